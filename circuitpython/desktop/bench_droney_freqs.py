@@ -0,0 +1,75 @@
+# bench_droney_freqs.py -- desktop benchmark of setting MyLittleDroney frequencies
+# part of https://github.com/todbot/qtpy_synth
+#
+# Times retuning every osc of a MyLittleDroney as the osc count grows (up
+# to synthio's MAX_SYNTH_NOTES), three ways:
+#   knobs -- set_voice_knobs(), table lookups (what dronesynth does)
+#   math  -- the old way, synthio.midi_to_hz() and a pow() per osc
+#   array -- set_all_notes(), one ulab (numpy here) op for all oscs
+# and checks all three give the same frequencies. On desktop Python, pow()
+# is a fast hardware op, so knobs and math come out about even here. The
+# tables are for the RP2040, where pow() is soft-float and slow.
+#
+#   python3 bench_droney_freqs.py [repeats]
+
+import sys
+import math
+import time
+
+import desktop_shims
+import synthio
+from my_little_droney import MyLittleDroney, SynthConfig, KnobTuning, knobval_to_note
+from qtpy_synth.synthio_instrument import MAX_SYNTH_NOTES
+import ulab.numpy as np
+
+repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 2000
+
+def old_set_voice(droney, n, valA, valB):
+    """what set_voice_knobs() used to cost: midi_to_hz plus a pow per extra osc"""
+    note = knobval_to_note(valA)
+    spread = 0.0001 + (valB / 255) * 2
+    f = synthio.midi_to_hz(note)
+    for osc in droney.voices[n]:
+        osc.frequency = f
+        f *= math.pow(2, spread / 12)
+
+def timeit(func):
+    t0 = time.perf_counter()
+    for r in range(repeats):
+        func(r)
+    return (time.perf_counter() - t0) / repeats * 1e6
+
+print("oscs  voices x oscs   knobs us   math us   array us   (per retune of all oscs)")
+for num_voices, oscs_per_voice in ((1,1), (2,1), (2,2), (4,2), (4,3), (6,2), (3,4)):
+    num_oscs = num_voices * oscs_per_voice
+    droney = MyLittleDroney(synthio.Synthesizer(), SynthConfig(), num_voices, oscs_per_voice,
+                            tuning=KnobTuning())
+
+    def knobs(r):
+        for n in range(num_voices):
+            droney.set_voice_knobs(n, (r + n * 10) % 256, 40)
+    def old(r):
+        for n in range(num_voices):
+            old_set_voice(droney, n, (r + n * 10) % 256, 40)
+    notes = np.zeros(num_oscs)
+    def array(r):
+        notes[:] = 36 + (r % 48)
+        droney.set_all_notes(notes)
+
+    t_knobs, t_old, t_array = timeit(knobs), timeit(old), timeit(array)
+    print("%4d  %6d x %d  %10.2f %9.2f %10.2f" %
+          (num_oscs, num_voices, oscs_per_voice, t_knobs, t_old, t_array))
+
+    # same frequencies from the tables as from the math, for whole-number knob vals
+    for valA in range(0, 256, 5):
+        droney.set_voice_knobs(0, valA, 40)
+        table_fs = [osc.frequency for osc in droney.voices[0]]
+        old_set_voice(droney, 0, valA, 40)
+        for tf, osc in zip(table_fs, droney.voices[0]):
+            assert abs(tf / osc.frequency - 1) < 1e-5, (valA, tf, osc.frequency)
+
+try:
+    MyLittleDroney(synthio.Synthesizer(), SynthConfig(), MAX_SYNTH_NOTES, 2)
+    print("FAIL: too many oscs wasn't caught")
+except ValueError as e:
+    print("too many oscs caught:", e)
@@ -0,0 +1,93 @@
+# bench_param_bank.py -- desktop benchmark of ParamScalerBank vs one ParamScaler per param
+# part of https://github.com/todbot/qtpy_synth
+#
+# Updates hundreds of params per "tick" from a moving knob, with a bank and
+# with a list of ParamScalers, checks SCALE mode gives the same values,
+# and times focus changes with save()/restore() (which shouldn't allocate).
+# Then checks restore() brings back pickup state too, not just values.
+#
+#   python3 bench_param_bank.py [num_params] [ticks]
+
+import sys
+import time
+import tracemalloc
+from array import array
+
+import desktop_shims
+from param_scaler import ParamScaler, ParamScalerBank, SCALE, PICKUP, JUMP
+
+num_params = int(sys.argv[1]) if len(sys.argv) > 1 else 400
+ticks = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+def knob_at(t):
+    """a knob going back and forth across its range"""
+    return abs((t * 7) % 510 - 255)
+
+def bench(name, update_all):
+    t0 = time.perf_counter()
+    for t in range(ticks):
+        update_all(knob_at(t))
+    dt = time.perf_counter() - t0
+    print("%-22s %8.1f us/tick  %6.3f us/param" %
+          (name, dt / ticks * 1e6, dt / ticks / num_params * 1e6))
+
+# same starting values for both
+starts = [(i * 37) % 256 for i in range(num_params)]
+
+scalers = [ParamScaler(v, knob_at(0)) for v in starts]
+def update_scalers(knob):
+    for s in scalers:
+        s.update(knob)
+
+bank = ParamScalerBank(num_params, mode=SCALE)
+for i,v in enumerate(starts):
+    bank.set(i, v, knob_at(0))
+def update_bank(knob):
+    for i in range(num_params):
+        bank.update(i, knob)
+
+print("%d params, %d ticks" % (num_params, ticks))
+bench("ParamScaler objects", update_scalers)
+bench("ParamScalerBank SCALE", update_bank)
+
+worst = max(abs(s.val - bank.vals[i]) for i,s in enumerate(scalers))
+print("SCALE mode max difference from ParamScaler: %g" % worst)
+assert worst < 1e-3, "bank SCALE mode doesn't match ParamScaler"
+
+for mode,name in ((PICKUP, "PICKUP"), (JUMP, "JUMP")):
+    bank = ParamScalerBank(num_params, mode=mode)
+    for i,v in enumerate(starts):
+        bank.set(i, v, knob_at(0))
+    bench("ParamScalerBank " + name, update_bank)
+
+# focus changes: save everything, restore it, refocus, like switching pads
+saved = array('f', [0] * bank.state_size())
+def switch_focus():
+    for t in range(ticks):
+        bank.save(saved)
+        bank.restore(saved)
+        bank.focus(t % num_params, knob_at(t))
+t0 = time.perf_counter()
+switch_focus()
+dt = time.perf_counter() - t0
+tracemalloc.start()  # timed without it, it slows every float made
+before = tracemalloc.get_traced_memory()[0]
+switch_focus()
+grew = tracemalloc.get_traced_memory()[0] - before
+tracemalloc.stop()
+print("save+restore+focus     %8.1f us each, heap grew %d bytes" % (dt / ticks * 1e6, grew))
+
+# restore() puts back knob positions & pickup state, so a picked up knob stays picked up
+bank = ParamScalerBank(2, mode=PICKUP)
+bank.set(0, 100, 50)
+bank.set(1, 200, 50)
+bank.update(0, 120)  # knob passes 100, picks up param 0
+assert bank.knob_match[0] and bank.vals[0] == 120
+saved = bank.save(array('f', [0] * bank.state_size()))
+bank.update(0, 30)
+bank.set(0, 10, 0)  # something else took over the param
+bank.restore(saved)
+assert bank.vals[0] == 120 and bank.last_knob_pos[0] == 120 and bank.knob_match[0]
+assert bank.update(0, 125) == 125, "restored param should still follow its knob"
+assert bank.update(1, 60) == 200 and not bank.knob_match[1], "param 1 wasn't picked up"
+print("full state save/restore ok")
@@ -0,0 +1,124 @@
+# bench_sequencer.py -- desktop benchmark of Sequencer step timing, jitter & drift
+# part of https://github.com/todbot/qtpy_synth
+#
+# Runs a Sequencer for 10,000 steps and reports how late steps were (jitter)
+# and how far the last step is from where it ideally is (drift). By default
+# time is simulated: each wait oversleeps by a random bit like asyncio.sleep()
+# does, with the odd long stall like a display refresh, so it runs in a
+# second. A naive "next = now + step" scheduler goes through the same waits
+# to show the drift it would build up. With "real", the Sequencer's own
+# run() task plays on real asyncio sleeps instead (that takes a while).
+# Then checks that steps follow a MidiClock, and start over with it after
+# a STOP and START.
+#
+#   python3 bench_sequencer.py [steps] [real]
+
+import sys
+import time
+import random
+import asyncio
+
+import desktop_shims
+from qtpy_synth.sequencer import Sequencer, Arpeggiator, Pattern, UP
+from qtpy_synth.midi_clock import MidiClock, PPQN
+
+num_steps = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+real = len(sys.argv) > 2 and sys.argv[2] == "real"
+
+MAX_JITTER_NS = 2_000_000   # asyncio.sleep() oversleeps up to this
+STALL_NS = 30_000_000       # a display refresh, now and then
+STALL_CHANCE = 0.01
+
+class CountingInst:
+    """Stands in for an Instrument, remembers when and what it played"""
+    def __init__(self):
+        self.ons = []
+    def note_on(self, note, vel=127):
+        self.ons.append(note)
+    def note_off(self, note, vel=0):
+        pass
+
+def oversleep():
+    ns = random.randrange(MAX_JITTER_NS)
+    if random.random() < STALL_CHANCE:
+        ns += STALL_NS
+    return ns
+
+def report(name, steps, max_late_ns, avg_late_ns, drift_ns, step_ns):
+    print("%-10s steps:%d  late avg:%6.3f max:%7.3f ms  drift:%9.3f ms (%.2f steps)" %
+          (name, steps, avg_late_ns / 1e6, max_late_ns / 1e6, drift_ns / 1e6, drift_ns / step_ns))
+
+def bench_simulated(bpm=140, steps_per_beat=4):
+    random.seed(1234)
+    arp = Arpeggiator(mode=UP, octaves=2)
+    for n in (48, 52, 55):
+        arp.press(n)
+    seq = Sequencer(CountingInst(), arp, bpm=bpm, steps_per_beat=steps_per_beat)
+    now = 1_000_000_000
+    seq.start(now)
+    while seq.steps < num_steps:
+        seq.update(now)
+        now += int(seq.time_to_next(now) * 1_000_000_000) + oversleep()
+    report("sequencer", seq.steps, seq.max_late_ns, seq.total_late_ns / seq.steps,
+           seq.drift_ns, seq.step_ns)
+    assert abs(seq.drift_ns) <= seq.max_late_ns  # no worse than one late step, doesn't add up
+
+    # same waits, but each step scheduled from when the last one happened
+    random.seed(1234)
+    step_ns = seq.step_ns
+    start = now = 1_000_000_000
+    next_ns = now
+    max_late = total_late = 0
+    for i in range(num_steps):
+        now = next_ns + oversleep()
+        late = now - next_ns
+        total_late += late
+        max_late = max(max_late, late)
+        next_ns = now + step_ns
+    report("naive", num_steps, max_late, total_late / num_steps,
+           now - (start + (num_steps - 1) * step_ns), step_ns)
+
+async def bench_real(bpm=600, steps_per_beat=4):
+    seq = Sequencer(CountingInst(), Pattern(16), bpm=bpm, steps_per_beat=steps_per_beat)
+    print("real time, %.1f ms steps, about %d s..." % (seq.step_ns / 1e6, num_steps * seq.step_ns // 1_000_000_000))
+    seq.start()
+    task = asyncio.create_task(seq.run())
+    while seq.steps < num_steps:
+        await asyncio.sleep(0.1)
+    task.cancel()
+    report("sequencer", seq.steps, seq.max_late_ns, seq.total_late_ns / seq.steps,
+           seq.drift_ns, seq.step_ns)
+
+def check_clock():
+    inst = CountingInst()
+    pattern = Pattern(4)
+    for i in range(4):
+        pattern.set(i, 60 + i)
+    clock = MidiClock()
+    seq = Sequencer(inst, pattern, steps_per_beat=4, clock=clock)
+    tick_ns = 60_000_000_000 // (120 * PPQN)
+    now = 1_000_000_000
+    seq.start(now)
+    clock.start()
+    def ticks(n):
+        nonlocal now
+        for i in range(n):
+            now += tick_ns
+            clock.tick(now)
+            seq.update(now)
+    ticks(PPQN * 2 - 1)  # two beats, a step every 6 ticks
+    assert inst.ons == [60, 61, 62, 63, 60, 61, 62, 63], inst.ons
+    ticks(3)  # half a step, then stop and start over
+    clock.stop()
+    inst.ons.clear()
+    clock.start()
+    seq.update(now)
+    ticks(PPQN - 1)
+    assert inst.ons == [60, 61, 62, 63], inst.ons  # back at the top, right away, no hole
+    print("clock sync & restart ok")
+
+if real:
+    asyncio.run(bench_real())
+else:
+    bench_simulated()
+check_clock()
@@ -0,0 +1,110 @@
+# desktop_shims.py -- run qtpy_synth code on desktop Python, for the benchmarks & tests here
+# part of https://github.com/todbot/qtpy_synth
+#
+# The library and apps import a few CircuitPython-only modules. This puts
+# stand-ins for them in sys.modules, so the same files can be imported and
+# timed on a desktop:
+#   micropython -- just const()
+#   ulab.numpy -- real numpy (pip install numpy)
+#   adafruit_wave -- the standard wave module, it has the same API
+#   synthio -- objects that only hold their attributes, no sound. Enough to
+#              time the Python side and check what gets set, not what's heard.
+# It also puts lib/ and the app directories on sys.path.
+#
+# Desktop CPython is much faster than an RP2040 and its heap is different,
+# so compare numbers between runs here, not with the board.
+#
+# Usage, first thing in a desktop script:
+#   import desktop_shims
+
+import os
+import sys
+import types
+import wave
+
+_here = os.path.dirname(os.path.abspath(__file__))
+_top = os.path.dirname(_here)
+for d in ('lib', 'dronesynth', 'wavesynth'):
+    sys.path.insert(0, os.path.join(_top, d))
+
+def _module(name, **attrs):
+    m = types.ModuleType(name)
+    m.__dict__.update(attrs)
+    sys.modules[name] = m
+    return m
+
+# micropython
+_module('micropython', const=lambda x: x)
+
+# ulab.numpy
+try:
+    import numpy
+except ImportError:
+    raise SystemExit("desktop_shims: needs numpy, 'pip install numpy'")
+_module('ulab', numpy=numpy)
+sys.modules['ulab.numpy'] = numpy
+
+# adafruit_wave
+_module('adafruit_wave', open=wave.open)
+
+# synthio
+class _Holder:
+    _defaults = {}
+    def __init__(self, *args, **kwargs):
+        self.__dict__.update(self._defaults)
+        self.__dict__.update(kwargs)
+        self.args = args
+
+class Note(_Holder):
+    _defaults = dict(frequency=440, amplitude=1, bend=0, waveform=None, envelope=None,
+                     filter=None, panning=0, waveform_loop_start=0, waveform_loop_end=16384)
+
+class LFO(_Holder):
+    _defaults = dict(rate=1, scale=1, offset=0, phase_offset=0, once=False, waveform=None,
+                     value=0)
+    def retrigger(self):
+        pass
+
+class Math(_Holder):
+    value = 0
+
+class MathOperation:
+    SUM, ADD_SUB, PRODUCT, CONSTRAINED_LERP, DIV, MAX, MIN, ABS, SCALE_OFFSET = range(9)
+
+class Envelope(_Holder):
+    _defaults = dict(attack_time=0.1, decay_time=0.05, release_time=0.2, attack_level=1,
+                     sustain_level=0.8)
+
+class Synthesizer:
+    """Keeps track of what's pressed, counts calls"""
+    def __init__(self, sample_rate=25600, channel_count=1):
+        self.sample_rate = sample_rate
+        self.pressed = set()
+        self.blocks = []
+        self.calls = 0
+
+    def press(self, notes):
+        self.change(press=notes)
+
+    def release(self, notes):
+        self.change(release=notes)
+
+    def change(self, release=(), press=(), retrigger=()):
+        self.calls += 1
+        for n in (release,) if isinstance(release, Note) else release:
+            self.pressed.discard(n)
+        for n in (press,) if isinstance(press, Note) else press:
+            self.pressed.add(n)
+
+    def low_pass_filter(self, frequency, q=0.7071):
+        return ('lpf', frequency, q)
+
+    def high_pass_filter(self, frequency, q=0.7071):
+        return ('hpf', frequency, q)
+
+    def band_pass_filter(self, frequency, q=0.7071):
+        return ('bpf', frequency, q)
+
+_module('synthio', Note=Note, LFO=LFO, Math=Math, MathOperation=MathOperation,
+        Envelope=Envelope, Synthesizer=Synthesizer, waveform_max_length=16384,
+        midi_to_hz=lambda n: 440 * 2 ** ((n - 69) / 12))
@@ -0,0 +1,100 @@
+# stress_granular.py -- desktop stress test of GranularInstrument at max density
+# part of https://github.com/todbot/qtpy_synth
+#
+# Runs the grain timer on simulated time with the density turned way past
+# what the pool can keep up with (so it's capped at max_density), a wavetable
+# as grain source, and several held notes, including float ones like
+# wavesynth's touch_midi_notes can be. After a warm-up, checks with
+# tracemalloc that spawning grains doesn't grow the heap (past a little
+# noise from CPython's free lists, it stays flat however long it runs), and
+# that there are never more grains going than the pool has Notes (no more
+# than MAX_SYNTH_NOTES). Then checks a ChannelRouter counts the grain pool
+# against its budget, not just the held notes.
+#
+#   python3 stress_granular.py [seconds] [num_grains]
+
+import sys
+import time
+import random
+import tracemalloc
+
+import desktop_shims
+import synthio
+from qtpy_synth.granular import GranularInstrument
+from qtpy_synth.midi_router import ChannelRouter
+from qtpy_synth.synthio_instrument import Patch, WaveType
+from qtpy_synth.synthio_instrument import MAX_SYNTH_NOTES
+
+seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 60
+num_grains = int(sys.argv[2]) if len(sys.argv) > 2 else MAX_SYNTH_NOTES
+TICK_NS = 2_000_000  # update() every 2 ms, like wavesynth does
+SLACK = 512  # bytes, CPython's float & int free lists wobble a bit, a leak per grain would be way more
+
+Patch.__repr__ = lambda self: "Patch('%s')" % self.name  # repr of the real one needs CircuitPython consts
+
+random.seed(1234)
+patch = Patch('grains')
+patch.wave_type = WaveType.WTB
+patch.wave_dir = '../wavesynth/wav'
+patch.wave = 'PLAITS02'
+patch.wave_mix_lfo_amount = 0.5  # spray
+patch.detune = 1.01              # pitch jitter
+synth = synthio.Synthesizer(sample_rate=28000)
+inst = GranularInstrument(synth, patch, num_grains=num_grains)
+inst.grain_time = 0.05
+inst.density = 10_000  # as fast as the pool allows
+inst.tick_budget = 1   # don't let a slow desktop drop grains, it's the heap we're after
+for n in (40, 48, 52.5, 55.25):
+    inst.note_on(n)
+
+now = time.monotonic_ns()  # note_on() has the first grain due now
+def run(ticks):
+    global now
+    for i in range(ticks):
+        now += TICK_NS
+        inst.update(now)
+
+tracemalloc.start()  # before warming up, so ints replaced later were tracked when made
+run(1000)  # warm up: every Note used, filter made, all the ints grown
+before = tracemalloc.take_snapshot()
+inst.reset_stats()
+run(int(seconds * 1_000_000_000 / TICK_NS))
+after = tracemalloc.take_snapshot()
+tracemalloc.stop()
+
+growth = sum(s.size_diff for s in after.compare_to(before, 'filename')
+             if 'tracemalloc' not in s.traceback[0].filename)
+inst.print_stats()
+print("%.0f s simulated, %d grains of %d samples, heap growth: %d bytes" %
+      (seconds, inst.spawned, inst.grain_size, growth))
+assert inst.spawned > 0.9 * seconds * inst.max_density, "didn't run at max density"
+assert inst.max_active <= len(inst.pool) <= MAX_SYNTH_NOTES
+assert growth < SLACK, "grains are allocating"
+
+# the router sees the grain pool: held notes are voices, the pool is the Notes they use
+router = ChannelRouter()
+grains = GranularInstrument(synth, patch, num_grains=8)
+router.add(grains, channels=(0,))
+others = GranularInstrument(synth, patch, num_grains=MAX_SYNTH_NOTES - 8)
+router.add(others, channels=(1,))
+router.note_on(0, 48)
+router.note_on(0, 52)  # a second note shares the pool, nothing stolen
+assert list(grains.voices) == [48, 52], grains.voices
+assert router.notes_used() == 8, router.notes_used()
+router.note_on(1, 60)
+assert router.notes_used() == MAX_SYNTH_NOTES and 60 in others.voices
+router.note_off(1, 60)
+router.add(GranularInstrument(synth, patch, num_grains=6), channels=(2,))
+router.note_on(2, 64)  # pool doesn't fit next to part 0's, and there's nothing of its own to steal
+assert router.part_for(2).inst.num_held == 0, "router let grains past synthio's notes"
+router.note_off(0, 48)
+router.note_off(0, 52)
+assert not grains.voices and grains.notes_used() == grains.active
+print("router counts grains ok")
+
+try:
+    GranularInstrument(synth, patch, num_grains=MAX_SYNTH_NOTES + 4)
+    assert False, "pool bigger than synthio's notes allowed"
+except ValueError as e:
+    print("too many grains caught:", e)
+print("ok")
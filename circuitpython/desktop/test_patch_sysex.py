@@ -0,0 +1,125 @@
+# test_patch_sysex.py -- desktop round trip of patches & waves through PatchSysex
+# part of https://github.com/todbot/qtpy_synth
+#
+# A "board" and an "editor" PatchSysex talk over fake MIDI ports that hand
+# out bytes a few at a time, like USB does. Checks a patch and full-size
+# (WAVE_CHUNK and longer) waves get across both ways unchanged, and that a
+# SysEx starting on one port while another port's is half read doesn't
+# lose either one, or stop the first port's other MIDI.
+#
+#   python3 test_patch_sysex.py
+
+import desktop_shims
+import ulab.numpy as np
+import qtpy_synth.winterbloom_smolmidi as smolmidi
+from qtpy_synth.midi_out import MidiOut
+from qtpy_synth.patch_sysex import PatchSysex, WAVE_CHUNK, SYSEX_ID, DEVICE_ID, WAVE_REQUEST, PATCH_REQUEST
+from qtpy_synth.synthio_instrument import Patch, Waves, WaveType, FiltType
+
+class FakePort:
+    """Bytes written in come out of readinto(), at most `trickle` at a time"""
+    def __init__(self, trickle=7):
+        self.data = bytearray()
+        self.trickle = trickle
+    def write(self, buf):
+        self.data.extend(buf)
+        return len(buf)
+    def readinto(self, buf):
+        n = min(len(buf), len(self.data), self.trickle)
+        buf[:n] = self.data[:n]
+        del self.data[:n]
+        return n
+
+def pump(midi_in, sysex):
+    """What wavesynth's midi_update() does, returns the non-sysex messages"""
+    got = []
+    for i in range(10_000):
+        sysex.update()
+        msg = midi_in.receive()
+        if msg is None:
+            if not midi_in._port.data and not midi_in._pending_end - midi_in._pending_pos:
+                sysex.update()
+                return got
+            continue
+        if msg.type == smolmidi.SYSEX:
+            sysex.handle(midi_in)
+        else:
+            got.append(msg)
+    raise AssertionError("never finished")
+
+to_board, to_editor = FakePort(), FakePort()
+board_wave = Waves.make_user(WAVE_CHUNK)
+board_patches = [Patch('one'), Patch('two')]
+board = PatchSysex(MidiOut(to_editor), board_patches, [board_wave])
+board_in = smolmidi.MidiIn(to_board)
+
+editor_wave = np.zeros(WAVE_CHUNK, dtype=np.int16)
+editor_patches = [Patch('x'), Patch('y')]
+editor = PatchSysex(MidiOut(to_board), editor_patches, [editor_wave])
+editor_in = smolmidi.MidiIn(to_editor)
+
+# patch: board -> editor, on request
+p = board_patches[1]
+p.wave_type, p.wave, p.waveB = WaveType.WTB, 'PLAITS02', 'BRAIDS01'
+p.wave_mix, p.detune, p.filt_type, p.filt_f, p.filt_q = 0.25, 1.01, FiltType.BP, 1234.5, 0.7
+p.amp_env_params.release_time = 0.75
+to_board.write(bytes((0xF0, SYSEX_ID, DEVICE_ID, PATCH_REQUEST, 1, 0xF7)))
+pump(board_in, board)
+pump(editor_in, editor)
+q = editor_patches[1]
+for attr in ('name', 'wave_type', 'wave', 'waveB', 'filt_type'):
+    assert getattr(q, attr) == getattr(p, attr), attr
+for attr in ('wave_mix', 'detune', 'filt_f', 'filt_q'):
+    assert abs(getattr(q, attr) - getattr(p, attr)) < 1e-5, attr
+assert abs(q.amp_env_params.release_time - 0.75) < 1e-6
+print("patch round trip ok")
+
+# full WAVE_CHUNK wave: editor -> board, then board -> editor on request
+editor_wave[:] = np.array([(i * 997) % 65536 - 32768 for i in range(WAVE_CHUNK)], dtype=np.int16)
+editor.send_wave(0)
+pump(board_in, board)
+assert (board_wave == editor_wave).all(), "wave to board"
+editor_wave[:] = 0
+req = bytearray((0xF0, SYSEX_ID, DEVICE_ID, WAVE_REQUEST, 0, 0, 0, 0, 0, 0, 0, 0xF7))  # wave 0, offset 0, count
+req[8:11] = bytes((WAVE_CHUNK & 0x7F, WAVE_CHUNK >> 7, 0))
+to_board.write(req)
+pump(board_in, board)
+pump(editor_in, editor)
+assert (board_wave == editor_wave).all(), "wave from board"
+print("%d sample wave round trip ok" % WAVE_CHUNK)
+
+# more than one chunk's worth goes as several messages
+big = np.array([i * 31 - 16000 for i in range(WAVE_CHUNK * 2 + 10)], dtype=np.int16)
+big_copy = np.zeros(len(big), dtype=np.int16)
+sender = PatchSysex(MidiOut(to_board), [], [None, big])  # it's wave 1 on the board too
+board.waves.append(big_copy)
+sender.send_wave(1)
+pump(board_in, board)
+assert (big_copy == big).all(), "multi-chunk wave"
+print("%d sample wave in chunks ok" % len(big))
+
+# a sysex starts on UART while a USB one is half read: both get through, USB keeps working
+uart = FakePort()
+uart_in = smolmidi.MidiIn(uart)
+board_wave[:] = 0
+editor_wave[:] = np.array([i * 100 - 12800 for i in range(WAVE_CHUNK)], dtype=np.int16)
+editor.send_wave(0)
+usb_msg = bytes(to_board.data)
+to_board.data[:] = usb_msg[:200]  # first part of the wave on USB
+board.update()
+for i in range(30):
+    board.update()
+    msg = board_in.receive()
+    if msg and msg.type == smolmidi.SYSEX:
+        board.handle(board_in)
+uart.write(bytes((0xF0, SYSEX_ID, DEVICE_ID, PATCH_REQUEST, 0, 0xF7)))
+pump(uart_in, board)  # UART's request gets answered while USB's wave is still coming
+to_editor.data.clear()
+to_board.write(usb_msg[200:])
+to_board.write(bytes((0x90, 60, 100)))  # and a note after it
+got = pump(board_in, board)
+assert (board_wave == editor_wave).all(), "USB wave lost"
+assert len(got) == 1 and got[0].type == smolmidi.NOTE_ON, "USB MIDI stopped"
+print("sysex on two ports at once ok")
+
+print("ok")
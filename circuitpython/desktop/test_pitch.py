@@ -0,0 +1,87 @@
+# test_pitch.py -- desktop check of qtpy_synth.pitch's tables against the exact formulas
+# part of https://github.com/todbot/qtpy_synth
+#
+# Sweeps fractional notes over (and past) the MIDI range, compares
+# midi_to_hz(), hz_to_midi() and the array versions with log/pow math,
+# and prints the worst error of each in cents. Then does the same for
+# tuning.Tuning's tables, and checks unmapped notes stay silent.
+#
+#   python3 test_pitch.py
+
+import math
+import numpy
+
+import desktop_shims
+from qtpy_synth.pitch import midi_to_hz, hz_to_midi, semitones_to_ratio, midi_to_hz_array, hz_to_midi_array
+from qtpy_synth.tuning import Tuning, KeyboardMap, EQUAL
+
+MAX_CENTS = 0.01  # worst error allowed, way under what anyone can hear
+
+def exact_hz(n):
+    return 440 * math.pow(2, (n - 69) / 12)
+
+def cents(f, f_exact):
+    return abs(1200 * math.log2(f / f_exact))
+
+notes = [n / 64 for n in range(-24 * 64, 150 * 64)]  # 1/64th semitone steps, C-3 to past G9
+
+worst = max(cents(midi_to_hz(n), exact_hz(n)) for n in notes)
+print("midi_to_hz         worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+worst = max(abs(hz_to_midi(exact_hz(n)) - n) * 100 for n in notes)
+print("hz_to_midi         worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+worst = max(abs(hz_to_midi(midi_to_hz(n)) - n) * 100 for n in notes)
+print("round trip         worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+worst = max(cents(semitones_to_ratio(s / 16), math.pow(2, s / 16 / 12)) for s in range(-24 * 16, 24 * 16))
+print("semitones_to_ratio worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+a = numpy.array(notes)
+fs = midi_to_hz_array(a)
+worst = max(cents(f, exact_hz(n)) for f, n in zip(fs, notes))
+print("midi_to_hz_array   worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+ns = hz_to_midi_array(numpy.array([exact_hz(n) for n in notes]))
+worst = max(abs(m - n) * 100 for m, n in zip(ns, notes))
+print("hz_to_midi_array   worst %.5f cents" % worst)
+assert worst < MAX_CENTS
+
+# no note for 0 Hz or less, like log() it's an error, not a hang
+for f in (0, -440, float('nan')):
+    try:
+        hz_to_midi(f)
+        assert False, "hz_to_midi(%s) didn't raise" % f
+    except ValueError:
+        pass
+print("hz_to_midi <= 0    ok")
+
+# a Tuning built from 12-TET ratios glides between its entries like 12-TET does
+table_tet = Tuning(ratios=[semitones_to_ratio(i) for i in range(1, 13)], name="12-TET table")
+in_range = [n for n in notes if 0 <= n <= 127]
+for name, tuning in (("EQUAL", EQUAL), ("12-TET table", table_tet)):
+    worst = max(cents(tuning.midi_to_hz(n), exact_hz(n)) for n in in_range)
+    print("Tuning %-12s worst %.5f cents" % (name, worst))
+    assert worst < MAX_CENTS
+
+# off the ends of a table, notes stay at the end notes, never go to 0 or below
+assert table_tet.midi_to_hz(-5.5) == table_tet.midi_to_hz(0)
+assert table_tet.midi_to_hz(140) == table_tet.midi_to_hz(127)
+
+# white keys only: black keys are silent, and white keys don't glide toward them
+kbm = KeyboardMap()
+kbm.size = 12
+kbm.octave_degree = 12
+kbm.mapping = [0, None, 2, None, 4, 5, None, 7, None, 9, None, 11]
+white = Tuning(kbm=kbm, name="white keys")
+assert white.midi_to_hz(61) == 0 and white.midi_to_hz(61.5) == 0
+assert white.midi_to_hz(60.5) == white.midi_to_hz(60)
+assert cents(white.midi_to_hz(64.5), exact_hz(64.5)) < MAX_CENTS  # E to F, both mapped
+print("Tuning unmapped    ok")
+
+print("ok")
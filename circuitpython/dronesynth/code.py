@@ -14,11 +14,14 @@
 #   - left pot A adjusts oscillator pair center frequency
 #   - right pot B adjusts oscillator frequency "spread" / "detune"
 #   - middle tact button mutes/unmutes the oscillator pair
+# - Hold tact button: other voices glide to pad 1's note
+# - Hold tact button, then:
+#   - tap a pad to glide to that pad's stored scene
+#   - hold a pad to store the current drone as that pad's scene
 #
 #
 
 import asyncio
-import time
 import random
 import synthio
 import usb_midi
@@ -27,10 +30,17 @@ import displayio, terminalio, vectorio
 from adafruit_display_text import bitmap_label as label
 
 from qtpy_synth.hardware import Hardware
-
-from param_scaler import ParamScaler
-from my_little_droney import (MyLittleDroney, SynthConfig,
-                              get_freqs_by_knobs, note_to_knobval, knobval_to_note)
+from qtpy_synth.input_events import KEY, KEY_HOLD, TOUCH, TOUCH_HOLD, KNOB
+from qtpy_synth.scheduler import Scheduler, PRIO_HIGH, PRIO_LOW
+from qtpy_synth.midi_clock import MidiClock
+from qtpy_synth.display_manager import DisplayManager
+from qtpy_synth.numeric_field import NumericField
+import qtpy_synth.winterbloom_smolmidi as smolmidi
+
+from param_scaler import ParamScalerBank
+from drone_scenes import DroneScenes
+from my_little_droney import MyLittleDroney, SynthConfig, KnobTuning, note_to_knobval
+from qtpy_synth.tuning import load_tuning
 
 import microcontroller
 microcontroller.cpu.frequency = 250_000_000  # overclock! vrrroomm
@@ -39,18 +49,30 @@ num_pads = 4
 oscs_per_pad = 2
 note_offset = 12
 note_range = 60
+scale = None  # or 'major', 'minor', 'pentatonic', etc to quantize pad notes
+tuning_scl = None  # Scala tuning file, like '/tunings/just.scl', None = 12-TET
+tuning_kbm = None  # Scala keyboard mapping file for it, optional
+voice_waves = ('saw', 'saw', 'saw', 'saw')  # or 'sin' or 'squ', per pad
 initial_vals = (note_to_knobval(36), note_to_knobval(48),
                 note_to_knobval(36), note_to_knobval(60))
 
 qts = Hardware()
 cfg = SynthConfig()
 
-droney = MyLittleDroney(qts.synth, cfg, num_pads, oscs_per_pad) #, initial_notes)
+tuning = KnobTuning(note_offset, note_range, scale,
+                    tuning = load_tuning(tuning_scl, tuning_kbm) if tuning_scl else None)
+droney = MyLittleDroney(qts.synth, cfg, num_pads, oscs_per_pad, voice_waves, tuning)
+
+# pitch LFOs follow external MIDI clock, if there is one
+midi_usb_in = smolmidi.MidiIn(usb_midi.ports[0])
+midi_uart_in = smolmidi.MidiIn(qts.midi_uart)
+midi_clock = MidiClock()
+midi_clock.add_target(droney.set_pitch_lfo_rate, beats=16)
 
 pad_num = None  # which pad is currently being touched
-voice_vals = []  # scaled knob vals per pad, index = pad number, val = [valA,valB]
-button_held = False
-button_held_time = 0
+# knob-controlled values 0-255: pad i's note is param i*2, its spread i*2+1, then global A & B
+params = ParamScalerBank(num_pads*2 + 2)
+globalA, globalB = num_pads*2, num_pads*2 + 1
 
 # -----------------------------
 
@@ -65,25 +87,22 @@ labels_pos = ( (5,5), (45,5),
                (115,5) # dronesynth logo vertical
               ) 
 disp_info = displayio.Group()
-for (x,y) in labels_pos:
-    disp_info.append( label.Label(terminalio.FONT, text="--", x=x, y=y) )
+for i,(x,y) in enumerate(labels_pos):
+    if i < 8:  # note & spread numbers per pad, only changed digits get redrawn
+        disp_info.append( NumericField(width=5, decimals=1, x=x, y=y) )
+    else:
+        disp_info.append( label.Label(terminalio.FONT, text="--", x=x, y=y) )
 disp_group.append(disp_info)
 disp_info[-1].text = "dronesynth"
 disp_info[-1].label_direction = "UPR"
+dispman = DisplayManager(qts.display)  # refresh display only when we say
 
 def display_update():
     for i in range(num_pads):
-        fstr = disp_info[i*2+0].text
-        dstr = disp_info[i*2+1].text
-        fstr_new = "%.1f" % knobval_to_note(voice_vals[i][0], note_offset, note_range)
-        dstr_new = "%.1f" % voice_vals[i][1]
-        if fstr_new != fstr:
-            disp_info[i*2+0].text = fstr_new
-        if dstr_new != dstr:
-            disp_info[i*2+1].text = dstr_new
-        onoff = "on" if droney.voices[i][0].amplitude else "--"
-        if disp_info[8+i].text != onoff:
-            disp_info[8+i].text = onoff
+        dispman.set_value(disp_info[i*2+0], tuning.note(params.vals[i*2]))
+        dispman.set_value(disp_info[i*2+1], params.vals[i*2+1])
+        onoff = "on" if droney.levels[i] else "--"
+        dispman.set_text(disp_info[8+i], onoff)
 
 
 # --------------------------------------------------------
@@ -93,23 +112,18 @@ def display_update():
 
 # set up the inital state of the voices
 for i in range(num_pads):
-    vs = [initial_vals[i], 0]
-    voice_vals.append(vs)
-    
+    params.set(i*2, initial_vals[i], knobA_val)
+    params.set(i*2+1, 0, knobB_val)
+
     # set up default freqs in droney
-    freqs = get_freqs_by_knobs(vs[0],vs[1], note_offset, note_range)
-    print("freqs:", freqs)
-    droney.set_voice_freqs(i, freqs)
+    droney.set_voice_knobs(i, params.vals[i*2], params.vals[i*2+1])
 
 # start with only two of the voices sounding
 droney.toggle_voice_mute(2)
 droney.toggle_voice_mute(3)
 
-scalerA = ParamScaler(voice_vals[0][0], knobA_val)
-scalerB = ParamScaler(voice_vals[0][1], knobB_val)
-
-globalA_val = knobA_val
-globalB_val = knobB_val
+params.set(globalA, knobA_val, knobA_val)
+params.set(globalB, knobB_val, knobB_val)
 
 display_update()
 
@@ -117,92 +131,119 @@ debug = False
 def dbg(*args,**kwargs):
     if debug: print(*args,**kwargs)
 
-while True:
-    time.sleep(0.001)
-
-    #droney.update()
-    
-    (knobA_val, knobB_val) = [v/256 for v in qts.read_pots()]
-    
-    # handle held touch pad
-    if pad_num is not None: 
-        
-        valA = scalerA.update(knobA_val) #, debug=True)
-        valB = scalerB.update(knobB_val)
-        
+print_sched_stats = False  # print loop timing stats every few seconds
+
+converge_time = 4  # seconds for voices to glide to pad 1's note when button is held
+scene_morph_time = 3  # seconds to glide to a recalled scene
+
+scenes = DroneScenes(num_pads, params, droney)  # one scene per pad
+
+def knobs_update(knobA_val, knobB_val):
+    """ Knobs moved, change the held pad's voice or the global params """
+    if pad_num is not None:
+        valA = params.update(pad_num*2, knobA_val)
+        valB = params.update(pad_num*2+1, knobB_val)
+
         dbg("knobA:%.1f knobB:%.1f  valA:%.1f  valB:%.1f" %
             (knobA_val, knobB_val, valA, valB))
 
-        freqs = get_freqs_by_knobs(valA, valB, note_offset, note_range)
-        droney.set_voice_freqs(pad_num, freqs)
-
-        voice_vals[touch.key_number] = [valA,valB]
-        display_update()
-        
+        droney.set_voice_knobs(pad_num, valA, valB)
     else:
-        globalA_val = scalerA.update(knobA_val)
-        globalB_val = scalerB.update(knobB_val) # , debug=True)
-        #dbg("global: %1.f %1.f" %(globalA_val, globalB_val))
+        globalA_val = params.update(globalA, knobA_val)
+        globalB_val = params.update(globalB, knobB_val)
         #droney.set_pitch_lfo_amount(knobB_val/255)
         #note_offset = (globalA_val/255) * 24
         f = 20 + (globalA_val/255) * 3000
-        droney.set_filter(f,None)
-
-    # handle pad press
-    if touches := qts.check_touch():
-        for touch in touches:
-            
-            if touch.pressed:
-                pad_num = touch.key_number
-                # restore vals for this pad 
-                lastA, lastB = voice_vals[pad_num]  
-                scalerA.reset(lastA, knobA_val)
-                scalerB.reset(lastB, knobB_val)
-
-            if touch.released:
+        droney.set_filter(f,None)  # only rebuilds filter if f changed
+
+def converge():
+    """ Glide the other voices to pad 1's note """
+    converge_valA = params.vals[0]
+    for i in range(1,num_pads):
+        params.vals[i*2] = converge_valA
+        droney.morph_voice(i, converge_valA, params.vals[i*2+1], droney.levels[i], converge_time)
+
+async def input_handler():
+    global pad_num
+    qts.hold_time = 1  # seconds button or pad is held before it counts as a hold
+    key_down = False
+    key_used = False  # button was used with a pad, so holding it isn't a converge
+    scene_pad = None  # pad pressed while button down, for scene store/recall
+    scene_stored = False
+    while True:
+        event = await qts.events.get()
+        knobA_val, knobB_val = qts.knobA/256, qts.knobB/256
+
+        if event.type == KNOB:
+            knobs_update(knobA_val, knobB_val)
+
+        # handle pad press
+        elif event.type == TOUCH:
+            if event.pressed and key_down and pad_num is None:
+                # button + pad tap = recall scene, button + pad hold = store scene
+                scene_pad = event.key_number
+                scene_stored = False
+                key_used = True
+            elif event.pressed:
+                pad_num = event.key_number
+                # knobs now control this pad's values
+                params.focus(pad_num*2, knobA_val)
+                params.focus(pad_num*2+1, knobB_val)
+            elif event.key_number == scene_pad:
+                if not scene_stored:
+                    print("recall scene", scene_pad, scenes.recall(scene_pad, scene_morph_time))
+                    params.focus(globalA, knobA_val)  # knobs are where they are now, not where they were when stored
+                    params.focus(globalB, knobB_val)
+                scene_pad = None
+            else:
                 pad_num = None
-                # restore the global vals
-                scalerA.reset(globalA_val, knobA_val)
-                scalerB.reset(globalB_val, knobB_val)
-
-    # handle tact button press
-    if key := qts.check_key():
-        if key.pressed:
-            print("button!")
-            button_held = True
-            button_held_time = time.monotonic()
-            droney.print_freqs()
-            if pad_num is not None: # pressing a pad toggles voice
-                droney.toggle_voice_mute(pad_num)
-
-            
-        if key.released:
-            button_held = False
-
-    # handle button held 
-    button_time_delta = time.monotonic() - button_held_time
-    if button_held and button_time_delta > 1:
-        dbg("drone freqs")
-        for i,vs in enumerate(voice_vals):
-            dbg("%d: " % i, end='')
-            for v in vs:
-               dbg("%.2f, " % v, end='')
-            dbg()
-
-
-        # if button is held, convert the notes to pad1 note
-        converge_valA, converge_valB = voice_vals[0]
-        cff = 0.05
-        for i in range(1,num_pads):
-            voice_vals[i][0] = cff*converge_valA + (1-cff)*voice_vals[i][0]
-            freqs = get_freqs_by_knobs(voice_vals[i][0], voice_vals[i][1], note_offset, note_range)
-            droney.set_voice_freqs(i, freqs)
-            display_update()
-            
-            
-
-
-
-
-
-                
+                # knobs go back to controlling the global vals
+                params.focus(globalA, knobA_val)
+                params.focus(globalB, knobB_val)
+
+        elif event.type == TOUCH_HOLD:
+            if event.key_number == scene_pad and key_down:
+                print("store scene", scene_pad)
+                scenes.store(scene_pad)
+                scene_stored = True
+
+        # handle tact button press
+        elif event.type == KEY:
+            key_down = event.pressed
+            if event.pressed:
+                print("button!")
+                droney.print_freqs()
+                key_used = pad_num is not None
+                if pad_num is not None: # pressing a pad toggles voice
+                    droney.toggle_voice_mute(pad_num)
+
+        elif event.type == KEY_HOLD:
+            if not key_used and pad_num is None:
+                dbg("drone freqs")
+                for i in range(num_pads):
+                    dbg("%d: %.2f, %.2f" % (i, params.vals[i*2], params.vals[i*2+1]))
+                converge()
+
+def midi_update():
+    while msg := midi_usb_in.receive() or midi_uart_in.receive():
+        midi_clock.handle(msg)
+
+def display_job():
+    display_update()  # only changed digits are redrawn
+    dispman.refresh()  # only if changed, and not too often
+
+# nothing here is busy-waiting: each job runs only as often as it needs to,
+# and knobs, pads & button are handled only when they do something
+sched = Scheduler()
+sched.add(midi_update, period=0.002, priority=PRIO_HIGH, deadline=0.005)
+sched.add(display_job, period=0.1, priority=PRIO_LOW, deadline=0.2)
+if print_sched_stats:
+    sched.add(sched.print_stats, period=5, priority=PRIO_LOW, name="stats")
+
+async def main():
+    task1 = asyncio.create_task(sched.run())
+    task2 = asyncio.create_task(input_handler())
+    task3 = asyncio.create_task(qts.input_task())
+    await asyncio.gather(task1, task2, task3)
+
+asyncio.run(main())
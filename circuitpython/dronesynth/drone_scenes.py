@@ -0,0 +1,59 @@
+# SPDX-FileCopyrightText: Copyright (c) 2024 Tod Kurt
+# SPDX-License-Identifier: MIT
+"""
+`drone_scenes`
+================================================================================
+
+`DroneScenes` stores snapshots ("scenes") of a drone: all the knob-controlled
+values in a `ParamScalerBank`, the filter frequency, and which voices are
+muted. Recalling a scene morphs the drone to it over a set time, using
+`MyLittleDroney.morph_voice()` so synthio does the gliding, not Python.
+
+Part of qtpy_synth.
+
+Example:
+
+  scenes = DroneScenes(4, params, droney)
+  scenes.store(0)
+  ...
+  scenes.recall(0, morph_time=3)
+
+"""
+
+from array import array
+
+class DroneScenes:
+    def __init__(self, num_scenes, params, droney):
+        """
+        params -- ParamScalerBank, pad i's note & spread are params i*2 & i*2+1
+        droney -- MyLittleDroney the scenes are of
+        """
+        self.params = params
+        self.droney = droney
+        num_voices = len(droney.voices)
+        # all preallocated, storing a scene doesn't allocate
+        self.states = [array('f', [0] * params.state_size()) for _ in range(num_scenes)]
+        self.filter_fs = array('f', [0] * num_scenes)
+        self.levels = [array('f', [0] * num_voices) for _ in range(num_scenes)]
+        self.stored = bytearray(num_scenes)
+
+    def store(self, n):
+        """ Save current drone state as scene n """
+        self.params.save(self.states[n])
+        self.filter_fs[n] = self.droney.cfg.filter_f
+        levels = self.levels[n]
+        for i,level in enumerate(self.droney.levels):
+            levels[i] = level
+        self.stored[n] = True
+
+    def recall(self, n, morph_time=2):
+        """ Morph drone to scene n over morph_time seconds, returns False if nothing stored there """
+        if not self.stored[n]:
+            return False
+        params, droney = self.params, self.droney
+        params.restore(self.states[n])
+        levels = self.levels[n]
+        for i in range(len(droney.voices)):
+            droney.morph_voice(i, params.vals[i*2], params.vals[i*2+1], levels[i], morph_time)
+        droney.set_filter(self.filter_fs[n], None)  # filter isn't block-rate, it changes right away
+        return True
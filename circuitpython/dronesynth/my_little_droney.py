@@ -10,10 +10,13 @@ Part of qtpy_synth.
 
 """
 
-import math
 import random
 import synthio
 import ulab.numpy as np
+from array import array
+from qtpy_synth.pitch import midi_to_hz, hz_to_midi, semitones_to_ratio, midi_to_hz_array
+from qtpy_synth.tuning import EQUAL
+from qtpy_synth.synthio_instrument import MAX_SYNTH_NOTES
 
 
 # set up some default synth parameters
@@ -25,9 +28,12 @@ wave_squ = np.concatenate((np.ones(wave_size // 2, dtype=np.int16) * wave_amp,
                            np.ones(wave_size // 2, dtype=np.int16) * -wave_amp))
 # default squ is too clippy, should be 3dB down or so?
 
-def hz_to_midi(f):
-    """ Convert Hz to MIDI note number float, synthio doesn't provide this """
-    return 12 * (math.log(f,2) - math.log(440,2)) + 69
+# one-shot LFO waveform that ramps from scale+offset down to offset, for glides & fades
+ramp_down = np.array((32767, 0), dtype=np.int16)
+
+def make_ramp(start, end):
+    """ A one-shot LFO that goes from start to end when retriggered, sits at end otherwise """
+    return synthio.LFO(waveform=ramp_down, once=True, scale=start-end, offset=end)
 
 def note_to_knobval(n, note_offset=12, note_range=60):
     """ Turn a midi note number into a 'knobval' (0-255 float) """
@@ -41,10 +47,67 @@ def get_freqs_by_knobs(valA,valB, note_offset=12, note_range=60):
     """ Create a list of frequencies based on two 0-255 inputs """
     n = knobval_to_note(valA, note_offset, note_range)
     d = 0.0001 + (valB / 255) * 2
-    f1 = synthio.midi_to_hz( n )
-    f2 = synthio.midi_to_hz( n + d )
+    f1 = midi_to_hz( n )
+    f2 = f1 * semitones_to_ratio( d )
     return (f1, f2)
 
+# scales for knob note quantizing, semitones from root
+scales = {
+    'chromatic': (0,1,2,3,4,5,6,7,8,9,10,11),
+    'major': (0,2,4,5,7,9,11),
+    'minor': (0,2,3,5,7,8,10),
+    'pentatonic': (0,3,5,7,10),
+    'fifths': (0,7),
+}
+
+def quantize_note(n, scale, root=0):
+    """ Nearest note to float note n that's in scale (a tuple of semitones) """
+    octave = (int(n) - root) // 12
+    best = None
+    for o in (octave-1, octave, octave+1):
+        for s in scale:
+            m = root + o*12 + s
+            if best is None or abs(m - n) < abs(best - n):
+                best = m
+    return best
+
+class KnobTuning:
+    """
+    Precomputed tables that turn knob vals (0-255) into notes and frequencies,
+    so moving a knob does no pow()/log(). On the RP2040 there's no FPU and those
+    are long soft-float routines, while a lookup and a multiply are cheap. (On
+    desktop Python, with hardware pow(), desktop/bench_droney_freqs.py has the
+    two about even.)
+    scale -- name from `scales` to quantize notes to, or None for no quantizing
+    tuning -- qtpy_synth.tuning.Tuning notes are turned into frequencies with, default 12-TET
+    """
+    size = 256
+    def __init__(self, note_offset=12, note_range=60, scale=None, root=0, max_spread=2, tuning=None):
+        self.quantized = scale is not None
+        self.tuning = tuning or EQUAL
+        self.notes = array('f', [0] * self.size)
+        self.freqs = array('f', [0] * self.size)
+        self.spreads = array('f', [0] * self.size)  # freq ratio between oscs in a voice
+        # same things as 12-TET note numbers, for bends & glides, so they don't need hz_to_midi()
+        self.pitches = array('f', [0] * self.size)
+        self.spread_notes = array('f', [0] * self.size)
+        for i in range(self.size):
+            n = knobval_to_note(i, note_offset, note_range)
+            if scale:
+                n = quantize_note(n, scales[scale], root)
+            self.notes[i] = n
+            self.freqs[i] = self.tuning.midi_to_hz(n)
+            self.pitches[i] = hz_to_midi(self.freqs[i]) if self.tuning is not EQUAL and self.freqs[i] else n
+            d = 0.0001 + (i / 255) * max_spread
+            self.spreads[i] = semitones_to_ratio(d)
+            self.spread_notes[i] = d
+
+    def index(self, val):
+        return min(max(int(val), 0), self.size-1)
+
+    def note(self, valA):
+        return self.notes[self.index(valA)]
+
 def get_wave(wave_type):
     if wave_type=='sin': return wave_sin
     if wave_type=='squ': return wave_squ
@@ -77,25 +140,86 @@ class SynthConfig():
 class MyLittleDroney():
     """
     Drone Synth
+    wave_types -- list of wave type per voice, defaults to synth_config.wave_type for all
+    tuning -- a KnobTuning for set_voice_knobs(), defaults to unquantized 12-72
+    num_voices * oscs_per_voice can't be more than synthio plays at once (MAX_SYNTH_NOTES),
+    a Synthesizer only has that many channels, so dozens of oscs need more synths
     """
-    def __init__(self, synth, synth_config, num_voices, oscs_per_voice):
+    def __init__(self, synth, synth_config, num_voices, oscs_per_voice, wave_types=None, tuning=None):
+        if num_voices * oscs_per_voice > MAX_SYNTH_NOTES:  # synthio would silently drop the rest
+            raise ValueError("%d voices x %d oscs is more than synthio's %d notes" %
+                             (num_voices, oscs_per_voice, MAX_SYNTH_NOTES))
         self.voices = []
+        self.pitch_lfos = []  # wobbly pitch of each osc
+        self.glides = []  # per osc, one-shot bend ramp for morphing pitch
+        self.fades = []  # per voice, one-shot amplitude ramp for morphing level
+        self.levels = [1] * num_voices  # level each voice is at or going to
         self.synth = synth
         self.cfg = synth_config
+        self.tuning = tuning or KnobTuning()
+        # for morph_voice(): knob vals of voices set by set_voice_knobs(), 12-TET note of each osc otherwise
+        self.knobs = array('f', [127] * (num_voices * 2))
+        self.by_knobs = bytearray([1] * num_voices)
+        self.pitches = array('f', [0] * (num_voices * oscs_per_voice))
+        self.filter = make_filter(self.synth, self.cfg)  # one filter shared by all oscs
+        wave_types = wave_types or [self.cfg.wave_type] * num_voices
+        f = self.tuning.freqs[127]  # fake value
         for i in range(num_voices):
+            wave = get_wave(wave_types[i])
+            fade = make_ramp(1, 1)
+            self.fades.append(fade)
             oscs = []
-            freqs = get_freqs_by_knobs(127,0)  # fake values
-            wave = get_wave(self.cfg.wave_type)
-            
             for j in range(oscs_per_voice):
-                f = freqs[j]
                 pitch_lfo = synthio.LFO(rate=0.1, scale=0.01, phase_offset=random.uniform(0,1))
-                osc = synthio.Note(frequency=f, waveform=wave,
-                                   bend=pitch_lfo,
-                                   filter = make_filter(self.synth,self.cfg))
-                synth.press(osc)
-                oscs.append(osc)
+                glide = make_ramp(0, 0)
+                self.pitch_lfos.append(pitch_lfo)
+                self.glides.append(glide)
+                # bend is pitch wobble plus glide, synthio adds them up for us
+                bend = synthio.Math(synthio.MathOperation.SUM, pitch_lfo, glide, 0)
+                oscs.append(synthio.Note(frequency=f, waveform=wave,
+                                         bend=bend, amplitude=fade,
+                                         filter = self.filter))
             self.voices.append(oscs)
+        self.oscs = [osc for voice in self.voices for osc in voice]
+        self.oscs_per_voice = oscs_per_voice
+        synth.press(tuple(self.oscs))  # start them all at once, not one by one
+
+    def set_voice_knobs(self,n,valA,valB):
+        """
+        Set voice n's notes from knob vals, valA = note, valB = spread.
+        Both must be 0-255 (as ParamScaler gives them), they're table indexes and not checked.
+        """
+        tuning = self.tuning
+        i = int(valA)
+        freqs = tuning.freqs
+        f = freqs[i]
+        if not tuning.quantized and i < 255:  # glide between table entries
+            f += (valA - i) * (freqs[i+1] - f)
+        spread = tuning.spreads[int(valB)]
+        for osc in self.voices[n]:
+            osc.frequency = f
+            f *= spread
+        # just the knob vals, morph_voice() works out osc notes from them only if it needs them
+        self.knobs[n*2] = valA
+        self.knobs[n*2+1] = valB
+        self.by_knobs[n] = 1
+
+    def osc_note(self, n, j):
+        """ 12-TET note number voice n's osc j is tuned to, not counting bends """
+        if not self.by_knobs[n]:
+            return self.pitches[n * self.oscs_per_voice + j]
+        tuning = self.tuning
+        valA = self.knobs[n*2]
+        i = tuning.index(valA)
+        p = tuning.pitches[i]
+        if not tuning.quantized and i < tuning.size-1:
+            p += (valA - i) * (tuning.pitches[i+1] - p)
+        return p + j * tuning.spread_notes[tuning.index(self.knobs[n*2+1])]
+
+    def set_voice_wave(self,n,wave_type):
+        wave = get_wave(wave_type)
+        for osc in self.voices[n]:
+            osc.waveform = wave
 
     # def update(self):
     #     for voice in self.voices:
@@ -103,22 +227,62 @@ class MyLittleDroney():
     #             osc.filter = make_filter(self.synth,self.cfg)
                 
     def set_voice_freqs(self,n,freqs):
+        j = n * self.oscs_per_voice
         for i,osc in enumerate(self.voices[n]):
             osc.frequency = freqs[i]
+            self.pitches[j+i] = hz_to_midi(freqs[i])
+        self.by_knobs[n] = 0
 
     def set_voice_notes(self,n,notes):
-        freqs = [synthio.midi_to_hz(n) for n in notes]
+        midi_to_hz = self.tuning.tuning.midi_to_hz  # the knob tuning's note tuning
+        j = n * self.oscs_per_voice
         for i,osc in enumerate(self.voices[n]):
-            osc.frequency = freqs[i]
+            osc.frequency = midi_to_hz(notes[i])
+            self.pitches[j+i] = notes[i]  # close enough for glides in non-12-TET tunings
+        self.by_knobs[n] = 0
+
+    def set_all_notes(self,notes):
+        """ Retune every osc at once, notes is a ulab array with a float note per osc """
+        for osc,f in zip(self.oscs, midi_to_hz_array(notes)):
+            osc.frequency = f
+        for j in range(len(self.oscs)):
+            self.pitches[j] = notes[j]
+        for n in range(len(self.voices)):
+            self.by_knobs[n] = 0
         
     def set_voice_level(self,n,level):
-        for osc in self.voices[n]:
-            osc.amplitude = level
+        fade = self.fades[n]
+        fade.offset = level
+        fade.scale = 0
+        self.levels[n] = level
 
     def toggle_voice_mute(self,n):
         # fixme: what about other levels than 0,1
-        for osc in self.voices[n]:
-            osc.amplitude = 0 if osc.amplitude > 0 else 1
+        self.set_voice_level(n, 0 if self.levels[n] > 0 else 1)
+
+    def morph_voice(self,n,valA,valB,level,time):
+        """
+        Glide voice n to new knob vals (like set_voice_knobs()) and level over `time` seconds.
+        The gliding is done by one-shot LFOs on bend & amplitude, so it costs no Python
+        after this, and its timing doesn't depend on how busy the CPU is.
+        """
+        rate = 1 / max(time, 0.001)
+        first = n * self.oscs_per_voice
+        glides = self.glides
+        # where each osc is right now, including any glide in progress
+        old_notes = [self.osc_note(n, j) + glides[first+j].value * 12 for j in range(self.oscs_per_voice)]
+        self.set_voice_knobs(n, valA, valB)
+        for j in range(self.oscs_per_voice):
+            glide = glides[first+j]
+            glide.scale = (old_notes[j] - self.osc_note(n, j)) / 12  # octaves away from new freq, ramps to 0
+            glide.rate = rate
+            glide.retrigger()
+        fade = self.fades[n]
+        fade.scale = fade.value - level
+        fade.offset = level
+        fade.rate = rate
+        fade.retrigger()
+        self.levels[n] = level
 
     def print_freqs(self):
         for i in range(len(self.voices)):
@@ -129,15 +293,22 @@ class MyLittleDroney():
             print()
             
     def set_pitch_lfo_amount(self,n):
-        for voice in self.voices:
-            for osc in voice:
-                osc.bend.scale = n
-        
+        for lfo in self.pitch_lfos:
+            lfo.scale = n
+
+    def set_pitch_lfo_rate(self,rate):
+        for lfo in self.pitch_lfos:
+            lfo.rate = rate
+
     def set_filter(self,f,q):
+        """ Change filter freq and/or q, only rebuilds the filter if they changed """
+        q = q if q else self.cfg.filter_q
+        if f == self.cfg.filter_f and q == self.cfg.filter_q:
+            return False
         self.cfg.filter_f = f
-        self.cfg.filter_q = q if q else self.cfg.filter_q
+        self.cfg.filter_q = q
+        self.filter = make_filter(self.synth, self.cfg)
         for voice in self.voices:
             for osc in voice:
-                osc.filter = make_filter(self.synth, self.cfg)
-
-        
+                osc.filter = self.filter
+        return True
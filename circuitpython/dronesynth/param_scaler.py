@@ -14,6 +14,9 @@ move in sync with the knob.  The value will always decrease/increase
 in the same direction as the knob.
 This mirrors how the Deluge synth's "SCALE" mode works.
 
+`ParamScalerBank` does the same for many parameters at once, in arrays,
+with "PICKUP" and "JUMP" modes too.
+
 Part of synth_tools.
 
 Example:
@@ -33,6 +36,7 @@ Example:
        
 """
 
+from array import array
 #from micropython import const
 
 #knob_min, knob_max = const(0), const(255) 
@@ -94,3 +98,113 @@ class ParamScaler:
         self.val = min(max(self.val + val_change, val_min), val_max)
         return self.val
 
+
+
+SCALE = 0   # ParamScaler behavior, value moves in knob's direction by remaining runway
+PICKUP = 1  # value doesn't change until knob passes through it, then follows knob
+JUMP = 2    # value is knob position, right away
+
+class ParamScalerBank:
+    """
+    Knob scaling for a bunch of parameters at once, like one ParamScaler per param
+    but with everything kept in a few compact arrays instead of an object each.
+
+    Each param has its own mode (SCALE, PICKUP, or JUMP).
+    When a knob starts controlling a different param, call focus() with
+    the knob's current position. Values aren't lost, so switching back and
+    forth doesn't make them jump. save() and restore() copy every param's
+    state (value, last knob position, picked-up or not) in/out of an
+    array you hand it, so nothing is allocated.
+
+    Example:
+
+      bank = ParamScalerBank(10)  # 8 per-pad params + 2 global
+      bank.focus(3, knob_pos)  # knob now controls param 3
+      while True:
+          val = bank.update(3, knob_pos)
+    """
+    def __init__(self, num_params, mode=SCALE, dead_zone=1):
+        self.num_params = num_params
+        self.vals = array('f', [0] * num_params)
+        self.last_knob_pos = array('f', [0] * num_params)
+        self.knob_match = bytearray(num_params)
+        self.modes = bytearray([mode] * num_params)
+        self.dead_zone = dead_zone
+
+    def set(self, i, val, knob_pos=None):
+        """ Set param i's value, e.g. when loading a new value """
+        self.vals[i] = val
+        if knob_pos is not None:
+            self.last_knob_pos[i] = knob_pos
+        self.knob_match[i] = False
+
+    def focus(self, i, knob_pos):
+        """ A knob starts controlling param i, it's now at knob_pos """
+        self.last_knob_pos[i] = knob_pos
+        self.knob_match[i] = False
+
+    def update(self, i, knob_pos):
+        """ Update param i from a knob, returns its new value """
+        # called for every param every knob tick, so no min()/max() and globals read once
+        kmin, kmax, vmin, vmax = knob_min, knob_max, val_min, val_max
+        if knob_pos < kmin:
+            knob_pos = kmin
+        elif knob_pos > kmax:
+            knob_pos = kmax
+        last_knob_positions = self.last_knob_pos
+        last_knob_pos = last_knob_positions[i]
+        knob_delta = knob_pos - last_knob_pos
+        val = self.vals[i]
+        dead_zone = self.dead_zone
+        if -dead_zone < knob_delta < dead_zone:
+            return val
+        last_knob_positions[i] = knob_pos
+        mode = self.modes[i]
+
+        if mode == SCALE:  # same as ParamScaler.update()
+            if knob_delta > dead_zone and knob_pos != kmax:
+                val += knob_delta * (vmax - val) / (kmax - knob_pos)
+            elif knob_delta < -dead_zone and knob_pos != kmin:
+                val += knob_delta * (val - vmin) / (knob_pos - kmin)
+            if val > vmax:
+                val = vmax
+            elif val < vmin:
+                val = vmin
+        elif mode == JUMP:
+            val = knob_pos
+        else:  # PICKUP
+            # picked up when knob gets close or passes over value
+            if (not self.knob_match[i] and (-dead_zone <= knob_pos - val <= dead_zone or
+                                           (last_knob_pos - val) * (knob_pos - val) < 0)):
+                self.knob_match[i] = True
+            if self.knob_match[i]:
+                val = knob_pos
+
+        self.vals[i] = val
+        return val
+
+    def state_size(self):
+        """ Length of the array('f') save() and restore() need """
+        return self.num_params * 3
+
+    def save(self, buf):
+        """
+        Copy every param's state into buf, an array('f') of state_size():
+        values, then last knob positions, then whether knobs had picked them up
+        """
+        n = self.num_params
+        vals, last_knob_pos, knob_match = self.vals, self.last_knob_pos, self.knob_match
+        for i in range(n):
+            buf[i] = vals[i]
+            buf[n+i] = last_knob_pos[i]
+            buf[n*2+i] = knob_match[i]
+        return buf
+
+    def restore(self, buf):
+        """ Put back state from save(), focus() afterwards if the knobs have moved since """
+        n = self.num_params
+        vals, last_knob_pos, knob_match = self.vals, self.last_knob_pos, self.knob_match
+        for i in range(n):
+            vals[i] = buf[i]
+            last_knob_pos[i] = buf[n+i]
+            knob_match[i] = int(buf[n*2+i])
@@ -0,0 +1,90 @@
+# qtpy_synth.display_manager.py -- refresh the OLED only when and how often we say
+# part of https://github.com/todbot/qtpy_synth
+#
+# With displayio's auto_refresh, changing a label's text can start an I2C
+# transfer to the display at any moment, right when the synth needs the CPU.
+# DisplayManager turns auto_refresh off, keeps track of whether anything
+# changed, and refreshes only when refresh() is called from a quiet spot in
+# the app, no faster than max_fps.
+#
+# If a refresh takes longer than `budget` seconds, following frames are
+# skipped to keep the average display time per frame within budget.
+# Call busy() when the synth is doing something timing sensitive (like
+# starting notes) to hold off refreshes for a little while.
+#
+# Example:
+#   dispman = DisplayManager(qts.display)
+#   dispman.set_text(my_label, "hello")  # marks display dirty if text changed
+#   while True:
+#       dispman.refresh()  # only refreshes if dirty, not busy, and it's time
+
+import time
+
+class DisplayManager:
+    def __init__(self, display, max_fps=10, budget=0.03, max_wait=0.5):
+        """
+        max_fps -- refreshes per second at most
+        budget -- seconds one refresh is allowed to take on average
+        max_wait -- longest time busy() may hold off a dirty display
+        """
+        self.display = display
+        display.auto_refresh = False
+        self.max_fps = max_fps
+        self.frame_ns = int(1_000_000_000 / max_fps)
+        self.budget_ns = int(budget * 1_000_000_000)
+        self.max_wait_ns = int(max_wait * 1_000_000_000)
+        self.dirty = True  # so first refresh shows what's been set up
+        self.frames = 0    # refreshes done
+        self.skipped = 0   # refreshes held off because busy or over budget
+        self.last_refresh_ms = 0  # how long the last refresh took
+        self._next_ns = 0
+        self._busy_until_ns = 0
+        self._dirty_since_ns = 0
+
+    def mark_dirty(self):
+        if not self.dirty:
+            self.dirty = True
+            self._dirty_since_ns = time.monotonic_ns()
+
+    def set_text(self, label, text):
+        """Set a label's text, only if it changed. Returns True if it did"""
+        if label.text == text:
+            return False
+        label.text = text
+        self.mark_dirty()
+        return True
+
+    def set_value(self, field, val):
+        """Set a NumericField's value, marks display dirty if it changed"""
+        if field.set_value(val):
+            self.mark_dirty()
+            return True
+        return False
+
+    def busy(self, duration=0.05):
+        """Synth is busy, don't refresh for the next `duration` seconds"""
+        self._busy_until_ns = time.monotonic_ns() + int(duration * 1_000_000_000)
+
+    def refresh(self, now=None):
+        """Refresh the display if it needs it and it's a good time, returns True if it did"""
+        if not self.dirty:
+            return False
+        now = now or time.monotonic_ns()
+        if now < self._next_ns:
+            return False
+        if now < self._busy_until_ns and now - self._dirty_since_ns < self.max_wait_ns:
+            self.skipped += 1
+            return False
+        t = time.monotonic_ns()
+        self.display.refresh(minimum_frames_per_second=0)
+        took_ns = time.monotonic_ns() - t
+        self.dirty = False
+        self.frames += 1
+        self.last_refresh_ms = took_ns / 1_000_000
+        # over budget? skip enough frames to make up for it
+        frames = 1
+        if took_ns > self.budget_ns:
+            frames += took_ns // self.budget_ns
+            self.skipped += frames - 1
+        self._next_ns = now + frames * self.frame_ns
+        return True
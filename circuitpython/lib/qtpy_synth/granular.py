@@ -0,0 +1,274 @@
+# qtpy_synth.granular.py -- granular synthesis from wavetable or sample data
+# part of https://github.com/todbot/qtpy_synth
+#
+# While notes are held, GranularInstrument keeps spawning short "grains":
+# a snippet of the source (one wavetable frame, or grain_size samples of a
+# sample) played at a held note's pitch under a rise-and-fall envelope.
+# Each grain gets its own position (patch.wave_mix, sprayed randomly by
+# patch.wave_mix_lfo_amount), pitch (jittered by patch.detune) and envelope
+# (one of a few lengths around grain_time).
+#
+# Nothing is made per grain: there's a fixed pool of synthio.Notes, each
+# with its own waveform buffer, made up front. A grain takes a free Note,
+# copies its snippet into that Note's buffer, and presses it. update() is
+# the only timer: it releases grains, frees finished ones, and spawns new
+# ones when they're due, so call it often from one task (or run run()).
+#
+# Every sounding grain is a voice synthio has to mix, so the pool size is
+# the CPU budget: density is capped at what the pool can keep going, and
+# update() stops spawning for a tick if it's taken more than tick_budget.
+# Held notes are in `voices` like other Instruments, but notes_used() is
+# the grain pool, so a ChannelRouter counts the Notes grains really take.
+#
+# Example:
+#   inst = GranularInstrument(synth, patch, num_grains=8)
+#   inst.density = 40       # grains per second
+#   inst.grain_time = 0.08  # seconds, envelope rise + fall
+#   inst.note_on(48)
+#   while True:
+#       inst.update()
+
+import time
+import random
+import asyncio
+import synthio
+from micropython import const
+import ulab.numpy as np
+
+from qtpy_synth.synthio_instrument import Instrument, Waves, WaveType, FiltType, MAX_SYNTH_NOTES
+
+NUM_ENVS = const(4)    # grain envelope lengths to pick from, 0.5x - 1.5x grain_time
+_FREE = const(0)
+_ON = const(1)         # pressed, rising
+_RELEASED = const(2)   # falling, Note not free until it's done
+_MARGIN_NS = const(10_000_000)  # extra time after release before reusing a Note
+
+class GranularInstrument(Instrument):
+    def __init__(self, synth, patch, num_grains=8, grain_size=256, max_held=8):
+        """
+        num_grains -- size of the Note pool, the most grains that can sound at once,
+          no more than synthio can play (MAX_SYNTH_NOTES)
+        grain_size -- samples in each grain's waveform, a wavetable frame is 256
+        """
+        if num_grains > MAX_SYNTH_NOTES:  # synthio would silently drop the extra grains
+            raise ValueError("%d grains is more than synthio's %d notes" % (num_grains, MAX_SYNTH_NOTES))
+        super().__init__(synth, patch)
+        self.grain_size = grain_size
+        self.bufs = [np.zeros(grain_size, dtype=np.int16) for _ in range(num_grains)]
+        self.pool = [synthio.Note(frequency=440, waveform=b) for b in self.bufs]
+        self.states = bytearray(num_grains)
+        self._off_ns = [0] * num_grains   # when to release each grain
+        self._free_ns = [0] * num_grains  # when each grain's Note can be used again
+        self._slot = 0
+        self.held = [0] * max_held  # a list, not bytearray, notes can be floats
+        self.num_held = 0
+        self._held_pos = 0
+        self.active = 0  # grains sounding, as of the last update()
+        self.level = 0.5   # grain amplitude, lower it if many overlap
+        self.tick_budget = 0.002  # seconds of spawning per update() at most
+        self._density = 30
+        self._grain_time = 0.08
+        self._envs = []
+        self._attack_ns = [0] * NUM_ENVS
+        self._next_ns = 0
+        self._filt_type = self._filt_f = self._filt_q = None
+        self.filter = None
+        self.waveform = self.bufs[0]  # latest grain, for showing on a scope
+        self.reset_stats()
+        self._make_envs()
+        self.load_patch(patch)
+
+    def load_patch(self, patch):
+        """Use patch's wavetable (or oscillator wave) as grain source"""
+        self.patch = patch
+        if patch.wave_type == WaveType.WTB:
+            path = patch.wave_dir + "/" + patch.wave + ".WAV"
+            self.set_source(Waves.wav(path, Waves.wav_info(path)[0]))  # all of it, into RAM
+        else:
+            self.set_source(Waves.make_waveform(patch.wave, size=self.grain_size))
+        self._filt_type = None  # remake filter on next update
+
+    def reload_patch(self):
+        self.load_patch(self.patch)
+
+    def set_source(self, src, sample_rate=None, num_frames=None):
+        """
+        src -- int16 array grains come from
+        sample_rate -- None if src is wavetable frames of grain_size, grains are
+          whole frames played at note pitch. Otherwise src is a sample, grains
+          start anywhere and play at the sample's speed at patch.sample_note.
+        """
+        self.src = src
+        self.sample_rate = sample_rate
+        self.src_len = num_frames or len(src)
+
+    @property
+    def grain_time(self):
+        return self._grain_time
+
+    @grain_time.setter
+    def grain_time(self, t):
+        self._grain_time = t
+        self._make_envs()
+
+    def _make_envs(self):
+        """The grain envelopes, remade only when grain_time changes"""
+        self._envs.clear()
+        for i in range(NUM_ENVS):
+            half = self._grain_time * (0.5 + i / (NUM_ENVS - 1)) / 2
+            self._envs.append(synthio.Envelope(attack_time=half, decay_time=0, sustain_level=1,
+                                               release_time=half))
+            self._attack_ns[i] = int(half * 1_000_000_000)
+        self.density = self._density  # new cap
+
+    @property
+    def max_density(self):
+        """Grains per second the pool can keep up with at the longest envelope"""
+        return len(self.pool) / (self._grain_time * 1.5)
+
+    @property
+    def density(self):
+        return self._density
+
+    @density.setter
+    def density(self, d):
+        self._density = d
+        self._interval_ns = int(1_000_000_000 / max(min(d, self.max_density), 0.1))
+
+    def note_on(self, midi_note, midi_vel=127):
+        if midi_note in self.held[:self.num_held] or self.num_held == len(self.held):
+            return
+        if not self.tuning.midi_to_hz(midi_note):  # not in this tuning's keyboard map
+            return
+        if self.num_held == 0:
+            self._next_ns = time.monotonic_ns()  # first grain right away
+        self.held[self.num_held] = midi_note
+        self.num_held += 1
+        self.voices[midi_note] = None  # no Notes of its own, grains come from the pool
+
+    def note_off(self, midi_note, midi_vel=0):
+        held = self.held
+        for i in range(self.num_held):
+            if held[i] == midi_note:
+                for j in range(i, self.num_held - 1):
+                    held[j] = held[j+1]
+                self.num_held -= 1
+                self.voices.pop(midi_note)
+                return
+
+    def note_off_all(self):
+        self.num_held = 0  # grains playing now just finish
+        self.voices.clear()
+
+    def notes_used(self, num_voices=None):
+        """The whole pool while notes are held, it fills up with grains, after that what's still sounding"""
+        if num_voices is None:
+            num_voices = self.num_held
+        return len(self.pool) if num_voices else self.active
+
+    def reset_stats(self):
+        self.spawned = 0
+        self.dropped = 0     # grains due that didn't fit in the pool or the tick budget
+        self.max_active = 0
+
+    def _update_filter(self):
+        patch = self.patch
+        if (patch.filt_type == self._filt_type and patch.filt_f == self._filt_f
+                and patch.filt_q == self._filt_q):
+            return
+        self._filt_type, self._filt_f, self._filt_q = patch.filt_type, patch.filt_f, patch.filt_q
+        if patch.filt_type == FiltType.HP:
+            self.filter = self.synth.high_pass_filter(patch.filt_f, patch.filt_q)
+        elif patch.filt_type == FiltType.BP:
+            self.filter = self.synth.band_pass_filter(patch.filt_f, patch.filt_q)
+        else:
+            self.filter = self.synth.low_pass_filter(patch.filt_f, patch.filt_q)
+
+    def update(self, now=None):
+        """The grain timer: release, free, and spawn grains that are due"""
+        now = now or time.monotonic_ns()
+        self._update_filter()
+        states = self.states
+        active = 0
+        for i in range(len(states)):
+            state = states[i]
+            if state == _ON and now >= self._off_ns[i]:
+                self.synth.release(self.pool[i])
+                states[i] = state = _RELEASED
+            if state == _RELEASED and now >= self._free_ns[i]:
+                states[i] = state = _FREE
+            if state != _FREE:
+                active += 1
+        self.active = active
+
+        if self.num_held == 0 or now < self._next_ns:
+            return
+        budget_end = now + int(self.tick_budget * 1_000_000_000)
+        while now >= self._next_ns:
+            self._next_ns += self._interval_ns  # from when it was due, so no drift
+            if time.monotonic_ns() > budget_end or not self._spawn(now):
+                self.dropped += 1
+            else:
+                active += 1
+        self.active = active
+        if active > self.max_active:
+            self.max_active = active
+
+    def _free_slot(self):
+        states = self.states
+        n = len(states)
+        for j in range(n):
+            i = (self._slot + j) % n
+            if states[i] == _FREE:
+                self._slot = (i + 1) % n
+                return i
+        return -1
+
+    def _spawn(self, now):
+        """Start a grain, returns False if there's no free Note for it"""
+        i = self._free_slot()
+        if i < 0:
+            return False
+        patch = self.patch
+        size = self.grain_size
+
+        pos = patch.wave_mix + (random.random() - 0.5) * patch.wave_mix_lfo_amount
+        pos = min(max(pos, 0), 1)
+        if self.sample_rate:
+            start = int(pos * (self.src_len - size))
+        else:  # whole wavetable frames
+            start = int(pos * (self.src_len // size - 1) + 0.5) * size
+        buf = self.bufs[i]
+        buf[:] = self.src[start:start+size]
+
+        note = self.held[self._held_pos % self.num_held]  # take turns between held notes
+        self._held_pos += 1
+        f = self.tuning.midi_to_hz(note)
+        if self.sample_rate:
+            f = self.sample_rate / size * f / self.tuning.midi_to_hz(patch.sample_note)
+        f *= 1 + (random.random() * 2 - 1) * (patch.detune - 1)  # pitch jitter
+
+        e = random.randrange(NUM_ENVS)
+        osc = self.pool[i]
+        osc.frequency = f
+        osc.envelope = self._envs[e]
+        osc.amplitude = self.level
+        osc.filter = self.filter
+        self.synth.press(osc)
+        self.states[i] = _ON
+        self._off_ns[i] = now + self._attack_ns[e]
+        self._free_ns[i] = now + 2 * self._attack_ns[e] + _MARGIN_NS
+        self.waveform = buf
+        self.spawned += 1
+        return True
+
+    async def run(self, period=0.002):
+        """Run the grain timer forever as an asyncio task, if not calling update() from elsewhere"""
+        while True:
+            self.update()
+            await asyncio.sleep(period)
+
+    def print_stats(self):
+        print("grains: spawned:%d dropped:%d max active:%d/%d  density:%.1f/s (max %.1f)" %
+              (self.spawned, self.dropped, self.max_active, len(self.pool),
+               min(self._density, self.max_density), self.max_density))
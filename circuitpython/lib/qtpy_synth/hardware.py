@@ -3,101 +3,300 @@
 # part of https://github.com/todbot/qtpy_synth
 #
 # libraries needed:
-#  circup install neopixel, adafruit_debouncer, adafruit_displayio_ssd1306
+#  circup install neopixel, adafruit_displayio_ssd1306
 #
 # UI fixme:
 # knob "pickup" vs knob "catchup"  (maybe done in app instead)
 
+import time
+import asyncio
 import board, busio
-import analogio, keypad
-import touchio
-from adafruit_debouncer import Debouncer
-import neopixel
-import audiopwmio, audiomixer
-import synthio
-import displayio
-import adafruit_displayio_ssd1306
+
+from qtpy_synth.knobs import Knob, KnobEvent
+from qtpy_synth.touchpads import TouchScanner
+from qtpy_synth.input_events import InputQueue, KEY, KEY_HOLD, TOUCH, TOUCH_HOLD, KNOB
 
 SAMPLE_RATE = 25600   # lets try powers of two
 #SAMPLE_RATE = 22050   # lets try powers of two
 MIXER_BUFFER_SIZE = 4096
+I2C_FREQUENCY = 400_000
+
+# latency profiles, name: (sample_rate, mixer_buffer_size)
+# smaller buffers = less delay from touch/MIDI to sound, but more chance of
+# audio glitches when something (like a display refresh) blocks for too long.
+# use Hardware.check_underrun_risk() to see what your app can get away with
+LATENCY_PROFILES = {
+    'live': (22050, 1024),      # ~23 ms per buffer
+    'balanced': (25600, 2048),  # ~40 ms per buffer
+    'safe': (25600, 4096),      # ~80 ms per buffer, needed w/ display auto_refresh
+}
+LATENCY_PROFILE_NAMES = ('live', 'balanced', 'safe')  # smallest first
+
+def buffer_time(sample_rate, mixer_buffer_size):
+    """Seconds of audio in one mixer buffer (16-bit mono)"""
+    return mixer_buffer_size / 2 / sample_rate
+
 DW,DH = 128, 64  # display width/height
 
+# all the subsystems Hardware knows how to set up
+FEATURES_ALL = ('led', 'keys', 'knobs', 'touch', 'midi_uart', 'display', 'audio')
+
 class Hardware():
-    def __init__(self):
-
-        self.led = neopixel.NeoPixel(board.NEOPIXEL, 1, brightness=0.1)
-        self.keys = keypad.Keys( pins=(board.TX,),  value_when_pressed=False )
-        self._knobA = analogio.AnalogIn(board.A0)
-        self._knobB = analogio.AnalogIn(board.A1)
-        self.knobA = self._knobA.value
-        self.knobB = self._knobB.value
-
-        self.touchins = []  # for raw_value
-        self.touches = []   # for debouncer
-        for pin in (board.A3, board.A2, board.MISO, board.SCK):
-            touchin = touchio.TouchIn(pin)
-            touchin.threshold = int(touchin.threshold * 1.1)  # noise protec
-            self.touchins.append(touchin)
-            self.touches.append(Debouncer(touchin))
-
-        self.midi_uart = busio.UART(rx=board.RX, baudrate=31250, timeout=0.001)
-
-        displayio.release_displays()
-        i2c = busio.I2C(scl=board.SCL, sda=board.SDA, frequency=400_000 )
-        display_bus = displayio.I2CDisplay(i2c, device_address=0x3c )
-        self.display = adafruit_displayio_ssd1306.SSD1306(display_bus,
+    """
+    Sets up the qtpy_synth board. Each subsystem (and the libraries it needs)
+    is only set up the first time it's used, and only if it's in `features`.
+    Set profile=True to print how long each subsystem took to set up,
+    times are also kept in `boot_times`.
+    Set latency to one of LATENCY_PROFILES to pick sample rate & buffer size.
+    """
+    def __init__(self, features=FEATURES_ALL, sample_rate=SAMPLE_RATE,
+                 mixer_buffer_size=MIXER_BUFFER_SIZE, i2c_frequency=I2C_FREQUENCY,
+                 profile=False, latency=None):
+        if latency:  # a named latency profile overrides sample_rate & buffer size
+            sample_rate, mixer_buffer_size = LATENCY_PROFILES[latency]
+        self.latency = latency
+        self.features = features
+        self.sample_rate = sample_rate
+        self.mixer_buffer_size = mixer_buffer_size
+        self.i2c_frequency = i2c_frequency
+        self.profile = profile
+        self.boot_times = {}  # key = subsystem name, val = milliseconds to set up
+
+        self._led = None
+        self._keys = None
+        self._knobs = None
+        self._touch = None
+        self._midi_uart = None
+        self._display = None
+        self._audio = None
+        self._mixer = None
+        self._synth = None
+        self.knobA = 0
+        self.knobB = 0
+
+        self.events = InputQueue()  # filled by input_task()
+        self.hold_time = 0.5  # seconds before a held key or pad makes a _HOLD event
+        self._key_down_ns = 0  # when key was pressed, 0 = not pressed
+        self._touch_down_ns = []  # when each pad was pressed, sized when touch is set up
+
+    def _setup(self, name, setup_func):
+        if name not in self.features:
+            raise RuntimeError("Hardware: '%s' is not in features" % name)
+        t = time.monotonic_ns()
+        obj = setup_func()
+        self.boot_times[name] = (time.monotonic_ns() - t) / 1_000_000
+        if self.profile:
+            print("Hardware: %s setup %.1f ms" % (name, self.boot_times[name]))
+        return obj
+
+    def print_boot_profile(self):
+        for name,ms in self.boot_times.items():
+            print("%10s: %6.1f ms" % (name, ms))
+        print("%10s: %6.1f ms" % ("total", sum(self.boot_times.values())))
+
+    @property
+    def led(self):
+        if self._led is None:
+            def setup():
+                import neopixel
+                return neopixel.NeoPixel(board.NEOPIXEL, 1, brightness=0.1)
+            self._led = self._setup('led', setup)
+        return self._led
+
+    @property
+    def keys(self):
+        if self._keys is None:
+            def setup():
+                import keypad
+                return keypad.Keys( pins=(board.TX,),  value_when_pressed=False )
+            self._keys = self._setup('keys', setup)
+        return self._keys
+
+    @property
+    def knobs(self):
+        if self._knobs is None:
+            self._knobs = self._setup('knobs', lambda: (Knob(board.A0), Knob(board.A1)))
+            self.knobA = self._knobs[0].value
+            self.knobB = self._knobs[1].value
+        return self._knobs
+
+    @property
+    def touch(self):
+        if self._touch is None:
+            self._touch = self._setup('touch', lambda:
+                                      TouchScanner((board.A3, board.A2, board.MISO, board.SCK)))
+            self._touch_down_ns = [0] * self._touch.num_pads
+        return self._touch
+
+    @property
+    def touchins(self):  # for raw_value
+        return self.touch.touchins
+
+    @property
+    def midi_uart(self):
+        if self._midi_uart is None:
+            self._midi_uart = self._setup('midi_uart', lambda:
+                                          busio.UART(rx=board.RX, baudrate=31250, timeout=0.001))
+        return self._midi_uart
+
+    @property
+    def display(self):
+        if self._display is None:
+            def setup():
+                import displayio
+                import adafruit_displayio_ssd1306
+                displayio.release_displays()
+                i2c = busio.I2C(scl=board.SCL, sda=board.SDA, frequency=self.i2c_frequency )
+                display_bus = displayio.I2CDisplay(i2c, device_address=0x3c )
+                return adafruit_displayio_ssd1306.SSD1306(display_bus,
                                                           width=DW, height=DH,
                                                           rotation=180)
+            self._display = self._setup('display', setup)
+        return self._display
+
+    def _setup_audio(self):
+        if self._synth is not None:
+            return
+        # do display first so we have minimal audible glitches
+        if 'display' in self.features:
+            self.display
+        def setup():
+            import audiopwmio, audiomixer
+            import synthio
+            self._audio = audiopwmio.PWMAudioOut(board.MOSI)
+            self._mixer = audiomixer.Mixer(sample_rate=self.sample_rate,
+                                           voice_count=1, channel_count=1,
+                                           bits_per_sample=16, samples_signed=True,
+                                           buffer_size=self.mixer_buffer_size)
+            self._synth = synthio.Synthesizer(sample_rate=self.sample_rate)
+            self._audio.play(self._mixer)
+            self._mixer.voice[0].play(self._synth)
+        self._setup('audio', setup)
+
+    @property
+    def audio(self):
+        self._setup_audio()
+        return self._audio
+
+    @property
+    def mixer(self):
+        self._setup_audio()
+        return self._mixer
+
+    @property
+    def synth(self):
+        self._setup_audio()
+        return self._synth
 
-        # now do audio setup so we have minimal audible glitches
-        self.audio = audiopwmio.PWMAudioOut(board.MOSI)
-        self.mixer = audiomixer.Mixer(sample_rate=SAMPLE_RATE,
-                                      voice_count=1, channel_count=1,
-                                      bits_per_sample=16, samples_signed=True,
-                                      buffer_size=MIXER_BUFFER_SIZE)
-        self.synth = synthio.Synthesizer(sample_rate=SAMPLE_RATE)
-        self.audio.play(self.mixer)
-        self.mixer.voice[0].play(self.synth)
-        
     def set_volume(self,v):
         self.mixer.voice[0].level = v
         
+    def buffer_time(self):
+        """Seconds of audio in one mixer buffer"""
+        return buffer_time(self.sample_rate, self.mixer_buffer_size)
+
+    def check_underrun_risk(self, update_func=None, count=20, margin=0.5):
+        """
+        Measure the worst-case time of a full display redraw plus an app update
+        tick (update_func) run back-to-back, like they'd be in an app.
+        Returns (worst_seconds, risk) where risk is worst time as a fraction
+        of the mixer buffer time. Above `margin` you'll likely hear glitches,
+        pick a bigger latency profile or make the display/update do less.
+        """
+        worst_ns = 0
+        has_display = 'display' in self.features
+        if has_display:
+            import displayio
+            blank = displayio.Group()
+        for _ in range(count):
+            if has_display:
+                # swapping root_group out and back marks the whole screen dirty,
+                # so every refresh redraws everything: the worst case, not an empty refresh
+                root = self.display.root_group
+                self.display.root_group = blank
+                self.display.root_group = root
+            t = time.monotonic_ns()
+            if has_display:
+                self.display.refresh()
+            if update_func:
+                update_func()
+            worst_ns = max(worst_ns, time.monotonic_ns() - t)
+        worst = worst_ns / 1_000_000_000
+        risk = worst / self.buffer_time()
+        print("Hardware: worst tick %.1f ms, buffer %.1f ms, risk %.2f %s" %
+              (worst*1000, self.buffer_time()*1000, risk, "(too high!)" if risk > margin else "ok"))
+        for name in LATENCY_PROFILE_NAMES:
+            if worst / buffer_time(*LATENCY_PROFILES[name]) <= margin:
+                print("Hardware: smallest ok latency profile:", name)
+                break
+        return worst, risk
+
     def check_key(self):
         return self.keys.events.get()
 
     def read_pots(self):
         """Read the knobs, filter out their noise """
-        filt = 0.5
-
-        # avg_cnt = 5
-        # knobA_vals = [self.knobA] * avg_cnt
-        # knobB_vals = [self.knobB] * avg_cnt
-        # for i in range(avg_cnt):
-        #     knobA_vals[i] = self._knobA.value
-        #     knobB_vals[i] = self._knobB.value
+        self.check_knobs()
+        return (self.knobA, self.knobB)
 
-        # self.knobA = filt * self.knobA + (1-filt)*(sum(knobA_vals)/avg_cnt)  # filter noise
-        # self.knobB = filt * self.knobB + (1-filt)*(sum(knobB_vals)/avg_cnt)  # filter noise
-
-        self.knobA = filt * self.knobA + (1-filt)*(self._knobA.value)  # filter noise
-        self.knobB = filt * self.knobB + (1-filt)*(self._knobB.value)  # filter noise
-        return (int(self.knobA), int(self.knobB))
+    def check_knobs(self):
+        """Read the knobs, return KnobEvents for the ones that moved"""
+        events = []
+        now = time.monotonic_ns()
+        for i,knob in enumerate(self.knobs):
+            if knob.update(now):
+                events.append(KnobEvent(i, knob.value))
+        self.knobA = self.knobs[0].value
+        self.knobB = self.knobs[1].value
+        return events
 
     def check_touch(self):
-        """Check the four touch inputs, return keypad-like Events"""
+        """Scan the next touch input, return keypad-like Events"""
         events = []
-        for i in 0,1,2,3:
-            touch = self.touches[i]
-            touch.update()
-            if touch.rose:
-                events.append(keypad.Event(i,True))
-            elif touch.fell:
-                events.append(keypad.Event(i,False))
+        if event := self.touch.update():
+            events.append(event)
         return events
 
     def check_touch_hold(self, hold_func):
-        for i in 0,1,2,3:
-            if self.touches[i].value:  # pressed
-                v = self.touchins[i].raw_value - self.touchins[i].threshold
-                hold_func(i, v)
+        """Call hold_func(pad_num, pressure) for each pad being held"""
+        for i in range(self.touch.num_pads):
+            if self.touch.pressed[i]:
+                hold_func(i, self.touch.pressures[i])
+
+    def poll_inputs(self):
+        """Check all the inputs and put what changed into self.events"""
+        now = time.monotonic_ns()
+        hold_ns = int(self.hold_time * 1_000_000_000)
+        events = self.events
+
+        if self._keys is not None and (key := self._keys.events.get()):
+            events.put(KEY, key.key_number, key.pressed)
+            self._key_down_ns = now if key.pressed else 0
+        elif self._key_down_ns and now - self._key_down_ns > hold_ns:
+            events.put(KEY_HOLD, 0, True)
+            self._key_down_ns = 0  # only one hold event per press
+
+        if self._touch is not None and (touch := self._touch.update(now)):
+            i = touch.key_number
+            events.put(TOUCH, i, touch.pressed, self.touch.pressures[i])
+            self._touch_down_ns[i] = now if touch.pressed else 0
+        for i in range(len(self._touch_down_ns)):
+            down_ns = self._touch_down_ns[i]
+            if down_ns and now - down_ns > hold_ns:
+                events.put(TOUCH_HOLD, i, True, self._touch.pressures[i])
+                self._touch_down_ns[i] = 0
+
+        if self._knobs is None:
+            return
+        for knob_event in self.check_knobs():
+            events.put(KNOB, knob_event.knob_number, False, knob_event.value)
+
+    async def input_task(self, interval=0.005):
+        """Poll inputs forever, run this as its own asyncio task"""
+        # set up the inputs we have, so polling them doesn't have to
+        for name in ('keys', 'touch', 'knobs'):
+            if name in self.features:
+                getattr(self, name)
+        while True:
+            self.poll_inputs()
+            await asyncio.sleep(interval)
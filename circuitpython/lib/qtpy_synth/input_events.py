@@ -0,0 +1,89 @@
+# qtpy_synth.input_events.py -- one queue of input events for all the controls
+# part of https://github.com/todbot/qtpy_synth
+#
+# Hardware.input_task() polls the key, touch pads and knobs and puts what
+# happened into an InputQueue. Apps then just wait for the next event:
+#
+#   async def input_handler():
+#       while True:
+#           event = await qts.events.get()
+#           if event.type == TOUCH and event.pressed: ...
+#
+# The queue is a fixed ring of preallocated InputEvent objects, so making
+# events doesn't allocate. This means an event returned by get() is only
+# good until the queue wraps around: use it, don't keep it.
+
+import asyncio
+from micropython import const
+
+KEY = const(0)         # tact button pressed/released
+KEY_HOLD = const(1)    # tact button held down for a while
+TOUCH = const(2)       # touch pad pressed/released, value = pressure
+TOUCH_HOLD = const(3)  # touch pad held down for a while, value = pressure
+KNOB = const(4)        # knob moved, value = knob position 0-65535
+
+class InputEvent:
+    def __init__(self):
+        self.type = KEY
+        self.key_number = 0  # which key, pad, or knob
+        self.pressed = False
+        self.value = 0
+
+    @property
+    def released(self):
+        return not self.pressed
+
+    def __repr__(self):
+        return "InputEvent(%d,%d,%s,%d)" % (self.type, self.key_number, self.pressed, self.value)
+
+
+class InputQueue:
+    def __init__(self, size=32):
+        self._events = [InputEvent() for _ in range(size)]
+        self._head = 0   # next event to get
+        self._count = 0
+        self._ready = asyncio.Event()
+        self.overflow_count = 0
+
+    def __len__(self):
+        return self._count
+
+    def put(self, type, key_number, pressed=False, value=0):
+        """Add an event, returns False if the queue was full"""
+        size = len(self._events)
+        if type == KNOB and self._count:
+            # a knob moving makes lots of events, fold them into the newest one
+            last = self._events[(self._head + self._count - 1) % size]
+            if last.type == KNOB and last.key_number == key_number:
+                last.value = value
+                return True
+        if self._count == size:
+            self.overflow_count += 1
+            return False
+        event = self._events[(self._head + self._count) % size]
+        event.type = type
+        event.key_number = key_number
+        event.pressed = pressed
+        event.value = value
+        self._count += 1
+        self._ready.set()
+        return True
+
+    def get_nowait(self):
+        """Return next event or None if there isn't one"""
+        if not self._count:
+            return None
+        event = self._events[self._head]
+        self._head = (self._head + 1) % len(self._events)
+        self._count -= 1
+        return event
+
+    async def get(self):
+        """Wait for and return the next event"""
+        while not self._count:
+            self._ready.clear()
+            await self._ready.wait()
+        return self.get_nowait()
+
+    def clear(self):
+        self._count = 0
@@ -0,0 +1,65 @@
+# qtpy_synth.knobs.py -- noise-filtered knob reading with change detection
+# part of https://github.com/todbot/qtpy_synth
+#
+# The RP2040 ADC is noisy. Each Knob averages several reads (oversampling),
+# smooths that with a simple IIR filter, and then only moves its reported
+# position when the filtered value leaves a deadband around it (hysteresis).
+# So a knob that isn't being touched doesn't change, and code that reacts to
+# knob changes (like rebuilding filters) doesn't run for nothing.
+
+import time
+import analogio
+from collections import namedtuple
+
+KnobEvent = namedtuple("KnobEvent", "knob_number value")
+
+KNOB_MAX = 65535
+
+class Knob:
+    def __init__(self, pin, oversample=4, filt=0.5, deadband=256, interval=0.01):
+        """
+        pin -- analog pin the knob is on
+        oversample -- ADC reads averaged per update
+        filt -- 0-1 IIR filter amount, higher = smoother but slower
+        deadband -- how far (in 0-65535 units) the filtered value must move to count as a change
+        interval -- seconds between ADC reads, update() does nothing if called sooner
+        """
+        self.analogin = analogio.AnalogIn(pin)
+        self.oversample = oversample
+        self.filt = filt
+        self.deadband = deadband
+        self.interval_ns = int(interval * 1_000_000_000)
+        self._next_ns = 0
+        self.raw = self._read()
+        """ filtered value, changes a little all the time """
+        self.filtered = self.raw
+        """ reported position 0-65535, only changes when the knob is moved """
+        self.value = int(self.raw)
+
+    def _read(self):
+        v = 0
+        for _ in range(self.oversample):
+            v += self.analogin.value
+        return v / self.oversample
+
+    def update(self, now=None):
+        """Read the knob if it's time to, returns True if its position changed"""
+        now = now or time.monotonic_ns()
+        if now < self._next_ns:
+            return False
+        self._next_ns = now + self.interval_ns
+        self.raw = self._read()
+        f = self.filt * self.filtered + (1 - self.filt) * self.raw
+        self.filtered = f
+        db = self.deadband
+        if f < db / 2:  # let the ends be reachable despite the deadband
+            f = 0
+        elif f > KNOB_MAX - db / 2:
+            f = KNOB_MAX
+        elif abs(f - self.value) < db:
+            return False
+        f = int(f)
+        if f == self.value:
+            return False
+        self.value = f
+        return True
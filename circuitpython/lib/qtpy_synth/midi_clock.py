@@ -0,0 +1,121 @@
+# qtpy_synth.midi_clock.py -- follow external MIDI clock and sync LFO rates to it
+# part of https://github.com/todbot/qtpy_synth
+#
+# MIDI clock is 24 ticks per quarter note (24 PPQN). Ticks over USB arrive in
+# jittery little bursts, so the tick interval is measured over the last whole
+# beat (where the jitter of single ticks mostly cancels out) and then smoothed
+# before turning it into a tempo.
+#
+# Synced LFOs are only retuned when the tempo estimate moves more than
+# `threshold` BPM, so a steady clock doesn't cause a stream of LFO updates.
+#
+# Example:
+#   midi_clock = MidiClock()
+#   midi_clock.add_lfo(my_lfo, beats=4)   # one LFO cycle per bar
+#   ...
+#   msg = midi_in.receive()
+#   if midi_clock.handle(msg):
+#       pass  # was a clock message
+
+import time
+from micropython import const
+
+import qtpy_synth.winterbloom_smolmidi as smolmidi
+
+PPQN = const(24)
+
+class MidiClock:
+    def __init__(self, smoothing=0.1, threshold=0.5, timeout=0.5):
+        """
+        smoothing -- 0-1 IIR filter amount per tick, smaller = smoother but slower to follow
+        threshold -- how many BPM the tempo must move before synced LFOs are retuned
+        timeout -- seconds without a tick before we consider the clock gone
+        """
+        self.smoothing = smoothing
+        self.threshold = threshold
+        self.timeout_ns = int(timeout * 1_000_000_000)
+        self.running = False  # True between START/CONTINUE and STOP
+        self.tick_count = 0   # ticks since START
+        self.bpm = 0          # estimated tempo, 0 = no clock seen
+        self.targets = []     # list of [setter_func, beats_per_cycle]
+        self._tick_ns = 0     # smoothed tick interval
+        self._times = [0] * PPQN  # last beat's worth of tick times
+        self._span_pos = 0
+        self._span_count = 0
+        self._last_ns = 0
+        self._tuned_bpm = 0
+
+    def add_target(self, setter, beats=1):
+        """Call setter(rate_hz) with a rate of one cycle every `beats` quarter notes"""
+        self.targets.append([setter, beats])
+        if self.bpm:
+            setter(self.bpm / 60 / beats)
+
+    def add_lfo(self, lfo, beats=1):
+        """Sync a synthio.LFO's rate to one cycle every `beats` quarter notes"""
+        def set_rate(rate):
+            lfo.rate = rate
+        self.add_target(set_rate, beats)
+
+    def clear_targets(self):
+        self.targets.clear()
+
+    def handle(self, msg):
+        """Handle a smolmidi message if it's a clock message, returns True if it was"""
+        t = msg.type
+        if t == smolmidi.CLOCK:
+            self.tick()
+        elif t == smolmidi.START:
+            self.start()
+        elif t == smolmidi.CONTINUE:
+            self.running = True
+        elif t == smolmidi.STOP:
+            self.stop()
+        else:
+            return False
+        return True
+
+    def start(self):
+        self.running = True
+        self.tick_count = 0
+
+    def stop(self):
+        self.running = False
+
+    def present(self, now=None):
+        """True if clock ticks have been arriving recently"""
+        now = now or time.monotonic_ns()
+        return self._last_ns != 0 and now - self._last_ns < self.timeout_ns
+
+    def tick(self, now=None):
+        now = now or time.monotonic_ns()
+        last_ns = self._last_ns
+        self._last_ns = now
+        self.tick_count += 1
+        if last_ns == 0 or now - last_ns > self.timeout_ns:
+            # first tick, or clock went away and came back: start over
+            self._span_count = 0
+            self._tick_ns = 0
+        # measure over a whole beat so per-tick jitter mostly cancels out
+        times = self._times
+        i = self._span_pos
+        span_start = times[i]
+        times[i] = now
+        self._span_pos = (i + 1) % PPQN
+        if self._span_count < PPQN:  # not a whole beat of ticks yet
+            self._span_count += 1
+            return
+        beat_tick_ns = (now - span_start) / PPQN
+        if self._tick_ns == 0:
+            self._tick_ns = beat_tick_ns
+        self._tick_ns += self.smoothing * (beat_tick_ns - self._tick_ns)
+        self.bpm = 60_000_000_000 / (self._tick_ns * PPQN)
+        if abs(self.bpm - self._tuned_bpm) > self.threshold:
+            self.retune()
+
+    def retune(self):
+        """Set all synced targets to the current tempo"""
+        self._tuned_bpm = self.bpm
+        beats_per_sec = self.bpm / 60
+        for (setter, beats) in self.targets:
+            setter(beats_per_sec / beats)
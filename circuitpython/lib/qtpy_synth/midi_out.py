@@ -0,0 +1,153 @@
+# qtpy_synth.midi_out.py -- buffered MIDI output, soft thru, and knobs-as-CCs
+# part of https://github.com/todbot/qtpy_synth
+#
+# Messages are queued into a ring buffer and written to the port in one go
+# by flush(), called once per tick, instead of lots of tiny blocking writes.
+#
+# The port can be anything with a write(), e.g. usb_midi.ports[1] or a
+# busio.UART with a TX pin. (On the qtpy_synth board the TX pin is the
+# tact button, so USB is the normal way out.)
+#
+# Example:
+#   midi_out = MidiOut(usb_midi.ports[1])
+#   ccs = CCController(midi_out)
+#   while True:
+#       midi_out.note_on(60, 100)
+#       ccs.set(74, knob_val >> 9)   # 0-65535 -> 0-127
+#       ccs.update()
+#       midi_out.flush()
+
+import time
+from micropython import const
+
+import qtpy_synth.winterbloom_smolmidi as smolmidi
+
+_NO_VAL = const(0xFF)
+
+class MidiOut:
+    def __init__(self, port, buffer_size=256):
+        self.port = port
+        self._buf = bytearray(buffer_size)
+        self._mv = memoryview(self._buf)
+        self._head = 0   # where the next byte is written out from
+        self._count = 0  # how many bytes are waiting
+        self.dropped = 0 # messages dropped because the buffer was full
+
+    def _put(self, n, b0, b1=0, b2=0):
+        size = len(self._buf)
+        if self._count + n > size:
+            self.dropped += 1
+            return False
+        i = (self._head + self._count) % size
+        self._buf[i] = b0
+        if n > 1:
+            self._buf[(i + 1) % size] = b1
+        if n > 2:
+            self._buf[(i + 2) % size] = b2
+        self._count += n
+        return True
+
+    def send(self, status, data1=None, data2=None):
+        """Queue a raw message, status byte includes the channel"""
+        if data1 is None:
+            return self._put(1, status)
+        if data2 is None:
+            return self._put(2, status, data1)
+        return self._put(3, status, data1, data2)
+
+    def note_on(self, note, vel=127, channel=0):
+        return self._put(3, smolmidi.NOTE_ON | channel, note, vel)
+
+    def note_off(self, note, vel=0, channel=0):
+        return self._put(3, smolmidi.NOTE_OFF | channel, note, vel)
+
+    def cc(self, ccnum, val, channel=0):
+        return self._put(3, smolmidi.CC | channel, ccnum, val)
+
+    def thru(self, msg):
+        """Queue a message received with smolmidi.MidiIn (soft MIDI thru).
+        SysEx is not passed through."""
+        t = msg.type
+        if t == smolmidi.SYSEX:
+            return False
+        status = t | msg.channel if msg.channel is not None else t
+        data = msg.data
+        if not data:
+            return self._put(1, status)
+        if len(data) == 1:
+            return self._put(2, status, data[0])
+        return self._put(3, status, data[0], data[1])
+
+    def flush(self):
+        """Write out everything queued, call once per tick"""
+        size = len(self._buf)
+        while self._count:
+            n = min(self._count, size - self._head)  # up to the end of the ring
+            written = self.port.write(self._mv[self._head : self._head + n])
+            if written is None:
+                written = n
+            if not written:
+                break  # port is full, try again next tick
+            self._head = (self._head + written) % size
+            self._count -= written
+
+    def write(self, data):
+        """
+        Write a long message like a SysEx dump, too big for the ring, right to
+        the port. Whatever's queued goes first, all of it, so this can't end
+        up in the middle of a message. Blocks until it's all written.
+        """
+        while self._count:
+            self.flush()
+        mv = memoryview(data)
+        while len(mv):
+            written = self.port.write(mv)
+            if written is None:
+                break
+            mv = mv[written:]
+
+
+class CCController:
+    """
+    Turns controller values (knobs, touch pads) into CC messages.
+    A CC is only sent when its value moved at least min_delta, and at most
+    once every min_interval seconds. Values that change faster than that
+    are held and the latest one is sent when the CC is allowed again.
+    """
+    def __init__(self, midi_out, channel=0, min_interval=0.02, min_delta=1):
+        self.midi_out = midi_out
+        self.channel = channel
+        self.min_interval_ms = int(min_interval * 1000)
+        self.min_delta = min_delta
+        self._last = bytearray([_NO_VAL] * 128)     # last sent value per CC
+        self._pending = bytearray([_NO_VAL] * 128)  # value waiting to be sent per CC
+        self._next_ms = [0] * 128                  # when each CC may be sent again
+        self._active = []                          # CCs that have been used
+
+    def set(self, ccnum, val):
+        """Set controller value 0-127, sent now or as soon as rate limit allows"""
+        val = min(max(int(val), 0), 127)
+        last = self._last[ccnum]
+        if last != _NO_VAL and abs(val - last) < self.min_delta:
+            self._pending[ccnum] = _NO_VAL
+            return
+        if ccnum not in self._active:
+            self._active.append(ccnum)
+        self._pending[ccnum] = val
+        self._send(ccnum, time.monotonic_ns() // 1_000_000)
+
+    def update(self):
+        """Send any held-back values whose CC is allowed again, call once per tick"""
+        now_ms = time.monotonic_ns() // 1_000_000
+        for ccnum in self._active:
+            if self._pending[ccnum] != _NO_VAL:
+                self._send(ccnum, now_ms)
+
+    def _send(self, ccnum, now_ms):
+        if now_ms < self._next_ms[ccnum]:
+            return
+        val = self._pending[ccnum]
+        if self.midi_out.cc(ccnum, val, self.channel):
+            self._last[ccnum] = val
+            self._pending[ccnum] = _NO_VAL
+            self._next_ms[ccnum] = now_ms + self.min_interval_ms
@@ -0,0 +1,138 @@
+# qtpy_synth.midi_router.py -- play several Instruments on one synth by MIDI channel
+# part of https://github.com/todbot/qtpy_synth
+#
+# Each Instrument becomes a "part" that listens on one or more MIDI channels.
+# All parts share the voice budget of the one synthio.Synthesizer they play on
+# (synthio can only sound so many Notes at once), and each part can have
+# its own polyphony cap. When a part is out of voices, its oldest held
+# note is stolen; when the whole synth is out, a note is only played if
+# the part has a note of its own to steal.
+#
+# Example:
+#   router = ChannelRouter()
+#   router.add(wave_inst, channels=(0,), max_voices=4)   # MIDI channel 1
+#   router.add(drone_inst, channels=(1,), max_voices=2)  # MIDI channel 2
+#   ...
+#   msg = midi_in.receive()
+#   if router.handle(msg):
+#       pass  # was a note for one of the parts
+
+from array import array
+from micropython import const
+
+import qtpy_synth.winterbloom_smolmidi as smolmidi
+from qtpy_synth.synthio_instrument import MAX_SYNTH_NOTES
+
+class Part:
+    def __init__(self, inst, max_voices):
+        self.inst = inst
+        self.max_voices = max_voices
+        # a slot per voice: the note in it and when it started (a count of note ons),
+        # all made here so note on/off don't allocate
+        self.notes = [None] * max_voices
+        self.ages = array('L', [0] * max_voices)
+        self._count = 0
+        for note in inst.voices:  # already playing before the router saw them, oldest
+            self.started(note)
+
+    def started(self, note):
+        """Note just started: take a free slot (or one the instrument let go of itself), or the oldest"""
+        notes, ages, voices = self.notes, self.ages, self.inst.voices
+        slot = 0
+        for i in range(len(notes)):
+            n = notes[i]
+            if n is None or n not in voices or n == note:
+                slot = i
+                break
+            if ages[i] < ages[slot]:
+                slot = i
+        self._count += 1
+        notes[slot] = note
+        ages[slot] = self._count
+
+    def stopped(self, note):
+        notes = self.notes
+        for i in range(len(notes)):
+            if notes[i] == note:
+                notes[i] = None
+                return
+
+    def oldest_note(self):
+        """Oldest note still playing, notes the instrument released by itself are skipped"""
+        notes, ages, voices = self.notes, self.ages, self.inst.voices
+        for note in voices:  # started outside the router, no age known: call it the oldest
+            if note not in notes:
+                return note
+        oldest = -1
+        for i in range(len(notes)):
+            if notes[i] is not None and notes[i] in voices and (oldest < 0 or ages[i] < ages[oldest]):
+                oldest = i
+        return notes[oldest] if oldest >= 0 else None
+
+    def notes_used(self):
+        return self.inst.notes_used()
+
+
+class ChannelRouter:
+    def __init__(self, max_notes=MAX_SYNTH_NOTES):
+        """max_notes -- how many synthio.Notes all parts together may use"""
+        self.max_notes = max_notes
+        self.parts = []
+        self._chan_parts = [None] * 16  # index = MIDI channel, val = Part
+
+    def add(self, inst, channels, max_voices=None):
+        """Play inst on the given MIDI channels (0-15), using at most max_voices voices"""
+        part = Part(inst, max_voices or self.max_notes // inst.oscs_per_voice)
+        self.parts.append(part)
+        for c in channels:
+            self._chan_parts[c] = part
+        return part
+
+    def part_for(self, channel):
+        return self._chan_parts[channel]
+
+    def notes_used(self):
+        """Number of synthio.Notes currently used by all parts"""
+        n = 0
+        for part in self.parts:
+            n += part.notes_used()
+        return n
+
+    def note_on(self, channel, midi_note, midi_vel=127):
+        part = self._chan_parts[channel]
+        if part is None:
+            return
+        inst = part.inst
+        if midi_note in inst.voices:  # retrigger, don't leak the old voice
+            inst.note_off(midi_note)
+            part.stopped(midi_note)
+        # the instrument says what one more voice costs, a granular one uses its whole grain pool
+        if (len(inst.voices) >= part.max_voices or
+            self.notes_used() - part.notes_used() + inst.notes_used(len(inst.voices) + 1) > self.max_notes):
+            stolen = part.oldest_note()
+            if stolen is None:
+                return  # nothing of ours to steal, drop the note
+            inst.note_off(stolen)
+            part.stopped(stolen)
+        inst.note_on(midi_note, midi_vel)
+        if midi_note in inst.voices:  # not if the instrument's tuning has no such key
+            part.started(midi_note)
+
+    def note_off(self, channel, midi_note, midi_vel=0):
+        part = self._chan_parts[channel]
+        if part is not None:
+            part.inst.note_off(midi_note, midi_vel)
+            part.stopped(midi_note)
+
+    def handle(self, msg):
+        """Route a smolmidi note on/off message, returns True if it was one"""
+        if msg.type == smolmidi.NOTE_ON:
+            if msg.data[1]:
+                self.note_on(msg.channel, msg.data[0], msg.data[1])
+            else:  # note on with zero velocity is a note off
+                self.note_off(msg.channel, msg.data[0])
+        elif msg.type == smolmidi.NOTE_OFF:
+            self.note_off(msg.channel, msg.data[0], msg.data[1])
+        else:
+            return False
+        return True
@@ -0,0 +1,101 @@
+# qtpy_synth.numeric_field.py -- fixed-width number display that only redraws changed digits
+# part of https://github.com/todbot/qtpy_synth
+#
+# Setting a Label's text re-renders the whole label bitmap, and making the
+# text with "%.2f" % val makes a new string every time. NumericField instead
+# is a one-row TileGrid over a tiny glyph sheet of just the characters
+# numbers need (pre-rendered once from the font), and set_value() works out
+# the digits with integer math and only changes the tiles that are different.
+#
+# Example:
+#   field = NumericField(width=5, decimals=2, x=10, y=20)
+#   group.append(field)
+#   field.set_value(3.14159)   # shows " 3.14"
+
+import displayio
+import bitmaptools
+import terminalio
+
+_CHARS = "0123456789.- "
+_DOT, _MINUS, _BLANK = 10, 11, 12
+
+_sheets = {}  # font -> (glyph sheet, tile width, tile height), shared by all fields
+
+def _glyph_sheet(font):
+    """Render the characters we need from a fixed-width font into one small bitmap"""
+    if font in _sheets:
+        return _sheets[font]
+    w, h = font.get_bounding_box()[:2]
+    sheet = displayio.Bitmap(w * len(_CHARS), h, 2)
+    for i,c in enumerate(_CHARS):
+        glyph = font.get_glyph(ord(c))
+        if glyph is None or c == ' ':
+            continue
+        cols = glyph.bitmap.width // w
+        src_x = (glyph.tile_index % cols) * w
+        src_y = (glyph.tile_index // cols) * h
+        bitmaptools.blit(sheet, glyph.bitmap, i * w, 0,
+                         x1=src_x, y1=src_y, x2=src_x + w, y2=src_y + h)
+    _sheets[font] = (sheet, w, h)
+    return _sheets[font]
+
+class NumericField(displayio.TileGrid):
+    def __init__(self, width=5, decimals=1, x=0, y=0, font=terminalio.FONT, color=0xffffff):
+        """
+        width -- number of characters, including '.' and '-'
+        decimals -- digits after the decimal point
+        x,y -- position, y is the vertical middle like bitmap_label.Label
+        """
+        sheet, w, h = _glyph_sheet(font)
+        palette = displayio.Palette(2)
+        palette.make_transparent(0)
+        palette[1] = color
+        super().__init__(sheet, pixel_shader=palette, width=width, height=1,
+                         tile_width=w, tile_height=h, default_tile=_BLANK,
+                         x=x, y=y - h//2)
+        self.num_chars = width
+        self.decimals = decimals
+        self._scale = 10 ** decimals
+        self._tiles = bytearray([_BLANK] * width)
+        self.value = None
+
+    def _set_tile(self, i, t):
+        if self._tiles[i] != t:
+            self._tiles[i] = t
+            self[i] = t
+            return True
+        return False
+
+    def set_value(self, val):
+        """Show a number, right-aligned. Returns True if any character changed"""
+        if val == self.value:
+            return False
+        self.value = val
+        n = int(abs(val) * self._scale + 0.5)
+        neg = val < 0 and n != 0
+        decimals = self.decimals
+        dot_done = decimals == 0
+        digits = 0
+        changed = False
+        i = self.num_chars - 1
+        # fill in digits from the right until the number and its decimals are done
+        while i >= 0 and (n or digits <= decimals):
+            if digits == decimals and not dot_done:
+                changed |= self._set_tile(i, _DOT)
+                dot_done = True
+            else:
+                changed |= self._set_tile(i, n % 10)
+                n //= 10
+                digits += 1
+            i -= 1
+        if n or (neg and i < 0):  # doesn't fit, show dashes
+            for i in range(self.num_chars):
+                changed |= self._set_tile(i, _MINUS)
+            return changed
+        if neg:
+            changed |= self._set_tile(i, _MINUS)
+            i -= 1
+        while i >= 0:
+            changed |= self._set_tile(i, _BLANK)
+            i -= 1
+        return changed
@@ -0,0 +1,284 @@
+# qtpy_synth.patch_sysex.py -- patch and wavetable dump/load over MIDI SysEx
+# part of https://github.com/todbot/qtpy_synth
+#
+# Lets a desktop editor push patches or wave data to the board and pull them back.
+#
+# All messages look like:
+#   F0 7D 51 <cmd> <args...> F7
+# where 7D is the "non-commercial" manufacturer id and 51 ('Q') is our device id.
+# Payloads are 8-bit data packed into 7-bit bytes (7 bytes -> 8 bytes, with
+# the high bits of the next 7 bytes in a leading byte) followed by a checksum byte.
+#
+# Commands:
+#   PATCH_REQUEST  01 <patch_num>                       -> board replies with PATCH_DATA
+#                                                          (patch_num 7F = whole bank)
+#   PATCH_DATA     02 <patch_num> <payload> <checksum>
+#   WAVE_REQUEST   03 <wave_num> <offset:3> <count:3>   -> board replies with WAVE_DATA
+#   WAVE_DATA      04 <wave_num> <offset:3> <count:3> <payload> <checksum>
+#
+# offset & count are in samples, sent as three 7-bit bytes, LSB first.
+# wave payloads are little-endian int16 samples.
+#
+# Example:
+#   patch_sysex = PatchSysex(MidiOut(usb_midi.ports[1]), patches)
+#   ...
+#   msg = midi_in.receive()
+#   if msg.type == smolmidi.SYSEX:
+#       patch_sysex.handle(midi_in)
+#   patch_sysex.update()  # every time, to finish reading long messages
+
+import struct
+from micropython import const
+import ulab.numpy as np
+
+from qtpy_synth.synthio_instrument import WaveType
+
+SYSEX_ID = const(0x7D)
+DEVICE_ID = const(0x51)
+
+PATCH_REQUEST = const(0x01)
+PATCH_DATA = const(0x02)
+WAVE_REQUEST = const(0x03)
+WAVE_DATA = const(0x04)
+
+ALL_PATCHES = const(0x7F)
+WAVE_CHUNK = const(256)  # max samples per WAVE_DATA message sent
+
+# name, wave_type, wave, waveB, wave_mix, wave_mix_lfo_amount, wave_mix_lfo_rate,
+# detune, filt_type, filt_f, filt_q, filt_env (5 floats), amp_env (5 floats)
+_PATCH_FMT = "<16sB16s16sffffBff5f5f"
+PATCH_SIZE = struct.calcsize(_PATCH_FMT)
+
+def packed_len(n):
+    """Number of 7-bit bytes needed to send n 8-bit bytes"""
+    return n + (n + 6) // 7
+
+def pack7(src, n, dst, dst_pos):
+    """Pack n 8-bit bytes of src into 7-bit bytes in dst, return new dst_pos"""
+    for i in range(0, n, 7):
+        hi_pos = dst_pos
+        hi = 0
+        dst_pos += 1
+        for j in range(min(7, n - i)):
+            b = src[i + j]
+            hi |= (b >> 7) << j
+            dst[dst_pos] = b & 0x7F
+            dst_pos += 1
+        dst[hi_pos] = hi
+    return dst_pos
+
+def unpack7(src, start, end, dst):
+    """Unpack 7-bit bytes src[start:end] into 8-bit bytes in dst, return count"""
+    n = 0
+    i = start
+    while i < end:
+        hi = src[i]
+        i += 1
+        for j in range(min(7, end - i)):
+            dst[n] = src[i] | (((hi >> j) & 1) << 7)
+            n += 1
+            i += 1
+    return n
+
+def checksum(buf, start, end):
+    s = 0
+    for i in range(start, end):
+        s += buf[i]
+    return s & 0x7F
+
+def _put21(buf, pos, v):
+    buf[pos] = v & 0x7F
+    buf[pos + 1] = (v >> 7) & 0x7F
+    buf[pos + 2] = (v >> 14) & 0x7F
+
+def _get21(buf, pos):
+    return buf[pos] | (buf[pos + 1] << 7) | (buf[pos + 2] << 14)
+
+def _str(b):
+    return b.rstrip(b'\0').decode()
+
+def _env_vals(env):
+    return (env.attack_time, env.decay_time, env.release_time,
+            env.attack_level, env.sustain_level)
+
+def _set_env(env, vals):
+    (env.attack_time, env.decay_time, env.release_time,
+     env.attack_level, env.sustain_level) = vals
+
+def patch_to_bytes(patch, buf):
+    """Serialize a Patch into buf (at least PATCH_SIZE long)"""
+    wave_type = patch.wave_type
+    if isinstance(wave_type, str):  # patches may have the 'wtb' string in them
+        wave_type = WaveType.WTB if wave_type == 'wtb' else WaveType.OSC
+    struct.pack_into(_PATCH_FMT, buf, 0,
+                     patch.name.encode(), wave_type,
+                     patch.wave.encode(), (patch.waveB or '').encode(),
+                     patch.wave_mix, patch.wave_mix_lfo_amount, patch.wave_mix_lfo_rate,
+                     patch.detune, patch.filt_type, patch.filt_f, patch.filt_q,
+                     *_env_vals(patch.filt_env_params), *_env_vals(patch.amp_env_params))
+
+def patch_from_bytes(patch, buf):
+    """Update an existing Patch from bytes made by patch_to_bytes"""
+    vals = struct.unpack_from(_PATCH_FMT, buf, 0)
+    patch.name = _str(vals[0])
+    patch.wave_type = vals[1]
+    patch.wave = _str(vals[2])
+    patch.waveB = _str(vals[3]) or None
+    (patch.wave_mix, patch.wave_mix_lfo_amount, patch.wave_mix_lfo_rate,
+     patch.detune, patch.filt_type, patch.filt_f, patch.filt_q) = vals[4:11]
+    _set_env(patch.filt_env_params, vals[11:16])
+    _set_env(patch.amp_env_params, vals[16:21])
+
+
+class PatchSysex:
+    """
+    Handles patch & wave dump/load SysEx messages.
+    All buffers are allocated up front so transfers don't churn the heap.
+
+    midi_out -- MidiOut replies are sent with, so they stay in order with other MIDI out
+    patches -- list of Patch objects, loaded patches are updated in place
+    waves -- list of int16 arrays (e.g. Waves.make_user() waves a patch plays
+             as 'USR0', ...) that can be written/read with WAVE_DATA / WAVE_REQUEST.
+             Not an instrument's mix buffer, that's rewritten every update.
+    max_length -- largest SysEx message accepted, longer ones are dropped
+    num_ports -- how many MIDI ins can be sending us SysEx at the same time
+    """
+    def __init__(self, midi_out, patches, waves=None, max_length=1024, num_ports=2):
+        self.midi_out = midi_out
+        self.patches = patches
+        self.waves = waves if waves is not None else []
+        # each port being read from gets its own receive buffer: [MidiIn or None, rx buf, timeout]
+        self._readers = [[None, bytearray(max_length), 0.5] for _ in range(num_ports)]
+        self.rx_buf = self._readers[0][1]  # the message being acted on
+        self.raw_buf = bytearray(max(max_length, PATCH_SIZE, WAVE_CHUNK * 2))
+        # F0 7D 51 cmd num offset:3 count:3 payload checksum F7
+        self.tx_buf = bytearray(13 + packed_len(max(PATCH_SIZE, WAVE_CHUNK * 2)))
+        """ Called with (patch_num, patch) when a patch has been loaded """
+        self.on_patch = None
+        """ Called with (wave_num, offset, count) when wave data has been loaded """
+        self.on_wave = None
+
+    def handle(self, midi_in, timeout=0.5):
+        """
+        Start reading a SysEx message from midi_in and act on it when it's all
+        here. Call right after midi_in.receive() returned a SYSEX message.
+        Doesn't wait for the rest of a long message, update() finishes it.
+        Messages on different ports are read side by side.
+        Returns True if it was a message for us and it's done.
+        """
+        for reader in self._readers:
+            if reader[0] is None or reader[0] is midi_in:
+                reader[0] = midi_in
+                reader[2] = timeout
+                return self.update()
+        # more ports than readers: leave it, midi_in.receive() skips over it (waiting for its end)
+        print("patch_sysex: too many SysEx ports at once")
+        return False
+
+    def update(self):
+        """Keep reading SysEx messages handle() started, call every time MIDI is checked"""
+        done = False
+        for reader in self._readers:
+            midi_in = reader[0]
+            if midi_in is None:
+                continue
+            result = midi_in.receive_sysex_into(reader[1], reader[2], block=False)
+            if result is None:  # rest of it isn't here yet
+                continue
+            reader[0] = None
+            self.rx_buf = reader[1]
+            if self._act(*result):
+                done = True
+        return done
+
+    def _act(self, n, truncated):
+        """Act on a whole message in rx_buf, returns True if it was for us"""
+        buf = self.rx_buf
+        if truncated or n < 3 or buf[0] != SYSEX_ID or buf[1] != DEVICE_ID:
+            return False
+        cmd = buf[2]
+        if cmd == PATCH_REQUEST and n >= 4:
+            if buf[3] == ALL_PATCHES:
+                for i in range(len(self.patches)):
+                    self.send_patch(i)
+            else:
+                self.send_patch(buf[3])
+        elif cmd == PATCH_DATA and n >= 5:
+            self._load_patch(buf[3], n)
+        elif cmd == WAVE_REQUEST and n >= 10:
+            self.send_wave(buf[3], _get21(buf, 4), _get21(buf, 7))
+        elif cmd == WAVE_DATA and n >= 11:
+            self._load_wave(buf[3], _get21(buf, 4), _get21(buf, 7), n)
+        else:
+            return False
+        return True
+
+    def _load_patch(self, patch_num, n):
+        buf = self.rx_buf
+        if patch_num >= len(self.patches) or checksum(buf, 4, n-1) != buf[n-1]:
+            print("patch_sysex: bad patch data", patch_num)
+            return
+        if unpack7(buf, 4, n-1, self.raw_buf) < PATCH_SIZE:
+            print("patch_sysex: short patch data", patch_num)
+            return
+        patch = self.patches[patch_num]
+        patch_from_bytes(patch, self.raw_buf)
+        if self.on_patch:
+            self.on_patch(patch_num, patch)
+
+    def _load_wave(self, wave_num, offset, count, n):
+        buf = self.rx_buf
+        if wave_num >= len(self.waves) or checksum(buf, 10, n-1) != buf[n-1]:
+            print("patch_sysex: bad wave data", wave_num)
+            return
+        wave = self.waves[wave_num]
+        count = min(count, unpack7(buf, 10, n-1, self.raw_buf) // 2, len(wave) - offset)
+        if count <= 0:
+            return
+        wave[offset:offset+count] = np.frombuffer(self.raw_buf, dtype=np.int16, count=count)
+        if self.on_wave:
+            self.on_wave(wave_num, offset, count)
+
+    def _start(self, cmd, num):
+        tx = self.tx_buf
+        tx[0] = 0xF0
+        tx[1] = SYSEX_ID
+        tx[2] = DEVICE_ID
+        tx[3] = cmd
+        tx[4] = num
+        return 5
+
+    def _finish(self, start, end):
+        tx = self.tx_buf
+        tx[end] = checksum(tx, start, end)
+        tx[end+1] = 0xF7
+        self.midi_out.write(memoryview(tx)[:end+2])
+
+    def send_patch(self, patch_num):
+        """Send a PATCH_DATA message for patches[patch_num]"""
+        if patch_num >= len(self.patches):
+            return
+        patch_to_bytes(self.patches[patch_num], self.raw_buf)
+        start = self._start(PATCH_DATA, patch_num)
+        end = pack7(self.raw_buf, PATCH_SIZE, self.tx_buf, start)
+        self._finish(start, end)
+
+    def send_wave(self, wave_num, offset=0, count=None):
+        """Send waves[wave_num] samples as WAVE_DATA messages of WAVE_CHUNK samples"""
+        if wave_num >= len(self.waves):
+            return
+        wave = self.waves[wave_num]
+        end_pos = len(wave) if count is None else min(len(wave), offset + count)
+        raw = self.raw_buf
+        while offset < end_pos:
+            count = min(WAVE_CHUNK, end_pos - offset)
+            for i in range(count):
+                s = int(wave[offset + i])
+                raw[i*2] = s & 0xFF
+                raw[i*2+1] = (s >> 8) & 0xFF
+            pos = self._start(WAVE_DATA, wave_num)
+            _put21(self.tx_buf, pos, offset)
+            _put21(self.tx_buf, pos + 3, count)
+            end = pack7(raw, count * 2, self.tx_buf, pos + 6)
+            self._finish(pos + 6, end)
+            offset += count
@@ -0,0 +1,93 @@
+# qtpy_synth.pitch.py -- MIDI note <-> Hz by table lookup, no log/exp at play time
+# part of https://github.com/todbot/qtpy_synth
+#
+# Two small tables made once at import: the frequency of each of the 128
+# MIDI notes, and the frequency ratio of each cent 0-100. A fractional note
+# is its whole note's frequency times the (interpolated) cent ratio, so it's
+# accurate to float precision at any fraction. Going back from Hz to a note
+# is a binary search of the same tables.
+#
+# For whole arrays of notes at once, midi_to_hz_array() does one ulab
+# operation instead of a Python loop. That one uses exp()/log() and not the
+# tables on purpose: ulab runs exp() over the whole array in C, which is
+# cheap and exact, while looking up tables by an array of indexes needs
+# floor, two np.take()s (not in every ulab build) and an interpolation,
+# four or five whole-array passes instead of one.
+#
+# Example:
+#   from qtpy_synth.pitch import midi_to_hz, hz_to_midi
+#   f = midi_to_hz(60.25)  # a quarter semitone above middle C
+#   n = hz_to_midi(f)      # 60.25
+
+import math
+from array import array
+from micropython import const
+import ulab.numpy as np
+
+NUM_NOTES = const(128)
+_CENTS = const(100)
+
+# Hz of each whole MIDI note
+note_freqs = array('f', [440 * math.pow(2, (n - 69) / 12) for n in range(NUM_NOTES)])
+# frequency ratio of 0-100 cents, cent_ratios[100] is one semitone
+cent_ratios = array('f', [math.pow(2, c / 1200) for c in range(_CENTS + 1)])
+
+def midi_to_hz(note):
+    """Frequency of a float MIDI note number, like synthio.midi_to_hz() but no pow()"""
+    i = int(note)
+    if note < i:  # int() rounds toward zero, want floor for negative notes
+        i -= 1
+    cents = (note - i) * _CENTS
+    octave_mult = 1
+    while i < 0:
+        i += 12
+        octave_mult *= 0.5
+    while i >= NUM_NOTES:
+        i -= 12
+        octave_mult *= 2
+    c = int(cents)
+    r = cent_ratios[c]
+    if c < _CENTS:
+        r += (cents - c) * (cent_ratios[c+1] - r)
+    return note_freqs[i] * r * octave_mult
+
+def semitones_to_ratio(semitones):
+    """Frequency ratio of an interval in (float) semitones"""
+    return midi_to_hz(69 + semitones) / 440
+
+def _bisect(table, val, lo, hi):
+    """Index of the last entry in table[lo:hi] that's <= val (table is increasing)"""
+    while hi - lo > 1:
+        mid = (lo + hi) // 2
+        if table[mid] <= val:
+            lo = mid
+        else:
+            hi = mid
+    return lo
+
+def hz_to_midi(f):
+    """Float MIDI note number of a frequency, inverse of midi_to_hz(), no log()"""
+    if not f > 0:  # would never get up to note 0, like log() of it
+        raise ValueError("frequency must be > 0")
+    octaves = 0
+    while f < note_freqs[0]:
+        f *= 2
+        octaves -= 1
+    while f >= note_freqs[NUM_NOTES-1] * cent_ratios[_CENTS]:
+        f *= 0.5
+        octaves += 1
+    i = _bisect(note_freqs, f, 0, NUM_NOTES)
+    r = f / note_freqs[i]
+    c = _bisect(cent_ratios, r, 0, _CENTS + 1)
+    cents = c
+    if c < _CENTS:
+        cents += (r - cent_ratios[c]) / (cent_ratios[c+1] - cent_ratios[c])
+    return i + cents / _CENTS + octaves * 12
+
+def midi_to_hz_array(notes):
+    """Frequencies of a ulab array of float MIDI notes, all in one go"""
+    return np.exp((notes - 69) * (math.log(2) / 12)) * 440
+
+def hz_to_midi_array(freqs):
+    """MIDI notes of a ulab array of frequencies, all in one go"""
+    return np.log(freqs / 440) * (12 / math.log(2)) + 69
@@ -0,0 +1,224 @@
+# qtpy_synth.samples.py -- one-shot & looped WAV samples played from RAM
+# part of https://github.com/todbot/qtpy_synth
+#
+# A sample is a whole WAV read into an int16 buffer and used as the waveform
+# of a synthio.Note, played through once at a frequency that makes it run
+# at its own sample rate.
+#
+# Reading WAVs off flash is slow and blocks the audio loop, so samples are
+# only ever read when a patch is loaded (its preload list, Patch.samples) and
+# kept in a SampleCache. Notes only look in the cache: a sample that's not
+# in RAM doesn't play, it never gets read in the middle of playing.
+#
+# The cache has a RAM budget in bytes. When loading a sample would go over
+# it, the least-recently-played samples are dropped until it fits. (A
+# dropped sample that's still sounding keeps playing, its Note holds onto
+# the buffer until it's done.)
+#
+# A one-shot sample plays the whole buffer, and its note is released by
+# update() once the sample's had time to play through (synthio would just
+# start it over, so keep one-shot patches' release time short). Where
+# synthio.Note has waveform_loop_start/waveform_loop_end, a sample with
+# loop points loops between those while held, at a frequency that makes the
+# loop run at the sample's own rate. Without them it plays like a one-shot.
+#
+# Example:
+#   patch.sample_dir = '/samples'
+#   patch.samples = ['kick.wav', 'snare.wav', 'hat.wav']
+#   patch.sample_note = 36  # kick on 36, snare on 37, ...
+#   inst = SampleInstrument(synth, patch, SampleCache(budget=96*1024))
+#   inst.note_on(37)
+
+import time
+import synthio
+from micropython import const
+import ulab.numpy as np
+
+from qtpy_synth.synthio_instrument import Instrument
+try:
+    import adafruit_wave
+except:
+    print("samples: no WAV import available")
+
+_READ_CHUNK = const(1024) # frames read from flash at a time, so loading needs little extra RAM
+
+# longest waveform synthio will take, older CircuitPython doesn't say
+MAX_FRAMES = getattr(synthio, 'waveform_max_length', 16384)
+HAS_LOOP_POINTS = hasattr(synthio.Note, 'waveform_loop_start')
+
+class Sample:
+    """A WAV in RAM: buf is int16 samples"""
+    def __init__(self, buf, num_frames, sample_rate, loop_start=None, loop_end=None):
+        self.buf = buf
+        self.num_frames = num_frames
+        self.sample_rate = sample_rate
+        self.loop_start = loop_start
+        self.loop_end = loop_end
+        # synthio runs through the whole waveform (or loop) once per cycle of frequency
+        self.frequency = sample_rate / len(buf)
+        self.duration = len(buf) / sample_rate
+        if loop_end:
+            self.loop_start = loop_start or 0
+            self.loop_frequency = sample_rate / (loop_end - self.loop_start)
+
+    @property
+    def nbytes(self):
+        return len(self.buf) * 2
+
+def load_sample(path, loop_start=None, loop_end=None):
+    """Read a mono 16-bit WAV into a Sample, long ones are cut to MAX_FRAMES"""
+    with adafruit_wave.open(path) as w:
+        if w.getsampwidth() != 2 or w.getnchannels() != 1:
+            raise ValueError("unsupported WAV format")
+        n = min(w.getnframes(), MAX_FRAMES)
+        buf = np.zeros(n, dtype=np.int16)
+        i = 0
+        while i < n:
+            chunk = np.frombuffer(w.readframes(min(_READ_CHUNK, n - i)), dtype=np.int16)
+            if not len(chunk):
+                break
+            buf[i:i+len(chunk)] = chunk
+            i += len(chunk)
+        return Sample(buf, i, w.getframerate(), loop_start, loop_end)
+
+
+class SampleCache:
+    def __init__(self, budget=64*1024):
+        """ budget -- max bytes of sample data kept in RAM """
+        self.budget = budget
+        self.used = 0
+        self.samples = {}  # path -> Sample
+        self._order = []   # paths, least recently used first
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, path):
+        """The Sample for path if it's in RAM, None if not. Never reads flash."""
+        sample = self.samples.get(path, None)
+        if sample is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        if self._order[-1] != path:
+            self._order.remove(path)
+            self._order.append(path)
+        return sample
+
+    def load(self, path, loop_start=None, loop_end=None):
+        """Get Sample for path, reading it from flash if needed. Not for use while playing."""
+        sample = self.samples.get(path, None)
+        if sample is None:
+            sample = load_sample(path, loop_start, loop_end)
+            if sample.nbytes > self.budget:
+                raise MemoryError("sample bigger than cache: %s" % path)
+            while self.used + sample.nbytes > self.budget:
+                self.evict()
+            self.samples[path] = sample
+            self.used += sample.nbytes
+        else:
+            self._order.remove(path)
+        self._order.append(path)
+        return sample
+
+    def evict(self):
+        """Drop the least recently used sample"""
+        path = self._order.pop(0)
+        self.used -= self.samples.pop(path).nbytes
+
+    def preload(self, paths):
+        """Load a list of samples, entries can be a path or (path, loop_start, loop_end)"""
+        for p in paths:
+            if isinstance(p, str):
+                self.load(p)
+            else:
+                self.load(*p)
+
+    def clear(self):
+        self.samples.clear()
+        self._order.clear()
+        self.used = 0
+
+    def print_stats(self):
+        print("samples: %d  used: %d/%d bytes  hits:%d misses:%d" %
+              (len(self.samples), self.used, self.budget, self.hits, self.misses))
+
+
+class SampleInstrument(Instrument):
+    """
+    Plays the samples in patch.samples, one per MIDI note starting at
+    patch.sample_note. If there's only one sample, it's played at the pitch
+    of every note instead, with sample_note being its original pitch.
+    """
+    def __init__(self, synth, patch, cache=None):
+        super().__init__(synth, patch)
+        self.cache = cache or SampleCache()
+        self._ends = {}  # midi note -> when to release it, for one-shots
+        self.load_patch(patch)
+
+    def _path(self, i):
+        p = self.patch.samples[i]
+        name = p if isinstance(p, str) else p[0]
+        return self.patch.sample_dir + "/" + name
+
+    def load_patch(self, patch):
+        """Switch to patch, reading in all its samples, do this before playing"""
+        self.patch = patch
+        paths = []
+        for i, p in enumerate(patch.samples):
+            paths.append(self._path(i) if isinstance(p, str) else (self._path(i),) + tuple(p[1:]))
+        self.cache.preload(paths)
+
+    def note_on(self, midi_note, midi_vel=127):
+        patch = self.patch
+        num = len(patch.samples)
+        if num == 0:
+            return
+        ratio = 1
+        if num == 1:
+            i = 0
+            f = self.tuning.midi_to_hz(midi_note)
+            if not f:  # not in this tuning's keyboard map
+                return
+            ratio = f / self.tuning.midi_to_hz(patch.sample_note)
+        else:
+            i = midi_note - patch.sample_note
+            if i < 0 or i >= num:
+                return
+        sample = self.cache.get(self._path(i))
+        if sample is None:  # not preloaded, don't go to flash for it now
+            print("sample not loaded:", self._path(i))
+            return
+        if midi_note in self.voices:  # retrigger
+            self.note_off(midi_note)
+
+        voice = synthio.Note(frequency=sample.frequency * ratio, waveform=sample.buf,
+                             envelope=patch.amp_env_params.make_env(),
+                             amplitude=midi_vel / 127)
+        if HAS_LOOP_POINTS and sample.loop_end:  # loop while held
+            voice.frequency = sample.loop_frequency * ratio
+            voice.waveform_loop_start = sample.loop_start
+            voice.waveform_loop_end = sample.loop_end
+        else:  # once through the whole buffer, then released by update()
+            self._ends[midi_note] = time.monotonic_ns() + int(sample.duration / ratio * 1_000_000_000)
+        self.voices[midi_note] = voice
+        self._press_notes( (voice,) )
+
+    def note_off(self, midi_note, midi_vel=0):
+        self._ends.pop(midi_note, None)
+        super().note_off(midi_note, midi_vel)
+
+    def note_off_all(self):
+        for n in list(self.voices.keys()):
+            self.note_off(n)
+
+    def update(self):
+        """Release one-shot samples that have played through"""
+        if not self._ends:
+            return
+        now = time.monotonic_ns()
+        for n, end_ns in list(self._ends.items()):
+            if now >= end_ns:
+                voice = self.voices.pop(n, None)
+                del self._ends[n]
+                if voice:
+                    self._release_notes( (voice,) )
@@ -0,0 +1,125 @@
+# qtpy_synth.scheduler.py -- run periodic synth jobs by priority & deadline, on top of asyncio
+# part of https://github.com/todbot/qtpy_synth
+#
+# Instead of a bunch of asyncio tasks each doing "work; await asyncio.sleep(x)"
+# and hoping it all fits, a Scheduler runs plain functions every `period`
+# seconds. When several are due at once, the highest priority one runs first
+# (ties go to the earliest deadline), and between each one the scheduler
+# yields to asyncio so event-driven tasks (like an input handler) still run.
+# So slow, low priority work like display updates waits its turn behind
+# instrument updates and MIDI instead of getting in their way.
+#
+# A job "misses its deadline" if it starts more than `deadline` seconds after
+# it was due. Runs, misses, lateness and run time are kept per job for
+# tuning, see print_stats().
+#
+# Example:
+#   sched = Scheduler()
+#   sched.add(inst.update, period=0.01, priority=PRIO_HIGH, deadline=0.005)
+#   sched.add(wavedisp.refresh, period=0.05, priority=PRIO_LOW)
+#   asyncio.run(asyncio.gather(sched.run(), other_task()))
+
+import asyncio
+import time
+from micropython import const
+
+PRIO_HIGH = const(2)    # audio-related, like instrument updates & MIDI
+PRIO_NORMAL = const(1)
+PRIO_LOW = const(0)     # display, prints, anything that can wait
+
+class Job:
+    def __init__(self, func, period, priority, deadline, name):
+        self.func = func
+        self.name = name
+        self.period_ns = int(period * 1_000_000_000)
+        self.deadline_ns = int(deadline * 1_000_000_000)
+        self.priority = priority
+        self.due_ns = 0          # when it should next run
+        self.runs = 0
+        self.misses = 0          # times it started later than its deadline
+        self.max_late_ns = 0     # worst lateness past due time
+        self.max_run_ns = 0      # longest single run
+        self.total_run_ns = 0
+
+    def __repr__(self):
+        return "Job(%s)" % self.name
+
+
+class Scheduler:
+    def __init__(self, max_sleep=0.01):
+        """
+        max_sleep -- longest the scheduler sleeps at once when nothing is due,
+                     so newly added jobs don't wait too long
+        """
+        self.jobs = []
+        self.max_sleep_ns = int(max_sleep * 1_000_000_000)
+
+    def add(self, func, period, priority=PRIO_NORMAL, deadline=None, name=None):
+        """
+        Run func() every `period` seconds.
+        deadline -- seconds after due time it may start without counting as a miss,
+                    defaults to one period
+        """
+        job = Job(func, period, priority, period if deadline is None else deadline,
+                  name or getattr(func, '__name__', 'job'))
+        job.due_ns = time.monotonic_ns()
+        self.jobs.append(job)
+        return job
+
+    def remove(self, job):
+        self.jobs.remove(job)
+
+    def next_job(self, now):
+        """Most urgent job that's due now, or None"""
+        best = None
+        for job in self.jobs:
+            if job.due_ns > now:
+                continue
+            if (best is None or job.priority > best.priority or
+                (job.priority == best.priority and
+                 job.due_ns + job.deadline_ns < best.due_ns + best.deadline_ns)):
+                best = job
+        return best
+
+    def run_job(self, job, now):
+        late_ns = now - job.due_ns
+        if late_ns > job.deadline_ns:
+            job.misses += 1
+        if late_ns > job.max_late_ns:
+            job.max_late_ns = late_ns
+        job.func()
+        run_ns = time.monotonic_ns() - now
+        job.runs += 1
+        job.total_run_ns += run_ns
+        if run_ns > job.max_run_ns:
+            job.max_run_ns = run_ns
+        job.due_ns += job.period_ns
+        if job.due_ns < now:  # fell more than a period behind, don't try to catch up
+            job.due_ns = now + job.period_ns
+
+    async def run(self):
+        """Run jobs forever, run this as its own asyncio task"""
+        while True:
+            now = time.monotonic_ns()
+            job = self.next_job(now)
+            if job:
+                self.run_job(job, now)
+                await asyncio.sleep(0)  # let other asyncio tasks in
+                continue
+            wait_ns = self.max_sleep_ns
+            for job in self.jobs:
+                wait_ns = min(wait_ns, job.due_ns - now)
+            await asyncio.sleep(max(wait_ns, 0) / 1_000_000_000)
+
+    def reset_stats(self):
+        for job in self.jobs:
+            job.runs = job.misses = 0
+            job.max_late_ns = job.max_run_ns = job.total_run_ns = 0
+
+    def print_stats(self):
+        print("%16s %6s %6s %9s %9s %9s" % ("job", "runs", "misses", "late ms", "max ms", "avg ms"))
+        for job in self.jobs:
+            avg_ns = job.total_run_ns / job.runs if job.runs else 0
+            print("%16s %6d %6d %9.2f %9.2f %9.3f" %
+                  (job.name, job.runs, job.misses, job.max_late_ns / 1_000_000,
+                   job.max_run_ns / 1_000_000, avg_ns / 1_000_000))
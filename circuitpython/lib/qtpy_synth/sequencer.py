@@ -0,0 +1,263 @@
+# qtpy_synth.sequencer.py -- arpeggiator & step sequencer that keep time
+# part of https://github.com/todbot/qtpy_synth
+#
+# A Sequencer plays steps on an Instrument (anything with note_on/note_off),
+# taking notes either from an Arpeggiator (notes being held down on pads or
+# MIDI) or a stored Pattern.
+#
+# Step times are kept as target times on time.monotonic_ns() that are
+# added to (next = next + step), never "now + step", so however late one
+# step happens (asyncio sleep jitter, a display refresh) the next one is
+# still due when it should be: jitter doesn't add up to drift.
+#
+# If a MidiClock is given and external clock is running, steps follow the
+# clock's ticks instead.
+#
+# Example:
+#   arp = Arpeggiator(mode=UPDOWN)
+#   seq = Sequencer(inst, arp, bpm=120, steps_per_beat=4, clock=midi_clock)
+#   arp.press(48); arp.press(52); arp.press(55)
+#   while True:
+#       seq.update()  # or run seq.run() as an asyncio task
+
+import time
+import random
+import asyncio
+from micropython import const
+
+from qtpy_synth.midi_clock import PPQN
+
+REST = const(255)  # pattern note that doesn't play
+
+UP = const(0)
+DOWN = const(1)
+UPDOWN = const(2)
+RANDOM = const(3)
+ORDER = const(4)  # in the order notes were pressed
+
+class Pattern:
+    """Steps of note, velocity, gate length, in a few bytearrays"""
+    def __init__(self, num_steps=16):
+        self.num_steps = num_steps
+        self.notes = bytearray([REST] * num_steps)
+        self.velocities = bytearray([100] * num_steps)
+        self.gates = bytearray([50] * num_steps)  # % of step time note is on
+        self.pos = 0
+
+    def set(self, step, note, velocity=100, gate=50):
+        self.notes[step] = note
+        self.velocities[step] = velocity
+        self.gates[step] = gate
+
+    def clear(self):
+        for i in range(self.num_steps):
+            self.notes[i] = REST
+        self.pos = 0
+
+    def reset(self):
+        self.pos = 0
+
+    def next_step(self):
+        """Returns (note, velocity, gate) of next step, note is REST for silence"""
+        i = self.pos
+        self.pos = (i + 1) % self.num_steps
+        return self.notes[i], self.velocities[i], self.gates[i]
+
+
+class Arpeggiator:
+    """Steps through the notes being held down"""
+    def __init__(self, mode=UP, octaves=1, velocity=100, gate=50, max_notes=16):
+        self.mode = mode
+        self.octaves = octaves
+        self.velocity = velocity
+        self.gate = gate
+        self.held = bytearray(max_notes)  # in press order
+        self.num_held = 0
+        self._sorted = bytearray(max_notes)
+        self.pos = 0
+        self._dir = 1
+
+    def press(self, note):
+        if note in self.held[:self.num_held] or self.num_held == len(self.held):
+            return
+        self.held[self.num_held] = note
+        self.num_held += 1
+        self._sort()
+
+    def release(self, note):
+        held = self.held
+        for i in range(self.num_held):
+            if held[i] == note:
+                for j in range(i, self.num_held - 1):
+                    held[j] = held[j+1]
+                self.num_held -= 1
+                self._sort()
+                return
+
+    def clear(self):
+        self.num_held = 0
+
+    def reset(self):
+        self.pos = 0
+        self._dir = 1
+
+    def _sort(self):
+        n = self.num_held
+        self._sorted[:n] = bytes(sorted(self.held[:n]))
+
+    def next_step(self):
+        """Returns (note, velocity, gate) of next step, note is REST if nothing's held"""
+        n = self.num_held
+        if n == 0:
+            return REST, 0, 0
+        count = n * self.octaves
+        mode = self.mode
+        if mode == RANDOM:
+            i = random.randint(0, count - 1)
+        else:
+            if self.pos >= count:
+                self.pos = 0 if mode != UPDOWN else count - 1
+            i = self.pos
+            if mode == UPDOWN and count > 1:
+                if i + self._dir < 0 or i + self._dir >= count:
+                    self._dir = -self._dir
+                self.pos = i + self._dir
+            else:
+                self.pos = (i + 1) % count
+            if mode == DOWN:
+                i = count - 1 - i
+        octave, j = divmod(i, n)
+        note = (self.held[j] if mode == ORDER else self._sorted[j]) + octave * 12
+        return min(note, 127), self.velocity, self.gate
+
+
+class Sequencer:
+    def __init__(self, inst, source, bpm=120, steps_per_beat=4, clock=None):
+        """
+        inst -- has note_on(note, vel) & note_off(note)
+        source -- an Arpeggiator or Pattern, or anything with next_step()
+        steps_per_beat -- 4 = 16th notes
+        clock -- optional MidiClock to follow when external clock is running
+        """
+        self.inst = inst
+        self.source = source
+        self.steps_per_beat = steps_per_beat
+        self.clock = clock
+        self.playing = False
+        self.bpm = bpm
+        self._next_ns = 0   # when next step is due
+        self._off_ns = 0    # when playing note should be released
+        self._note = REST   # note playing now
+        self._next_tick = 0
+        self.reset_stats()
+
+    @property
+    def bpm(self):
+        return self._bpm
+
+    @bpm.setter
+    def bpm(self, bpm):
+        self._bpm = bpm
+        self.step_ns = int(60_000_000_000 / (bpm * self.steps_per_beat))
+
+    def reset_stats(self):
+        self.steps = 0
+        self.max_late_ns = 0    # worst step lateness, the jitter
+        self.total_late_ns = 0  # for average lateness
+        self.drift_ns = 0       # latest step time minus where it ideally would be
+        self._start_ns = self._next_ns
+
+    def start(self, now=None):
+        now = now or time.monotonic_ns()
+        self.playing = True
+        self.source.reset()
+        self._next_ns = now
+        if self.clock:
+            self._next_tick = self.clock.tick_count
+        self.reset_stats()
+
+    def stop(self):
+        self.playing = False
+        self._release()
+
+    def _release(self):
+        if self._note != REST:
+            self.inst.note_off(self._note)
+            self._note = REST
+
+    def _synced(self, now):
+        clock = self.clock
+        return clock and clock.running and clock.present(now)
+
+    def update(self, now=None):
+        """Play or release notes if it's time to, returns True if a step happened"""
+        if not self.playing:
+            return False
+        now = now or time.monotonic_ns()
+        if self._note != REST and now >= self._off_ns:
+            self._release()
+
+        if self._synced(now):
+            ticks_per_step = PPQN // self.steps_per_beat
+            if self.clock.tick_count < self._next_tick - ticks_per_step:
+                # clock went back, a START after a STOP: go back to the top with it
+                self._next_tick = self.clock.tick_count
+                self.source.reset()
+            if self.clock.tick_count < self._next_tick:
+                return False
+            self._next_tick += ticks_per_step
+            if self.clock.tick_count >= self._next_tick:  # way behind, catch up
+                self._next_tick = self.clock.tick_count + ticks_per_step
+            if self.clock.bpm:
+                self.bpm = self.clock.bpm
+            self._next_ns = now + self.step_ns  # so free-running picks up from here
+            self._start_ns = now - self.steps * self.step_ns
+            self._step(now, now)
+            return True
+
+        due_ns = self._next_ns
+        if now < due_ns:
+            return False
+        self._next_ns = due_ns + self.step_ns  # from when it was due, not from now
+        if now >= self._next_ns:  # over a step behind, skip ahead instead of rushing
+            skipped = (now - due_ns) // self.step_ns
+            self._next_ns = due_ns + (skipped + 1) * self.step_ns
+            self.steps += skipped
+            due_ns += skipped * self.step_ns
+        self._step(now, due_ns)
+        self.drift_ns = now - (self._start_ns + (self.steps - 1) * self.step_ns)
+        return True
+
+    def _step(self, now, due_ns):
+        late_ns = now - due_ns
+        self.steps += 1
+        self.total_late_ns += late_ns
+        if late_ns > self.max_late_ns:
+            self.max_late_ns = late_ns
+
+        self._release()
+        note, velocity, gate = self.source.next_step()
+        if note != REST:
+            self.inst.note_on(note, velocity)
+            self._note = note
+            self._off_ns = now + self.step_ns * gate // 100
+
+    def time_to_next(self, now=None):
+        """Seconds until something needs to happen"""
+        now = now or time.monotonic_ns()
+        next_ns = self._next_ns
+        if self._note != REST:
+            next_ns = min(next_ns, self._off_ns)
+        return max(next_ns - now, 0) / 1_000_000_000
+
+    async def run(self, max_sleep=0.005):
+        """Run forever as an asyncio task, if not calling update() from elsewhere"""
+        while True:
+            self.update()
+            sleep = max_sleep if self._synced(time.monotonic_ns()) else min(self.time_to_next(), max_sleep)
+            await asyncio.sleep(sleep)
+
+    def print_stats(self):
+        avg_ns = self.total_late_ns / self.steps if self.steps else 0
+        print("steps:%d late avg:%.3f max:%.3f ms  drift:%.3f ms" %
+              (self.steps, avg_ns / 1_000_000, self.max_late_ns / 1_000_000, self.drift_ns / 1_000_000))
@@ -4,11 +4,16 @@ import synthio
 from collections import namedtuple
 from micropython import const
 import ulab.numpy as np
+from qtpy_synth.tuning import EQUAL
+
+MAX_SYNTH_NOTES = const(12)  # synthio's polyphony limit, Notes one Synthesizer plays at once
 try:
     import adafruit_wave
 except:
     print("synthio_instrment: no WAV import available")
 
+_READ_CHUNK = const(1024)  # frames read from flash at a time when loading a second wavetable
+
 # mix between values a and b, works with numpy arrays too,  t ranges 0-1
 def lerp(a, b, t):  return (1-t)*a + t*b
 
@@ -17,8 +22,12 @@ class Waves:
     """
     Generate waveforms for either oscillator or LFO use
     """
+    user = []  # waves in RAM that get loaded from outside (e.g. over SysEx), named 'USR0', 'USR1', ...
+
     def make_waveform(waveid, size=512, volume=30000):
         waveid = waveid.upper()
+        if waveid.startswith('USR'):  # the RAM wave itself, not a copy, so loading it is heard right away
+            return Waves.user[int(waveid[3:] or 0)]
         if waveid=='SIN' or waveid=='SINE':
             return Waves.sine(size,volume)
         elif waveid=='SQU' or waveid=='SQUARE':
@@ -34,6 +43,12 @@ class Waves:
         else:
             print("unknown wave type", waveid)
 
+    def make_user(size=256, volume=30000):
+        """A new RAM wave to load into, starts out a sine, returns it. Its name is 'USR<n>'"""
+        wave = Waves.sine(size, volume)
+        Waves.user.append(wave)
+        return wave
+
     def sine(size, volume):
         return np.array(np.sin(np.linspace(0, 2*np.pi, size, endpoint=False)) * volume, dtype=np.int16)
 
@@ -160,6 +175,127 @@ class Wavetable:
         self.w.close()
 
 
+class Wavetable2D(Wavetable):
+    """
+    A Wavetable with a second axis to morph along. Either a table's waves are
+    a grid (e.g. 64 waves as 8x8), or with filepathB, a second table of the
+    same size is the second row, so x scans both tables and y mixes them.
+
+    set_wave_pos2(x, y) mixes the four waves around (x,y), with bilinear
+    weights looked up from a table made once (fractions are quantized to
+    1/WEIGHT_STEPS), in place in preallocated float buffers, so it makes no
+    new arrays. It costs the same wherever (x,y) is and however it got there.
+    set_wave_pos(x) keeps y where it was. The whole wavetable (or both) is
+    held in RAM.
+    """
+    WEIGHT_STEPS = 16
+    _weights = None  # shared by all 2D wavetables, list of (w0,w1,w2,w3) tuples
+
+    def __init__(self, filepath, size=256, grid=None, filepathB=None):
+        self.filepath = filepath
+        self.size = size
+        if filepathB:  # both tables read right into one buffer, no concatenate() copy
+            n = Wavetable2D._num_frames(filepath)
+            if Wavetable2D._num_frames(filepathB) != n:
+                raise ValueError("wavetables not same size")
+            wav = np.zeros(2 * n, dtype=np.int16)
+            Wavetable2D._read_into(filepath, wav, 0)
+            Wavetable2D._read_into(filepathB, wav, n)
+            grid = (n // size, 2)
+        else:
+            wav = Wavetable2D._load(filepath)
+        self.wav = wav
+        self.cols, self.rows = grid or (8, len(wav) // size // 8)
+        if self.cols < 2 or self.rows < 2 or self.cols * self.rows * size > len(wav):
+            raise ValueError("bad wavetable grid")
+        self.num_waves = self.cols  # so x works like a 1D wave_pos
+        self.frames = wav.reshape((len(wav) // size, size))
+        self._quad = np.zeros((4, size))  # the 4 waves being mixed, as floats
+        self._mix = np.zeros(size)  # mixing is done in these two, in place
+        self._tmp = np.zeros(size)
+        self._cell = -1
+        self.wave_pos_y = 0
+        self.waveform = Waves.silence(size)
+        if Wavetable2D._weights is None:
+            Wavetable2D._weights = Wavetable2D._make_weights(Wavetable2D.WEIGHT_STEPS)
+        self.set_wave_pos2(0, 0)
+
+    def _open(filepath):
+        w = adafruit_wave.open(filepath)
+        if w.getsampwidth() != 2 or w.getnchannels() != 1:
+            w.close()
+            raise ValueError("unsupported WAV format")
+        return w
+
+    def _load(filepath):
+        with Wavetable2D._open(filepath) as w:
+            return np.frombuffer(w.readframes(w.getnframes()), dtype=np.int16)
+
+    def _num_frames(filepath):
+        with Wavetable2D._open(filepath) as w:
+            return w.getnframes()
+
+    def _read_into(filepath, buf, pos):
+        """Read a WAV into buf starting at pos, a chunk at a time so it needs little extra RAM"""
+        with Wavetable2D._open(filepath) as w:
+            while True:
+                chunk = np.frombuffer(w.readframes(_READ_CHUNK), dtype=np.int16)
+                if not len(chunk):
+                    break
+                buf[pos:pos+len(chunk)] = chunk
+                pos += len(chunk)
+
+    def _make_weights(steps):
+        """Weights of the 4 corner waves, for each (x,y) fraction"""
+        w = []
+        for i in range(steps + 1):
+            fx = i / steps
+            for j in range(steps + 1):
+                fy = j / steps
+                w.append(((1-fx)*(1-fy), fx*(1-fy), (1-fx)*fy, fx*fy))
+        return w
+
+    def set_wave_pos(self, wave_pos):
+        self.set_wave_pos2(wave_pos, self.wave_pos_y)
+
+    def set_wave_pos2(self, x, y):
+        """x is 0 to cols-1, y is 0 to rows-1, both can be fractional"""
+        x = min(max(x, 0), self.cols-1)
+        y = min(max(y, 0), self.rows-1)
+        self.wave_pos, self.wave_pos_y = x, y
+        x0 = min(int(x), self.cols-2)
+        y0 = min(int(y), self.rows-2)
+
+        cell = y0 * self.cols + x0
+        if cell != self._cell:  # corner waves only change when moving to a new cell
+            q, frames = self._quad, self.frames
+            q[0,:] = frames[cell]
+            q[1,:] = frames[cell + 1]
+            q[2,:] = frames[cell + self.cols]
+            q[3,:] = frames[cell + self.cols + 1]
+            self._cell = cell
+
+        steps = Wavetable2D.WEIGHT_STEPS
+        k = int((x - x0) * steps + 0.5) * (steps + 1) + int((y - y0) * steps + 0.5)
+        w0, w1, w2, w3 = Wavetable2D._weights[k]
+        q, mix, tmp = self._quad, self._mix, self._tmp
+        mix[:] = q[0]
+        mix *= w0
+        tmp[:] = q[1]
+        tmp *= w1
+        mix += tmp
+        tmp[:] = q[2]
+        tmp *= w2
+        mix += tmp
+        tmp[:] = q[3]
+        tmp *= w3
+        mix += tmp
+        self.waveform[:] = mix
+
+    def deinit(self):
+        pass  # files were closed after loading
+
+
 class LFOParams:
     """
     """
@@ -227,6 +363,8 @@ class Patch:
         self.wave_mix = 0.0  # 0 = wave, 1 = waveB
         self.wave_mix_lfo_amount = 3
         self.wave_mix_lfo_rate = 0.5
+        self.wave_grid = None  # (cols,rows) to morph a wavetable as a 2D grid, like (8,8)
+        self.wave_morph = 0.0  # 0-1 position on 2nd axis, of wave_grid or between wavetables wave & waveB
         self.wave_dir = '/wav'
         self.detune = detune
         self.filt_type = filt_type   # allowed values:
@@ -234,6 +372,9 @@ class Patch:
         self.filt_q = filt_q
         self.filt_env_params = filt_env_params or EnvParams()
         self.amp_env_params = amp_env_params or EnvParams()
+        self.sample_dir = '/samples'
+        self.samples = []  # WAVs a SampleInstrument preloads, name or (name, loop_start, loop_end)
+        self.sample_note = 36  # MIDI note of first sample
 
     def wave_select(self):
         """Construct a 'wave_select' string from patch parts"""
@@ -255,28 +396,80 @@ class Patch:
 
 # a very simple instrument
 class Instrument():
+    oscs_per_voice = 1  # how many synthio.Notes each voice uses
 
     def __init__(self, synth, patch=None):
         self.synth = synth
         self.patch = patch or Patch('init')
         self.voices = {}  # keys = midi note, vals = oscs
+        self.tuning = EQUAL  # or a qtpy_synth.tuning.Tuning loaded from a Scala file
+        # batch mode: note_on/note_off only collect what to press & release, and
+        # flush() does it all in one synth.change(), so chords start together
+        self.batch = False
+        self._press = []
+        self._release = []
+        self._blocks = []  # LFOs to start along with the pressed notes
 
     def update(self):
         for v in self.voices:
             print("note:",v)
 
+    def notes_used(self, num_voices=None):
+        """How many synthio.Notes this uses with num_voices held (default: as many as are now)"""
+        if num_voices is None:
+            num_voices = len(self.voices)
+        return num_voices * self.oscs_per_voice
+
+    def _press_notes(self, notes, blocks=()):
+        if self.batch:
+            self._press.extend(notes)
+            self._blocks.extend(blocks)
+        else:
+            self.synth.press(notes)
+            for b in blocks:
+                self.synth.blocks.append(b)
+
+    def _release_notes(self, notes, blocks=()):
+        if self.batch:
+            for n in notes:
+                if n in self._press:  # never got started, just forget it
+                    self._press.remove(n)
+                else:
+                    self._release.append(n)
+        else:
+            self.synth.release(notes)
+        for b in blocks:
+            if b in self._blocks:
+                self._blocks.remove(b)
+            else:
+                self.synth.blocks.remove(b)
+
+    def flush(self):
+        """In batch mode, apply all the collected note changes in one synth call"""
+        if not (self._press or self._release):
+            return
+        for b in self._blocks:
+            self.synth.blocks.append(b)
+        self.synth.change(release=self._release, press=self._press)
+        self._press.clear()
+        self._release.clear()
+        self._blocks.clear()
+
     def note_on(self, midi_note, midi_vel=127):
-        # FIXME: deal with multiple note_ons of same note
-        f = synthio.midi_to_hz(midi_note)
+        f = self.tuning.midi_to_hz(midi_note)
+        if not f:  # not in this tuning's keyboard map
+            return
+        if midi_note in self.voices:  # retrigger, release the old voice instead of losing it
+            self.note_off(midi_note)
         amp_env = self.patch.amp_env_params.make_env()
         voice = synthio.Note( frequency=f, envelope=amp_env )
         self.voices[midi_note] = voice
-        self.synth.press( voice )
+        self._press_notes( (voice,) )
 
     def note_off(self, midi_note, midi_vel=0):
         voice = self.voices.get(midi_note, None)
         if voice:
-            self.synth.release(voice)
+            self._release_notes( (voice,) )
             self.voices.pop(midi_note)  # FIXME: need to run filter after release cycle
 
 #
@@ -293,6 +486,7 @@ class WavePolyTwoOsc(Instrument):
     This is a two-oscillator per voice subtractive synth patch
     with a low-pass filter w/ filter envelope and an amplitude envelope
     """
+    oscs_per_voice = 2
     def __init__(self, synth, patch):
         super().__init__(synth)
         self.load_patch(patch)
@@ -305,7 +499,7 @@ class WavePolyTwoOsc(Instrument):
 
         self.synth.blocks.clear()   # remove any global LFOs
 
-        raw_lfo1 = synthio.LFO(rate = 0.3)  #, scale=0.5, offset=0.5)  # FIXME: set lfo rate by patch param
+        raw_lfo1 = synthio.LFO(rate = patch.wave_mix_lfo_rate)  #, scale=0.5, offset=0.5)
         lfo1 = synthio.Math( synthio.MathOperation.SCALE_OFFSET, raw_lfo1, 0.5, 0.5) # unipolar
         self.wave_lfo = lfo1
         self.synth.blocks.append(lfo1)  # global lfo for wave_lfo
@@ -322,13 +516,19 @@ class WavePolyTwoOsc(Instrument):
 
         # wavetable patch
         elif patch.wave_type == WaveType.WTB:
-            self.wavetable = Wavetable(patch.wave_dir+"/"+patch.wave+".WAV")
+            if patch.wave_grid or patch.waveB:
+                pathB = patch.wave_dir+"/"+patch.waveB+".WAV" if patch.waveB else None
+                self.wavetable = Wavetable2D(patch.wave_dir+"/"+patch.wave+".WAV",
+                                             grid=patch.wave_grid, filepathB=pathB)
+            else:
+                self.wavetable = Wavetable(patch.wave_dir+"/"+patch.wave+".WAV")
             self.waveform = self.wavetable.waveform
 
         self.filt_env_wave = Waves.lfo_triangle()
 
     def reload_patch(self):
         self.note_off_all()
+        self.flush()
         self.synth.blocks.clear()  # clear out global wavetable LFOs (if any)
         self.load_patch(self.patch)
 
@@ -337,10 +537,13 @@ class WavePolyTwoOsc(Instrument):
 
             # let Wavetable do the work  # FIXME: don't need to do this per osc1 yeah?
             if self.patch.wave_type == WaveType.WTB:
-                self.wave_lfo.a.rate = self.patch.wave_mix_lfo_rate  # FIXME: danger
                 wave_pos = self.wave_lfo.value * self.patch.wave_mix_lfo_amount * 10
                 wave_pos += self.patch.wave_mix * self.wavetable.num_waves
-                self.wavetable.set_wave_pos( wave_pos )
+                if self.patch.wave_grid or self.patch.waveB:
+                    wave_pos_y = self.patch.wave_morph * (self.wavetable.rows - 1)
+                    self.wavetable.set_wave_pos2( wave_pos, wave_pos_y )
+                else:
+                    self.wavetable.set_wave_pos( wave_pos )
 
             # else simple osc wave mixing
             else:
@@ -385,7 +588,17 @@ class WavePolyTwoOsc(Instrument):
             if self.patch.detune:
                 osc2.filter = filt
 
+    def set_wave_lfo_rate(self, rate):
+        """Set wave mix LFO rate, e.g. from a MidiClock, without touching anything else"""
+        self.patch.wave_mix_lfo_rate = rate
+        self.wave_lfo.a.rate = rate
+
     def note_on(self, midi_note, midi_vel=127):
+        f = self.tuning.midi_to_hz(midi_note)
+        if not f:  # not in this tuning's keyboard map
+            return
+        if midi_note in self.voices:  # retrigger, release old oscs & filt_env instead of leaking them
+            self.note_off(midi_note)
         amp_env = self.patch.amp_env_params.make_env()
 
         #filt_env = self.patch.filt_env_params.make_env()  # synthio.Envelope.value does not exist
@@ -394,21 +607,18 @@ class WavePolyTwoOsc(Instrument):
                                waveform=self.filt_env_wave,
                                rate=self.patch.filt_env_params.attack_time, ) # always positve
 
-        f = synthio.midi_to_hz(midi_note)
         osc1 = synthio.Note( frequency=f, waveform=self.waveform, envelope=amp_env )
         osc2 = synthio.Note( frequency=f * self.patch.detune, waveform=self.waveform, envelope=amp_env )
 
         self.voices[midi_note] = (osc1, osc2, filt_env, amp_env)
-        self.synth.press( (osc1,osc2) )
-        self.synth.blocks.append(filt_env) # not tracked automaticallly by synthio
+        self._press_notes( (osc1,osc2), (filt_env,) ) # filt_env not tracked automaticallly by synthio
 
     def note_off(self, midi_note, midi_vel=0):
         (osc1,osc2,filt_env,amp_env) = self.voices.get(midi_note, (None,None,None,None)) # FIXME
         #print("note_off:",osc1)
         if osc1:  # why this check? in case user tries to note_off a non-existant note
-            self.synth.release( (osc1,osc2) )
             self.voices.pop(midi_note)  # FIXME: let filter run on release, check amp_env?
-            self.synth.blocks.remove(filt_env)  # FIXME: figure out how to release after note is done
+            self._release_notes( (osc1,osc2), (filt_env,) )  # FIXME: figure out how to release filt_env after note is done
         #print("note_off: blocks:", self.synth.blocks)
 
     def note_off_all(self):
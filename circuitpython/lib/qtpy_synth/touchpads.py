@@ -0,0 +1,83 @@
+# qtpy_synth.touchpads.py -- background capacitive touch pad scanning
+# part of https://github.com/todbot/qtpy_synth
+#
+# Each capacitive touch measurement takes a while, so instead of reading all
+# pads every time, TouchScanner measures just one pad per update(), going
+# round-robin. That keeps the worst-case time of an input pass to one read.
+#
+# Each pad has a baseline that slowly follows its untouched reading, so
+# drift from temperature, humidity, or how the board is held doesn't cause
+# stuck or dead pads. A pad is pressed when its reading goes far enough
+# above the baseline, and released when it falls back below a lower level
+# (hysteresis). While pressed, `pressures` holds a smoothed
+# "how hard/how much finger" value (reading minus baseline).
+
+import time
+import keypad
+import touchio
+
+class TouchScanner:
+    def __init__(self, pins, interval=0.005, sensitivity=0.1, min_delta=100,
+                 release_ratio=0.7, baseline_filt=0.02, pressure_filt=0.5):
+        """
+        pins -- touch pins, pad numbers are their index
+        interval -- seconds between pad measurements, each pad is read every len(pins)*interval
+        sensitivity -- press when reading goes this fraction above baseline (plus min_delta)
+        min_delta -- minimum raw count above baseline for a press
+        release_ratio -- release when below this fraction of the press level (hysteresis)
+        baseline_filt -- how fast the baseline follows untouched readings (0-1)
+        pressure_filt -- 0-1 IIR filter amount for pressure, higher = smoother
+        """
+        self.touchins = [touchio.TouchIn(pin) for pin in pins]
+        self.num_pads = len(pins)
+        self.interval_ns = int(interval * 1_000_000_000)
+        self.sensitivity = sensitivity
+        self.min_delta = min_delta
+        self.release_ratio = release_ratio
+        self.baseline_filt = baseline_filt
+        self.pressure_filt = pressure_filt
+        self.baselines = [t.raw_value for t in self.touchins]
+        self.pressures = [0] * self.num_pads
+        self.pressed = [False] * self.num_pads
+        self._pos = 0
+        self._next_ns = 0
+
+    def press_level(self, i):
+        """How far above baseline pad i must read to count as pressed"""
+        return self.baselines[i] * self.sensitivity + self.min_delta
+
+    def update(self, now=None):
+        """
+        Measure the next pad if it's time to.
+        Returns a keypad.Event if that pad was pressed or released, else None
+        """
+        now = now or time.monotonic_ns()
+        if now < self._next_ns:
+            return None
+        self._next_ns = now + self.interval_ns
+
+        i = self._pos
+        self._pos = (i + 1) % self.num_pads
+        raw = self.touchins[i].raw_value
+        delta = raw - self.baselines[i]
+        press_level = self.press_level(i)
+
+        if self.pressed[i]:
+            f = self.pressure_filt
+            self.pressures[i] = f * self.pressures[i] + (1-f) * delta
+            if delta < press_level * self.release_ratio:
+                self.pressed[i] = False
+                self.pressures[i] = 0
+                return keypad.Event(i, False)
+        else:
+            # follow untouched drift, and drop right away if reading goes below baseline.
+            # don't follow a finger slowly coming in though
+            if delta < 0:
+                self.baselines[i] = raw
+            elif delta < press_level / 2:
+                self.baselines[i] += self.baseline_filt * delta
+            if delta > press_level:
+                self.pressed[i] = True
+                self.pressures[i] = delta
+                return keypad.Event(i, True)
+        return None
@@ -0,0 +1,146 @@
+# qtpy_synth.tuning.py -- microtuning from Scala .scl/.kbm files, as note frequency tables
+# part of https://github.com/todbot/qtpy_synth
+#
+# A Tuning is just a 128-entry table of the frequency of each MIDI note.
+# Loading a Scala scale (.scl) and optional keyboard mapping (.kbm) parses
+# the files and builds the table once, so playing a note is the same table
+# lookup whether it's 12-TET or something stranger. Switching tunings is
+# just using a different Tuning object.
+#
+# See https://www.huygens-fokker.org/scala/scl_format.html and
+# https://www.huygens-fokker.org/scala/help.htm#mappings for the file formats.
+#
+# Example:
+#   tuning = load_tuning('/tunings/just.scl')
+#   inst.tuning = tuning
+#   f = tuning.midi_to_hz(60, bend=0.5)  # middle C, bent up half a semitone
+
+import math
+from array import array
+from qtpy_synth.pitch import NUM_NOTES, note_freqs, semitones_to_ratio, midi_to_hz, hz_to_midi
+
+def _lines(path):
+    """Non-comment lines of a Scala file, stripped"""
+    with open(path) as f:
+        for line in f:
+            line = line.strip()
+            if not line.startswith('!'):
+                yield line
+
+def _pitch_to_ratio(s):
+    """Scala pitch value: has a '.' = cents, else a ratio like '3/2' or '2'"""
+    s = s.split()[0] if s else '1'
+    if '.' in s:
+        return math.pow(2, float(s) / 1200)
+    if '/' in s:
+        num, den = s.split('/')
+        return int(num) / int(den)
+    return int(s)
+
+def parse_scl(path):
+    """Returns (description, list of ratios), last ratio is the period (usually 2/1)"""
+    lines = _lines(path)
+    description = next(lines)
+    count = int(next(lines).split()[0])
+    ratios = [_pitch_to_ratio(next(lines)) for _ in range(count)]
+    return description, ratios
+
+class KeyboardMap:
+    """What a .kbm file says, defaults are a linear map with A4 = 440 Hz"""
+    def __init__(self):
+        self.size = 0           # 0 = linear, every key is the next scale degree
+        self.first_note = 0
+        self.last_note = NUM_NOTES - 1
+        self.middle_note = 60   # note where scale degree 0 is
+        self.ref_note = 69
+        self.ref_freq = 440.0
+        self.octave_degree = 0  # scale degree the mapping repeats at, 0 = scale size
+        self.mapping = []       # scale degree for each key in the map, None = unmapped
+
+def parse_kbm(path):
+    kbm = KeyboardMap()
+    lines = [l for l in _lines(path) if l]
+    vals = [l.split()[0] for l in lines]
+    kbm.size = int(vals[0])
+    kbm.first_note = int(vals[1])
+    kbm.last_note = int(vals[2])
+    kbm.middle_note = int(vals[3])
+    kbm.ref_note = int(vals[4])
+    kbm.ref_freq = float(vals[5])
+    kbm.octave_degree = int(vals[6])
+    kbm.mapping = [None if v.lower() == 'x' else int(v) for v in vals[7:7+kbm.size]]
+    kbm.mapping += [None] * (kbm.size - len(kbm.mapping))  # missing entries are unmapped
+    return kbm
+
+
+class Tuning:
+    def __init__(self, ratios=None, kbm=None, name="12-TET"):
+        """
+        ratios -- scale ratios from parse_scl(), None for 12-TET
+        kbm -- KeyboardMap from parse_kbm(), None for the default one
+        Unmapped notes have a frequency of 0.
+        """
+        self.name = name
+        self.pitches = None  # each entry's 12-TET note number, for gliding between entries
+        if ratios is None and kbm is None:
+            self.freqs = note_freqs  # plain 12-TET, share pitch's table
+            return
+        ratios = ratios or [semitones_to_ratio(i) for i in range(1, 13)]
+        kbm = kbm or KeyboardMap()
+        self.freqs = array('f', [0] * NUM_NOTES)
+        ref_ratio = self._note_ratio(kbm.ref_note, ratios, kbm) or 1
+        for n in range(kbm.first_note, min(kbm.last_note, NUM_NOTES - 1) + 1):
+            r = self._note_ratio(n, ratios, kbm)
+            if r is not None:
+                self.freqs[n] = kbm.ref_freq * r / ref_ratio
+        self.pitches = array('f', [hz_to_midi(f) if f else 0 for f in self.freqs])
+
+    @staticmethod
+    def _note_ratio(note, ratios, kbm):
+        """Ratio of note's pitch to the middle note's, or None if unmapped"""
+        num_degrees = len(ratios)
+        steps = note - kbm.middle_note
+        if kbm.size:
+            reps, i = divmod(steps, kbm.size)
+            degree = kbm.mapping[i]
+            if degree is None:
+                return None
+            degree += reps * (kbm.octave_degree or num_degrees)
+        else:
+            degree = steps
+        periods, degree = divmod(degree, num_degrees)
+        r = math.pow(ratios[-1], periods)
+        if degree:
+            r *= ratios[degree - 1]
+        return r
+
+    def midi_to_hz(self, note, bend=0):
+        """
+        Frequency of a MIDI note in this tuning, fractional notes glide between
+        table entries (evenly in pitch, not in Hz). Notes past either end of the
+        table stay at the end note, and there's no gliding to or from an
+        unmapped note. bend is extra pitch bend in (12-TET) semitones.
+        """
+        if self.pitches is None:  # 12-TET, pitch does it exactly, even off the ends
+            f = midi_to_hz(note)
+        else:
+            i = min(max(int(note), 0), NUM_NOTES - 1)
+            f = self.freqs[i]
+            t = note - i
+            if t > 0 and i < NUM_NOTES - 1 and f and self.freqs[i+1]:
+                p = self.pitches[i]
+                f = midi_to_hz(p + t * (self.pitches[i+1] - p))
+        if bend:
+            f *= semitones_to_ratio(bend)
+        return f
+
+    def __repr__(self):
+        return "Tuning('%s')" % self.name
+
+EQUAL = Tuning()  # standard 12-TET, A4 = 440 Hz
+
+def load_tuning(scl_path, kbm_path=None):
+    """Make a Tuning from a Scala .scl file and optional .kbm keyboard mapping"""
+    description, ratios = parse_scl(scl_path)
+    kbm = parse_kbm(kbm_path) if kbm_path else None
+    return Tuning(ratios, kbm, description or scl_path)
@@ -25,6 +25,8 @@ __repo__ = "https://github.com/theacodes/Winterbloom_SmolMIDI.git"
 
 """A minimalist MIDI library."""
 
+import time
+
 # Message type constants.
 NOTE_OFF = 0x80
 NOTE_ON = 0x90
@@ -69,12 +71,18 @@ def _is_channel_message(status_byte):
     return status_byte >= NOTE_OFF and status_byte <= PITCH_BEND + 0x0F
 
 
-def _read_n_bytes(port, buf, dest, num_bytes):
+def _read_n_bytes(readinto, buf, dest, num_bytes):
     while num_bytes:
-        if port.readinto(buf):
+        if readinto(buf):
             dest.append(buf[0])
             num_bytes -= 1
 
+# Size of the chunks read from the port when receiving sysex in bulk.
+_SYSEX_CHUNK_SIZE = 64
+_NO_BUF = bytearray(0)
+# Most real-time messages (CLOCK etc) kept while a sysex is being received.
+_REALTIME_QUEUE_SIZE = 32
+
 class Message:
     def __init__(self):
         self.type = None
@@ -97,20 +105,47 @@ class MidiIn:
         self._running_status = None
         self._outstanding_sysex = False
         self._error_count = 0
+        # Bulk sysex reads can read past the end of a sysex message,
+        # the bytes after SYSEX_END are kept here for the next receive().
+        self._chunk = bytearray(_SYSEX_CHUNK_SIZE)
+        self._pending = bytearray(_SYSEX_CHUNK_SIZE)
+        self._pending_pos = 0
+        self._pending_end = 0
+        # Real-time bytes that came in during a sysex, given out by receive().
+        self._realtime = bytearray(_REALTIME_QUEUE_SIZE)
+        self._realtime_count = 0
+        # Progress of a sysex being received, -1 = none.
+        self._sysex_length = -1
+        self._sysex_truncated = False
+        self._sysex_deadline = 0
 
     @property
     def error_count(self):
         return self._error_count
 
+    def _readinto(self, buf):
+        # Drain bytes left over from a bulk sysex read before reading the port.
+        if self._pending_pos < self._pending_end:
+            buf[0] = self._pending[self._pending_pos]
+            self._pending_pos += 1
+            return 1
+        return self._port.readinto(buf)
+
     def receive(self):
         # Before we do anything, check and see if there's an unprocessed
         # sysex message pending. If so, throw it away. The caller has
         # to call receive_sysex if they care about the bytes.
+        if self._realtime_count:
+            return self._next_realtime()
         if self._outstanding_sysex:
-            self.receive_sysex(0)
+            if self._sysex_length >= 0:
+                return None  # caller is still receiving it with block=False
+            self.receive_sysex_into(_NO_BUF)
+            if self._realtime_count:
+                return self._next_realtime()
 
         # Read the status byte for the next message.
-        result = self._port.readinto(self._read_buf)
+        result = self._readinto(self._read_buf)
 
         # No message ready.
         if not result:
@@ -147,10 +182,10 @@ class MidiIn:
 
         # Read the appropriate number of bytes for each message type.
         if message.type in _LEN_2_MESSAGES:
-            _read_n_bytes(self._port, self._read_buf, data_bytes, 2 - len(data_bytes))
+            _read_n_bytes(self._readinto, self._read_buf, data_bytes, 2 - len(data_bytes))
             message.data = data_bytes
         elif message.type in _LEN_1_MESSAGES:
-            _read_n_bytes(self._port, self._read_buf, data_bytes, 1 - len(data_bytes))
+            _read_n_bytes(self._readinto, self._read_buf, data_bytes, 1 - len(data_bytes))
             message.data = data_bytes
 
         # If this is a sysex message, set the pending sysex flag so we
@@ -169,7 +204,16 @@ class MidiIn:
 
         return message
 
-    def receive_sysex(self, max_length):
+    def _next_realtime(self):
+        message = Message()
+        message.type = self._realtime[0]
+        self._realtime_count -= 1
+        rt = self._realtime
+        for i in range(self._realtime_count):
+            rt[i] = rt[i+1]
+        return message
+
+    def receive_sysex(self, max_length, timeout=0.5):
         """Receives the next outstanding sysex message.
 
         Returns a tuple: the first item is the bytearray of the
@@ -179,30 +223,93 @@ class MidiIn:
         This must only be called after getting a sysex message from
         receive and must be called before invoking receive again.
         """
-        self._outstanding_sysex = False
+        out = bytearray(max_length)
+        length, truncated = self.receive_sysex_into(out, timeout)
+        return out[:length], truncated
+
+    def receive_sysex_into(self, buf, timeout=0.5, block=True):
+        """Receives the next outstanding sysex message into a preallocated buffer.
+
+        The port is read in chunks instead of one byte at a time. At most
+        len(buf) data bytes are stored, the rest of the message is discarded.
+        Gives up if SYSEX_END hasn't arrived within `timeout` seconds.
+        Real-time messages (like CLOCK) in the middle of the sysex are kept
+        and returned by the next receive() calls, in order.
+
+        If block is False, reads only what's arrived so far and returns None
+        if the message isn't all here yet. Call again (with the same buf)
+        until it returns, receive() only gives real-time messages meanwhile.
 
-        out = bytearray()
-        length = 0
-        buf = bytearray(1)
-        truncated = False
-
-        # This reads one byte at a time so we don't read past the
-        # end byte. There may be more efficient ways to do this
-        # but sysex messages should be relatively rare in practice,
-        # so I'm not sure how much benefit we'll get.
-        while length < max_length:
-            self._port.readinto(buf)
-            if buf[0] == SYSEX_END:
+        Returns a tuple: the number of bytes stored in buf and a boolean
+        that indicates if the message was truncated (too long, timed out,
+        or interrupted by another status byte).
+
+        Like receive_sysex, this must only be called after getting a sysex
+        message from receive and before invoking receive again.
+        """
+        if self._sysex_length < 0:  # starting a new message
+            self._sysex_length = 0
+            self._sysex_truncated = False
+            self._sysex_deadline = time.monotonic_ns() + int(timeout * 1_000_000_000)
+
+        while True:
+            if self._sysex_read(buf):
                 break
-            out.extend(buf)
-            length += 1
+            if time.monotonic_ns() > self._sysex_deadline:
+                self._sysex_truncated = True
+                break
+            if not block:
+                return None
 
-        # We exceeded the length.
+        self._outstanding_sysex = False
+        length, self._sysex_length = self._sysex_length, -1
+        return length, self._sysex_truncated
+
+    def _sysex_read(self, buf):
+        """Read sysex bytes that have arrived into buf, returns True at the end of the message"""
+        # Use up any leftover bytes before reading more from the port.
+        if self._pending_pos < self._pending_end:
+            src = self._pending
+            start, end = self._pending_pos, self._pending_end
         else:
-            truncated = True
-            # Ignore the rest of the message by reading and throwing away
-            # bytes until we get to SYSEX_END.
-            while buf[0] != SYSEX_END:
-                self._port.readinto(buf)
-
-        return out, truncated
+            end = self._port.readinto(self._chunk)
+            if not end:
+                return False
+            src = self._chunk
+            start = 0
+
+        max_length = len(buf)
+        length = self._sysex_length
+        i = start
+        done = False
+        while i < end:
+            b = src[i]
+            i += 1
+            if b & 0x80:
+                if b >= CLOCK:  # real-time messages may be interleaved, save them for receive()
+                    if self._realtime_count < len(self._realtime):
+                        self._realtime[self._realtime_count] = b
+                        self._realtime_count += 1
+                    continue
+                if b != SYSEX_END:
+                    # Some other status byte, the sysex end got lost.
+                    # Leave the status byte for the next receive().
+                    i -= 1
+                    self._sysex_truncated = True
+                done = True
+                break
+            if length < max_length:
+                buf[length] = b
+                length += 1
+            else:
+                self._sysex_truncated = True
+        self._sysex_length = length
+
+        # Keep anything after the end of the message for receive().
+        if src is self._pending:
+            self._pending_pos = i
+        elif i < end:
+            self._pending[0 : end - i] = memoryview(self._chunk)[i:end]
+            self._pending_pos = 0
+            self._pending_end = end - i
+        return done
@@ -19,6 +19,7 @@ from adafruit_display_text import bitmap_label as label
 
 from qtpy_synth.hardware import Hardware
 import qtpy_synth.winterbloom_smolmidi as smolmidi
+from qtpy_synth.tuning import EQUAL, load_tuning
 
 class SynthConfig():
     def __init__(self):
@@ -31,6 +32,9 @@ qts = Hardware()
 cfg = SynthConfig()
 
 touch_midi_notes = [40, 48, 52, 60] # can be float
+tuning_scl = None  # Scala tuning file, like '/tunings/just.scl', None = 12-TET
+tuning_kbm = None  # Scala keyboard mapping file for it, optional
+tuning = load_tuning(tuning_scl, tuning_kbm) if tuning_scl else EQUAL
 notes_playing = {}  # dict of notes currently playing
 
 # let's get the midi going
@@ -74,7 +78,7 @@ def display_update():
 def note_on( notenum, vel=64):
     print("note_on", notenum, vel)
     cfg.filter_mod = (vel/127) * 1500
-    f = synthio.midi_to_hz(notenum)
+    f = tuning.midi_to_hz(notenum)
     note = synthio.Note( frequency=f, waveform=wave_saw, filter=make_filter() )
     notes_playing[notenum] = note
     qts.synth.press( note )
@@ -120,7 +124,7 @@ async def display_updater():
 
 async def input_handler():
     while True:
-        (knobA, knobB) = qts.read_pots()
+        knobs_moved = qts.check_knobs()
 
         if key := qts.check_key():
             if key.pressed:
@@ -134,8 +138,9 @@ async def input_handler():
 
         qts.check_touch_hold(touch_hold)
 
-        cfg.filter_f = map_range( knobA, 0,65535, 30, 8000)
-        cfg.filter_q = map_range( knobB, 0,65535, 0.1, 3.0)
+        if knobs_moved:
+            cfg.filter_f = map_range( qts.knobA, 0,65535, 30, 8000)
+            cfg.filter_q = map_range( qts.knobB, 0,65535, 0.1, 3.0)
 
         await asyncio.sleep(0.01)
 
@@ -18,17 +18,46 @@ import time
 import usb_midi
 
 from qtpy_synth.hardware import Hardware
-from qtpy_synth.synthio_instrument import WavePolyTwoOsc, Patch, FiltType
+from qtpy_synth.input_events import KEY, KEY_HOLD, TOUCH, KNOB
+from qtpy_synth.synthio_instrument import WavePolyTwoOsc, Patch, FiltType, WaveType, Waves
+from qtpy_synth.granular import GranularInstrument
+from qtpy_synth.tuning import load_tuning
 import qtpy_synth.winterbloom_smolmidi as smolmidi
+from qtpy_synth.patch_sysex import PatchSysex
+from qtpy_synth.midi_clock import MidiClock
+from qtpy_synth.midi_router import ChannelRouter
+from qtpy_synth.midi_out import MidiOut, CCController
+from qtpy_synth.scheduler import Scheduler, PRIO_HIGH, PRIO_LOW
+from qtpy_synth.sequencer import Sequencer, Arpeggiator, UP, DOWN, UPDOWN, RANDOM, ORDER
 
 from wavesynth_display import WavesynthDisplay
+from wavesynth_params import make_knob_modes, find_wave_selects
 
 import microcontroller
 microcontroller.cpu.frequency = 250_000_000
 
 time.sleep(2)  # let USB settle down
 
+latency_profile = 'safe'  # or 'balanced' or 'live', see check_latency below
+check_latency = False  # measure if display + instrument updates fit in the audio buffer
+print_sched_stats = False  # print scheduler timing stats every few seconds, for tuning
 touch_midi_notes = [40, 48, 52, 55] # can be float
+touch_mode = 'note'  # or 'chord' = pads play touch_chord, 'strum' = same but strummed
+touch_chord = (0, 4, 7, 12)  # semitones above pad note for chord & strum modes
+strum_time = 0.03  # seconds between strummed notes
+tuning_scl = None  # Scala tuning file, like '/tunings/just.scl', None = 12-TET
+tuning_kbm = None  # Scala keyboard mapping file for it, optional
+arp_mode = None  # or UP, DOWN, UPDOWN, RANDOM, ORDER to arpeggiate held pads & MIDI notes
+arp_bpm = 120  # arp tempo, 16th notes, follows MIDI clock instead when there is one
+midi_controller_mode = False  # send knobs & pads out as CCs, to control other gear
+knob_ccs = (74, 71)  # CCs for knobA & knobB in controller mode
+touch_ccs = (20, 21, 22, 23)  # CCs for touch pads in controller mode
+granular = False  # play grains of the wavetable instead: mix = position, wlfo = spray, detun = pitch jitter
+grain_pool = 8  # most grains at once, each is a synthio voice
+grain_density = 30  # grains per second
+grain_time = 0.08  # seconds per grain
+wave_morph_control = None  # or 'knob' = knobB on line 2, 'touch' = pad pressure, sweeps 2nd wavetable axis
+touch_morph_range = 2000  # touch pressure for full wave_morph
 
 patch1 = Patch('oneuno')
 patch2 = Patch('twotoo')
@@ -48,86 +77,208 @@ patch2.amp_env_params.release_time = 1.0
 patch3.waveformB = 'square'  # show off wavemixing
 patch3.filt_type = FiltType.BP
 
-patch4.wave_type = 'wtb'
+patch4.wave_type = WaveType.WTB
 patch4.wave = 'PLAITS02'  # 'MICROW02' 'BRAIDS04'
 patch4.wave_mix_lfo_amount = 0.23
 #patch4.detune = 0  # disable 2nd oscillator
 patch4.amp_env_params.release_time = 0.5
+if wave_morph_control:
+    patch4.wave_grid = (8, 8)  # PLAITS02's 64 waves as an 8x8 grid, mix = x, morph = y
 
 print("--- qtpy_synth wavesynth starting up ---")
 
-qts = Hardware()
-inst = WavePolyTwoOsc(qts.synth, patch4)
-wavedisp = WavesynthDisplay(qts.display, inst.patch)
+qts = Hardware(latency=latency_profile)
+sysex_wave = Waves.make_user()  # "USR0" in patches, a desktop editor loads it over sysex
+if granular:
+    inst = GranularInstrument(qts.synth, patch4, num_grains=grain_pool)
+    inst.density = grain_density
+    inst.grain_time = grain_time
+else:
+    inst = WavePolyTwoOsc(qts.synth, patch4)
+inst.batch = True  # notes collected each tick start together with inst.flush()
+if tuning_scl:  # touch pads & MIDI notes all play through the instrument's tuning
+    inst.tuning = load_tuning(tuning_scl, tuning_kbm)
+    print("tuning:", inst.tuning)
+
+def select_wave(patch, wave_select):
+    print("reload patch!", wave_select)
+    patch.set_by_wave_select( wave_select )
+    inst.reload_patch()
+
+# what the knobs edit in each knob mode, also what the display shows
+knob_modes = make_knob_modes(find_wave_selects(inst.patch.wave_dir), select_wave,
+                             morph_knob=(wave_morph_control == 'knob'))
+wavedisp = WavesynthDisplay(qts.display, inst.patch, knob_modes)
+
+if check_latency:
+    inst.note_on(48)
+    inst.flush()
+    qts.check_underrun_risk(lambda: (inst.update(), wavedisp.display_update()))
+    inst.note_off(48)
+    inst.flush()
 
 # let's get the midi going
 midi_usb_in = smolmidi.MidiIn(usb_midi.ports[0])
 midi_uart_in = smolmidi.MidiIn(qts.midi_uart)
 
-def map_range(s, a1, a2, b1, b2):  return  b1 + ((s - a1) * (b2 - b1) / (a2 - a1))
+# MIDI out over USB: soft thru of serial MIDI in, touch pad notes, knob CCs
+midi_usb_out = MidiOut(usb_midi.ports[1])
+midi_controller = CCController(midi_usb_out)
 
+# let a desktop editor dump/load patches & sysex_wave over sysex
+patch_sysex = PatchSysex(midi_usb_out, list(patches), [sysex_wave])
 
-async def instrument_updater():
-    while True:
-        inst.update()
-        await asyncio.sleep(0.01)  # as fast as possible
-
-async def display_updater():
-    while True:
-        wavedisp.display_update()
-        await asyncio.sleep(0.1)
-
-
-async def midi_handler():
-    while True:
-        while msg := midi_usb_in.receive() or midi_uart_in.receive():
-            if msg.type == smolmidi.NOTE_ON:
-                inst.note_on(msg.data[0])
-                qts.led.fill(0xff00ff)
-            elif msg.type == smolmidi.NOTE_OFF:
-                inst.note_off(msg.data[0])
-                qts.led.fill(0x000000)
-            elif msg.type == smolmidi.CC:
-                ccnum = msg.data[0]
-                ccval = msg.data[1]
-                qts.led.fill(ccval)
-                if ccnum == 71:  # "sound controller 1"
-                    new_wave_mix = ccval/127
-                    print("wave_mix:", new_wave_mix)
-                    inst.patch.wave_mix = new_wave_mix
-                elif ccnum == 1: # mod wheel
-                    inst.patch.wave_mix_lfo_amount = ccval/127 * 50
-                    #inst.patch.wave_mix_lfo_rate = msg.value/127 * 5
-                elif ccnum == 74: # filter cutoff
-                    inst.patch.filt_f = ccval/127 * 8000
-
-        await asyncio.sleep(0.001)
+def patch_loaded(patch_num, patch):
+    print("sysex patch loaded:", patch_num, patch)
+    if patch is inst.patch:
+        inst.reload_patch()
+patch_sysex.on_patch = patch_loaded
+
+# play the instrument on all MIDI channels, within synthio's voice budget
+router = ChannelRouter()
+router.add(inst, channels=range(16))
+
+# follow external MIDI clock, wave mix LFO does one cycle per bar
+midi_clock = MidiClock()
+if not granular:
+    midi_clock.add_target(inst.set_wave_lfo_rate, beats=4)
+
+# arpeggiator plays the instrument from held notes, in time with MIDI clock if there is one
+arp = Arpeggiator(mode=arp_mode or UP)
+seq = Sequencer(inst, arp, bpm=arp_bpm, clock=midi_clock)
+if arp_mode is not None:
+    seq.start()
+
+
+def touch_morph(pad_num, pressure):
+    inst.patch.wave_morph = min(max(pressure, 0), touch_morph_range) / touch_morph_range
+
+def instrument_update():
+    if wave_morph_control == 'touch':
+        qts.check_touch_hold(touch_morph)
+    inst.update()
+
+def display_update():
+    wavedisp.display_update()
+    wavedisp.scope_update(inst.waveform)  # does nothing unless scope page is shown
+    wavedisp.refresh()  # only refreshes if changed, not too often, and synth isn't busy
+
+def midi_update():
+    patch_sysex.update()  # finish reading a long SysEx a bit at a time, don't wait for it
+    for midi_in in (midi_usb_in, midi_uart_in):
+        while msg := midi_in.receive():
+            if midi_in is midi_uart_in:
+                midi_usb_out.thru(msg)
+            handle_midi(midi_in, msg)
+    inst.flush()  # a chord from a MIDI keyboard starts all at once
+    midi_controller.update()
+    midi_usb_out.flush()
+
+def handle_midi(midi_in, msg):
+    if midi_clock.handle(msg):
+        pass
+    elif seq.playing and msg.type in (smolmidi.NOTE_ON, smolmidi.NOTE_OFF):
+        if msg.type == smolmidi.NOTE_ON and msg.data[1]:
+            arp.press(msg.data[0])
+        else:
+            arp.release(msg.data[0])
+    elif router.handle(msg):
+        wavedisp.dispman.busy()  # don't refresh display while notes start
+        qts.led.fill(0xff00ff if msg.type == smolmidi.NOTE_ON and msg.data[1] else 0)
+    elif msg.type == smolmidi.CC:
+        ccnum = msg.data[0]
+        ccval = msg.data[1]
+        qts.led.fill(ccval)
+        if ccnum == 71:  # "sound controller 1"
+            new_wave_mix = ccval/127
+            print("wave_mix:", new_wave_mix)
+            inst.patch.wave_mix = new_wave_mix
+        elif ccnum == 1: # mod wheel
+            inst.patch.wave_mix_lfo_amount = ccval/127 * 50
+            #inst.patch.wave_mix_lfo_rate = msg.value/127 * 5
+        elif ccnum == 74: # filter cutoff
+            inst.patch.filt_f = ccval/127 * 8000
+    elif msg.type == smolmidi.SYSEX:
+        patch_sysex.handle(midi_in)
+
+
+strums = []  # [time_ns, note] of strummed notes still to play
+pad_held = {}  # midi note -> how many pads hold it, chords on two pads can share notes
+
+def pad_notes(pad):
+    midi_note = touch_midi_notes[pad]
+    if touch_mode == 'note':
+        return (midi_note,)
+    return [midi_note + i for i in touch_chord]
+
+def play_note(midi_note):
+    held = pad_held.get(midi_note, 0)
+    pad_held[midi_note] = held + 1
+    if held:  # another pad's chord has it going already
+        return
+    if seq.playing:
+        arp.press(int(midi_note))
+    else:
+        router.note_on(0, midi_note)  # same voice budget as MIDI notes, steals the oldest past it
+    midi_usb_out.note_on(int(midi_note))
+
+def stop_note(midi_note):
+    held = pad_held.pop(midi_note, 0) - 1
+    if held > 0:  # another pad still holds it
+        pad_held[midi_note] = held
+        return
+    if seq.playing:
+        arp.release(int(midi_note))
+    else:
+        router.note_off(0, midi_note)
+    midi_usb_out.note_off(int(midi_note))
+
+def pad_notes_on(pad):
+    now = time.monotonic_ns()
+    for i,midi_note in enumerate(pad_notes(pad)):
+        if touch_mode == 'strum' and i > 0:
+            strums.append([now + int(i * strum_time * 1_000_000_000), midi_note])
+            strums.sort()  # other pads' strums may still be going
+        else:
+            play_note(midi_note)
+    inst.flush()
+
+def pad_notes_off(pad):
+    for midi_note in pad_notes(pad):
+        for s in strums:
+            if s[1] == midi_note:  # not strummed yet, don't bother
+                strums.remove(s)
+                break
+        else:
+            stop_note(midi_note)
+    inst.flush()
 
+def strum_update():
+    if not strums:
+        return
+    now = time.monotonic_ns()
+    while strums and strums[0][0] <= now:
+        play_note(strums.pop(0)[1])
+    inst.flush()
 
 async def input_handler():
 
     # fixme: put these in qtpy_synth.py? no I think they are part of this "app"
-    knob_mode = 0  # 0=frequency, 1=wavemix, 2=, 3=
+    knob_mode = 0  # which entry of knob_modes the knobs are editing
     key_held = False
     key_with_touch = False
-    knob_saves = [ (0,0) for _ in range(4) ]  # list of knob state pairs
-    param_saves = [ (0,0) for _ in range(4) ]  # list of param state pairs for knobs
+    key_hold_used = False  # key hold toggled the scope, so its release isn't a tap
+    knob_saves = [ (0,0) for _ in knob_modes ]  # list of knob state pairs
     knobA_pickup, knobB_pickup = False, False
     knobA, knobB = 0,0
 
-    def reload_patch(wave_select):
-        print("reload patch!", wave_select)
-        # the below seems like the wrong way to do this, needlessly complex
-        inst.patch.set_by_wave_select( wave_select )
-        inst.reload_patch()
-        param_saves[0] = wavedisp.wave_select_pos(), inst.patch.wave_mix
-        param_saves[1] = inst.patch.detune, inst.patch.wave_mix_lfo_amount
-        param_saves[2] = inst.patch.filt_type, inst.patch.filt_f
-        param_saves[3] = inst.patch.filt_q, inst.patch.filt_env_params.attack_time
-
     while True:
+        # wait for something to happen on the knobs, pads, or key
+        event = await qts.events.get()
+
         # KNOB input
-        (knobA_new, knobB_new) = qts.read_pots()
+        knobs_moved = event.type == KNOB
+        (knobA_new, knobB_new) = (qts.knobA, qts.knobB)
 
         # simple knob pickup logic: if the real knob is close enough to
         if abs(knobA - knobA_new) <= 1000:  # knobs range 0-65535
@@ -140,119 +291,92 @@ async def input_handler():
         if knobB_pickup:
             knobB = knobB_new
 
+        if midi_controller_mode and knobs_moved:
+            midi_controller.set(knob_ccs[0], knobA_new >> 9)  # 0-65535 -> 0-127
+            midi_controller.set(knob_ccs[1], knobB_new >> 9)
+
         # TOUCH input
-        if touches := qts.check_touch():
-            for touch in touches:
-
-                if touch.pressed:
-                    if key_held:  # load a patch
-                        print("load patch", touch.key_number)
-                        # disable this for now
-                        #inst.load_patch(patches[i])
-                        #qts.patch = patches[i]
-                        wavedisp.display_update()
-                        key_with_touch = True
-                    else:  # trigger a note
-                        qts.led.fill(0xff00ff)
-                        midi_note = touch_midi_notes[touch.key_number]
-                        inst.note_on(midi_note)
-
-                if touch.released:
-                    if key_with_touch:
-                        key_with_touch = False
-                    else:
-                        qts.led.fill(0)
-                        midi_note = touch_midi_notes[touch.key_number]
-                        inst.note_off(midi_note)
+        if event.type == TOUCH:
+            touch = event
+            if midi_controller_mode:
+                midi_controller.set(touch_ccs[touch.key_number], 127 if touch.pressed else 0)
+
+            if touch.pressed:
+                if key_held:  # load a patch
+                    print("load patch", touch.key_number)
+                    # disable this for now
+                    #inst.load_patch(patches[i])
+                    #qts.patch = patches[i]
+                    wavedisp.display_update()
+                    key_with_touch = True
+                else:  # trigger a note
+                    wavedisp.dispman.busy()
+                    qts.led.fill(0xff00ff)
+                    pad_notes_on(touch.key_number)
+
+            if touch.released:
+                if key_with_touch:
+                    key_with_touch = False
+                else:
+                    qts.led.fill(0)
+                    pad_notes_off(touch.key_number)
 
         # KEY input
-        if key := qts.check_key():
+        if event.type == KEY:
+            key = event
             if key.pressed:
                 key_held = True
             if key.released:
                 key_held = False
-                if not key_with_touch:  # key tap == change what knobs do
+                if key_hold_used:
+                    key_hold_used = False
+                elif not key_with_touch:  # key tap == change what knobs do
                     # turn off pickup mode since we change what knobs do
                     knobA_pickup, knobB_pickup = False, False
                     knob_saves[knob_mode] = knobA, knobB  # save knob positions
-                    knob_mode = (knob_mode + 1) % 4  # FIXME: make a max_knob_mode
+                    knob_mode = (knob_mode + 1) % len(knob_modes)
                     knobA, knobB = knob_saves[knob_mode] # retrive saved knob positions
                     print("knob mode:",knob_mode, knobA, knobB)
                     wavedisp.selected_info = knob_mode  # FIXME
 
-        # Handle parameter changes depending on knob mode
-        if knob_mode == 0:  # wave selection & wave_mix
-
-            wave_select_pos, wave_mix = param_saves[knob_mode]
+        # KEY held without touching pads == flip between params & scope pages
+        if event.type == KEY_HOLD and not key_with_touch:
+            key_hold_used = True
+            wavedisp.show_scope(not wavedisp.scope_shown)
 
+        # Handle parameter changes depending on knob mode, if knobs have moved
+        if knobs_moved:
+            paramA, paramB = knob_modes[knob_mode]
             if knobA_pickup:
-                wave_select_pos = map_range( knobA, 0,65535, 0, len(wavedisp.wave_selects)-1)
+                paramA.set_from_knob(inst.patch, knobA)
             if knobB_pickup:
-                wave_mix = map_range( knobB, 0,65535, 0, 1)
-
-            param_saves[knob_mode] = wave_select_pos, wave_mix
-
-            wave_select = wavedisp.wave_selects[ int(wave_select_pos) ]
-
-            if inst.patch.wave_select() != wave_select:
-                reload_patch(wave_select)
-
-            inst.patch.wave_mix = wave_mix
-
-        elif knob_mode == 1:  # osc detune & wave_mix lfo
-
-            detune, wave_lfo = param_saves[knob_mode]
-
-            if knobA_pickup:
-                detune  = map_range(knobA, 300,65300, 1, 1.1)  # RP2040 has bad ADC
-            if knobB_pickup:
-                wave_lfo = map_range(knobB, 0,65535, 0, 1)
-
-            param_saves[knob_mode] = detune, wave_lfo
-
-            inst.patch.wave_mix_lfo_amount = wave_lfo
-            inst.patch.detune = detune
-
-
-        elif knob_mode == 2: # filter type and filter freq
-            filt_type, filt_f = param_saves[knob_mode]
-
-            if knobA_pickup:
-                filt_type  = int(map_range(knobA, 0,65535, 0,3))
-            if knobB_pickup:
-                filt_f = map_range(knobB, 300,65300, 100, 8000)
-
-            param_saves[knob_mode] = filt_type, filt_f
-
-            inst.patch.filt_type = filt_type
-            inst.patch.filt_f = filt_f
-
-        elif knob_mode == 3:
-            filt_q, filt_env = param_saves[knob_mode]
-
-            if knobA_pickup:
-                filt_q  = map_range(knobA, 0,65535, 0.5,2.5)
-            if knobB_pickup:
-                filt_env = map_range(knobB, 300,65300, 1, 0.01)
-
-            param_saves[knob_mode] = filt_q, filt_env
-
-            inst.patch.filt_q = filt_q
-            inst.patch.filt_env_params.attack_time = filt_env
-
-        else:
-            pass
-
-        await asyncio.sleep(0.02)
+                paramB.set_from_knob(inst.patch, knobB)
 
 
 print("--- qtpy_synth wavesynth ready ---")
 
+# MIDI & instrument updates go first, display only gets what time is left over
+sched = Scheduler()
+sched.add(midi_update, period=0.001, priority=PRIO_HIGH, deadline=0.005)
+# in granular mode, instrument update is the grain timer, so it runs more often
+sched.add(instrument_update, period=0.002 if granular else 0.01, priority=PRIO_HIGH, deadline=0.005)
+sched.add(display_update, period=0.05, priority=PRIO_LOW, deadline=0.2)
+if arp_mode is not None:
+    def arp_update():
+        seq.update()
+        inst.flush()
+    sched.add(arp_update, period=0.001, priority=PRIO_HIGH, deadline=0.002)
+if touch_mode == 'strum':
+    sched.add(strum_update, period=0.002, priority=PRIO_HIGH, deadline=0.005)
+if print_sched_stats:
+    sched.add(sched.print_stats, period=5, priority=PRIO_LOW, name="stats")
+    if granular:
+        sched.add(inst.print_stats, period=5, priority=PRIO_LOW, name="grains")
+
 async def main():
-    task1 = asyncio.create_task(display_updater())
+    task1 = asyncio.create_task(sched.run())
     task2 = asyncio.create_task(input_handler())
-    task3 = asyncio.create_task(midi_handler())
-    task4 = asyncio.create_task(instrument_updater())
-    await asyncio.gather(task1, task2, task3, task4)
+    task3 = asyncio.create_task(qts.input_task())
+    await asyncio.gather(task1, task2, task3)
 
 asyncio.run(main())
@@ -2,11 +2,17 @@
 # 28 Jul 2023 - @todbot / Tod Kurt
 # part of https://github.com/todbot/qtpy_synth
 
-import os
 import displayio, terminalio, vectorio
+import bitmaptools
+import ulab.numpy as np
 from adafruit_display_text import bitmap_label as label
 
 from qtpy_synth.synthio_instrument import FiltType
+from wavesynth_params import Choice
+from qtpy_synth.display_manager import DisplayManager
+from qtpy_synth.numeric_field import NumericField
+
+SCOPE_W, SCOPE_H = 128, 32  # size of each scope trace, waveform on top, filter below
 
 # class WavesynthDisplay(displayio.Group):
 #     def __init__(self, display):
@@ -15,133 +21,140 @@ from qtpy_synth.synthio_instrument import FiltType
 #         self.display_setup()
 
 class WavesynthDisplay:
-    def __init__(self, display, patch):
+    def __init__(self, display, patch, knob_modes):
         self.display = display
+        self.dispman = DisplayManager(display)  # we say when display refreshes
         self.patch = patch
         self.selected_info = 0 # which part of the display is currently selected
-        self.update_wave_selects()
+        self.knob_modes = knob_modes  # what's shown on each line, see wavesynth_params.py
         self.display_setup()
         self.display_update()
         print("WavesynthDisplay:init: patch=",patch)
 
     def display_setup(self):
-        disp_group = displayio.Group()
-        self.display.root_group = disp_group
-
-        lwave_sel = label.Label(terminalio.FONT, text=self.patch.wave_select(), x=2, y=6)
-        lwave_mix = label.Label(terminalio.FONT, text=str(self.patch.wave_mix), x=80, y=6)
-
-        ldetune  = label.Label(terminalio.FONT, text="-", x=2, y=19)
-        lwave_lfo= label.Label(terminalio.FONT, text="-", x=75, y=19)
-
-        lfilt_type = label.Label(terminalio.FONT, text="-", x=2,y=32)
-        lfilt_f  = label.Label(terminalio.FONT, text="-", x=75,y=32)
-
-        lfilt_q  = label.Label(terminalio.FONT, text="-", x=2,y=45)
-        lfilt_env= label.Label(terminalio.FONT, text="-", x=70,y=45)
-
-        self.disp_line1 = displayio.Group()
-        for l in (lwave_sel, lwave_mix):
-            self.disp_line1.append(l)
-        disp_group.append(self.disp_line1)
-
-        self.disp_line2 = displayio.Group()
-        for l in (ldetune, lwave_lfo):
-            self.disp_line2.append(l)
-        disp_group.append(self.disp_line2)
-
-        self.disp_line3 = displayio.Group()
-        for l in (lfilt_type, lfilt_f):
-            self.disp_line3.append(l)
-        disp_group.append(self.disp_line3)
-
-        self.disp_line4 = displayio.Group()
-        for l in (lfilt_q, lfilt_env):
-            self.disp_line4.append(l)
-        disp_group.append(self.disp_line4)
+        root_group = displayio.Group()
+        self.display.root_group = root_group
+        disp_group = displayio.Group()  # the parameter page
+        root_group.append(disp_group)
+        self.params_group = disp_group
+        self.scope_setup(root_group)
+
+        # numbers are NumericFields so changing them only redraws changed digits,
+        # the text around them are Labels that don't change.
+        # one line per knob mode, knobA's param on the left, knobB's on the right
+        def text(t, x, y):  return label.Label(terminalio.FONT, text=t, x=x, y=y)
+        cw = 6  # terminalio.FONT character width
+
+        self.param_widgets = []  # (param, Label or NumericField) to update
+        for i,params in enumerate(self.knob_modes):
+            y = 6 + i*13
+            line = displayio.Group()
+            for j,param in enumerate(params):
+                if isinstance(param, Choice):
+                    widget = text(param.display_text(self.patch), 2 if j==0 else 70, y)
+                    line.append(widget)
+                else:
+                    nchars = len(param.name) + param.width + len(param.units)
+                    x = 2 if j==0 else 128 - cw*nchars - 2
+                    widget = NumericField(width=param.width, decimals=param.decimals,
+                                          x=x + cw*len(param.name), y=y)
+                    line.append(text(param.name, x, y))
+                    line.append(widget)
+                    if param.units:
+                        line.append(text(param.units, x + cw*(nchars - len(param.units)), y))
+                self.param_widgets.append((param, widget))
+            disp_group.append(line)
 
         # selection lines
         pal = displayio.Palette(1)
         pal[0] = 0xffffff
-        selectF = vectorio.Rectangle(pixel_shader=pal, width=128, height=1, x=0, y=6 + 8)
-        selectW = vectorio.Rectangle(pixel_shader=pal, width=128, height=1, x=0, y=19 + 8)
-        selectG = vectorio.Rectangle(pixel_shader=pal, width=128, height=1, x=0, y=32 + 8)
-        selectH = vectorio.Rectangle(pixel_shader=pal, width=128, height=1, x=0, y=45 + 8)
-
         self.disp_selects = displayio.Group()
-        for s in (selectF,selectW,selectG, selectH):
+        for i in range(len(self.knob_modes)):
+            s = vectorio.Rectangle(pixel_shader=pal, width=128, height=1, x=0, y=6 + i*13 + 8)
             s.hidden=True
             self.disp_selects.append(s)
         disp_group.append(self.disp_selects)
 
+    def scope_setup(self, root_group):
+        """Scope page: the current waveform and the filter's rough frequency response"""
+        self.scope_bitmap = displayio.Bitmap(SCOPE_W, SCOPE_H*2, 2)
+        pal = displayio.Palette(2)
+        pal[1] = 0xffffff
+        self.scope_group = displayio.Group()
+        self.scope_group.append(displayio.TileGrid(self.scope_bitmap, pixel_shader=pal))
+        self.scope_group.append(label.Label(terminalio.FONT, text="wave", x=100, y=4))
+        self.scope_group.append(label.Label(terminalio.FONT, text="filt", x=100, y=SCOPE_H+4))
+        self.scope_group.hidden = True
+        root_group.append(self.scope_group)
+        self.scope_xs = np.array(range(SCOPE_W), dtype=np.int16)
+        self.scope_wave_ys = np.zeros(SCOPE_W, dtype=np.int16)
+        self.scope_filt_ys = np.zeros(SCOPE_W, dtype=np.int16)
+        # filter response is drawn on a log frequency scale, 50 Hz - 10 kHz
+        self.scope_freqs = np.logspace(np.log10(50), np.log10(10000), SCOPE_W)
+        self._scope_filt = None  # (filt_type, filt_f, filt_q) last drawn
+
+    def show_scope(self, show):
+        self.params_group.hidden = show
+        self.scope_group.hidden = not show
+        self._scope_filt = None  # make sure it gets drawn
+        self.dispman.mark_dirty()
+
+    @property
+    def scope_shown(self):
+        return not self.scope_group.hidden
+
+    def scope_update(self, waveform):
+        """Redraw scope traces that have changed, does nothing if scope isn't shown"""
+        if self.scope_group.hidden:
+            return
+        # decimate waveform down to one sample per pixel column and scale it to trace height
+        step = max(1, len(waveform) // SCOPE_W)
+        ys = np.array(waveform[::step][:SCOPE_W] * (-(SCOPE_H/2 - 1) / 32768) + SCOPE_H/2,
+                      dtype=np.int16)
+        if self._scope_filt is None or np.any(ys != self.scope_wave_ys):
+            self.scope_wave_ys = ys
+            self._scope_draw(0, self.scope_wave_ys)
+
+        filt = (self.patch.filt_type, self.patch.filt_f, self.patch.filt_q)
+        if filt != self._scope_filt:
+            self._scope_filt = filt
+            self.scope_filt_ys = self._filter_response(*filt)
+            self._scope_draw(SCOPE_H, self.scope_filt_ys)
+
+    def _filter_response(self, filt_type, filt_f, filt_q):
+        """Approximate 2-pole filter response in dB, as trace y positions (+12 dB top, -24 dB bottom)"""
+        r2 = (self.scope_freqs / max(filt_f, 1)) ** 2
+        mag2 = 1 / ((1 - r2)**2 + r2 / (filt_q * filt_q))
+        if filt_type == FiltType.HP:
+            mag2 = mag2 * r2 * r2
+        elif filt_type == FiltType.BP:
+            mag2 = mag2 * r2 / (filt_q * filt_q)
+        db = np.clip(10 * np.log10(mag2), -24, 12)
+        return np.array((12 - db) * ((SCOPE_H - 1) / 36) + SCOPE_H, dtype=np.int16)
+
+    def _scope_draw(self, y, ys):
+        bitmaptools.fill_region(self.scope_bitmap, 0, y, SCOPE_W, y + SCOPE_H, 0)
+        bitmaptools.draw_polygon(self.scope_bitmap, self.scope_xs, ys, 1, close=False)
+        self.dispman.mark_dirty()
+
     def display_update(self):
         self.disp_select()
-        self.display_update_line1()
-        self.display_update_line2()
-        self.display_update_line3()
-        self.display_update_line4()
+        self.display_update_params()
+
+    def refresh(self):
+        """Refresh the display if something changed and it's a good time to"""
+        self.dispman.refresh()
 
     def disp_select(self):
-        for s in self.disp_selects:
-            s.hidden = True
-        self.disp_selects[self.selected_info].hidden = False
-
-    def display_update_line1(self):
-        wave_select = self.patch.wave_select()
-        wave_mix = "%.2f:mix" % self.patch.wave_mix
-
-        if self.disp_line1[0].text != wave_select:
-            self.disp_line1[0].text = wave_select
-        if self.disp_line1[1].text != wave_mix:
-            self.disp_line1[1].text = wave_mix
-
-    def display_update_line2(self):
-        detune = "detun:%1.3f" % self.patch.detune
-        wave_lfo = "%1.2f:wlfo" % self.patch.wave_mix_lfo_amount
-
-        if self.disp_line2[0].text != detune:
-            self.disp_line2[0].text = detune
-        if self.disp_line2[1].text != wave_lfo:
-            self.disp_line2[1].text = wave_lfo
-
-    def display_update_line3(self):
-        filt_type = "filter:"+FiltType.str(self.patch.filt_type)
-        filt_f = "freq:%1.1fk" % (self.patch.filt_f / 1000)
-
-        if self.disp_line3[0].text != filt_type:
-            self.disp_line3[0].text = filt_type
-        if self.disp_line3[1].text != filt_f:
-            self.disp_line3[1].text = filt_f
-
-    def display_update_line4(self):
-        filt_q = "filtq:%1.1f" % self.patch.filt_q
-        filt_env = "fenv:%1.2f" % self.patch.filt_env_params.attack_time
-
-        if self.disp_line4[0].text != filt_q:
-            self.disp_line4[0].text = filt_q
-        if self.disp_line4[1].text != filt_env:
-            print("!")
-            self.disp_line4[1].text = filt_env
-
-    # utility methods for dealing with these "wave_selects" I've gotten myself into
-
-    def update_wave_selects(self):   # fixme: why isn't this a Patch class method?
-        wave_selects = [
-            "osc:SAW/TRI",
-            "osc:SAW/SQU",
-            "osc:SAW/SIN",
-            "osc:SQU/SIN"
-        ]
-        # fixme: check for bad/none dir_path
-        for path in os.listdir(self.patch.wave_dir):
-            path = path.upper()
-            if path.endswith('.WAV') and not path.startswith('.'):
-                wave_selects.append("wtb:"+path.replace('.WAV',''))
-        self.wave_selects = wave_selects
-
-    def wave_select_pos(self):
-        print("wave_select_pos:",self.patch.wave_select())
-        return self.wave_selects.index( self.patch.wave_select() ) # fixme: this seems wrong
-
-    def wave_select(self):
-        return self.patch.wave_select()
+        for i,s in enumerate(self.disp_selects):
+            hidden = i != self.selected_info
+            if s.hidden != hidden:
+                s.hidden = hidden
+                self.dispman.mark_dirty()
+
+    def display_update_params(self):
+        for param, widget in self.param_widgets:
+            if isinstance(param, Choice):
+                self.dispman.set_text(widget, param.display_text(self.patch))
+            else:
+                self.dispman.set_value(widget, param.display_value(self.patch))
@@ -0,0 +1,144 @@
+# wavesynth_params.py -- what the knobs edit in wavesynth, as tables
+# part of https://github.com/todbot/qtpy_synth
+#
+# Each editable patch parameter is described once here: its display name,
+# which patch attribute it is, its range & curve, and how to show it. A knob
+# mode is just a pair of these (knobA, knobB), and both the input loop and
+# WavesynthDisplay work from that table, so adding a parameter is one line.
+#
+# Knob-to-value scaling is worked out up front into a lookup table indexed
+# by the knob position >> 8, so turning a knob is a table lookup, not math.
+
+import os
+import math
+from array import array
+
+from qtpy_synth.synthio_instrument import FiltType
+
+LIN = 0  # straight line from lo to hi
+EXP = 1  # equal ratios per knob step, good for frequencies & times
+
+KNOB_SHIFT = 8  # knob 0-65535 -> table index 0-255
+TABLE_SIZE = 65536 >> KNOB_SHIFT
+
+class Param:
+    """A number parameter, shown in a NumericField"""
+    def __init__(self, name, attr, lo, hi, curve=LIN, width=4, decimals=2, scale=1, units="",
+                 knob_lo=0, knob_hi=65535):
+        """
+        name -- label shown on display
+        attr -- patch attribute, can be dotted like "filt_env_params.attack_time"
+        lo,hi -- values at the knob ends, hi can be less than lo to go backwards
+        curve -- LIN or EXP
+        width,decimals -- NumericField format, value is multiplied by scale before showing
+        units -- shown after the value
+        knob_lo,knob_hi -- knob range used, the RP2040 ADC doesn't quite reach the ends
+        """
+        self.name = name
+        self.attr = attr.split('.')
+        self.width = width
+        self.decimals = decimals
+        self.scale = scale
+        self.units = units
+        self.table = array('f', [0] * TABLE_SIZE)
+        for i in range(TABLE_SIZE):
+            knob = i * 65535 // (TABLE_SIZE - 1)  # so the ends reach lo & hi
+            t = min(max((knob - knob_lo) / (knob_hi - knob_lo), 0), 1)
+            if curve == EXP:
+                self.table[i] = lo * math.pow(hi / lo, t)
+            else:
+                self.table[i] = lo + t * (hi - lo)
+
+    def _owner(self, patch):
+        for a in self.attr[:-1]:
+            patch = getattr(patch, a)
+        return patch
+
+    def get(self, patch):
+        return getattr(self._owner(patch), self.attr[-1])
+
+    def set(self, patch, val):
+        setattr(self._owner(patch), self.attr[-1], val)
+
+    def set_from_knob(self, patch, knob):
+        self.set(patch, self.table[knob >> KNOB_SHIFT])
+
+    def display_value(self, patch):
+        return self.get(patch) * self.scale
+
+
+class Choice:
+    """A parameter picked from a list, shown as text"""
+    def __init__(self, name, attr, values, names=None, getter=None, setter=None):
+        """
+        name -- label shown in front of the choice, can be ""
+        attr -- patch attribute, or None if getter & setter are given
+        values -- what the knob chooses between
+        names -- how to show each value, defaults to the values themselves
+        getter,setter -- func(patch) and func(patch,val) to use instead of attr
+        """
+        self.name = name
+        self.attr = attr
+        self.values = values
+        self.names = names or values
+        self.getter = getter
+        self.setter = setter
+
+    def get(self, patch):
+        return self.getter(patch) if self.getter else getattr(patch, self.attr)
+
+    def set(self, patch, val):
+        if self.get(patch) == val:
+            return
+        if self.setter:
+            self.setter(patch, val)
+        else:
+            setattr(patch, self.attr, val)
+
+    def set_from_knob(self, patch, knob):
+        self.set(patch, self.values[(knob * len(self.values)) >> 16])
+
+    def display_text(self, patch):
+        val = self.get(patch)
+        name = self.names[self.values.index(val)] if val in self.values else str(val)
+        return self.name + name
+
+
+def find_wave_selects(wave_dir):
+    """The built-in oscillator pairs plus every wavetable in wave_dir"""
+    wave_selects = [
+        "osc:SAW/TRI",
+        "osc:SAW/SQU",
+        "osc:SAW/SIN",
+        "osc:SQU/SIN",
+        "osc:USR0",  # the wave a desktop editor loads over SysEx
+    ]
+    # fixme: check for bad/none dir_path
+    for path in os.listdir(wave_dir):
+        path = path.upper()
+        if path.endswith('.WAV') and not path.startswith('.'):
+            wave_selects.append("wtb:"+path.replace('.WAV',''))
+    return wave_selects
+
+
+def make_knob_modes(wave_selects, select_wave, morph_knob=False):
+    """
+    Knob modes in the order the key steps through them, each is (knobA param, knobB param).
+    select_wave -- func(patch, wave_select) that loads a new wave selection
+    morph_knob -- knobB on line 2 moves along the 2nd wavetable axis instead of wlfo
+    """
+    if morph_knob:
+        line2B = Param("morph:", "wave_morph", 0, 1)
+    else:
+        line2B = Param("wlfo:", "wave_mix_lfo_amount", 0, 1, width=5)  # CC1 & patches go up to 50
+    return (
+        (Choice("", None, wave_selects, getter=lambda p: p.wave_select(), setter=select_wave),
+         Param("mix:", "wave_mix", 0, 1)),
+        (Param("detun:", "detune", 1, 1.1, width=5, decimals=3, knob_lo=300, knob_hi=65300),
+         line2B),
+        (Choice("filter:", "filt_type", (FiltType.LP, FiltType.HP, FiltType.BP), ("LP", "HP", "BP")),
+         Param("freq:", "filt_f", 100, 8000, curve=EXP, width=3, decimals=1, scale=1/1000,
+               units="k", knob_lo=300, knob_hi=65300)),
+        (Param("filtq:", "filt_q", 0.5, 2.5, width=3, decimals=1),
+         Param("fenv:", "filt_env_params.attack_time", 1, 0.01, knob_lo=300, knob_hi=65300)),
+    )